@@ -0,0 +1,43 @@
+import json
+import statistics
+import subprocess
+import sys
+
+# python -X importtime -c "import wechat", a few times, with the median
+# cumulative time of wechat and of the heaviest imports under it, in ms.
+
+RUNS = 9
+
+
+def importtime(module):
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+
+    # "import time:  self [us] | cumulative | imported package"
+    res = {}
+    for line in stderr.splitlines()[1:]:
+        if not line.startswith("import time:"):
+            continue
+
+        self_us, cumulative, name = line.removeprefix("import time:").split("|")
+        res[name.strip()] = int(cumulative) / 1000
+
+    return res
+
+
+def main():
+    runs = [importtime("wechat") for _ in range(RUNS)]
+
+    names = set.intersection(*(set(x) for x in runs))
+    medians = {name: statistics.median(x[name] for x in runs) for name in names}
+    heaviest = sorted(medians, key=medians.get, reverse=True)[:10]
+
+    print(json.dumps({name: round(medians[name], 1) for name in heaviest}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
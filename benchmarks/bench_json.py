@@ -0,0 +1,33 @@
+import timeit
+
+from benchmarks import payloads
+from wechat import utils
+
+
+def main():
+    docs = {
+        "webwxgetcontact": {
+            "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "MemberCount": 5000,
+            "MemberList": payloads.contacts(5000, rooms=50, members=200),
+            "Seq": 0,
+        },
+        "webwxsync": payloads.sync(100),
+    }
+
+    for name in utils.JSON_BACKENDS:
+        utils.set_json_backend(name)
+
+        for doc_name, doc in docs.items():
+            data = utils.dumps(doc)
+
+            loads = min(timeit.repeat(lambda: utils.loads(data), number=1, repeat=5))
+            dumps = min(timeit.repeat(lambda: utils.dumps(doc), number=1, repeat=5))
+            print(
+                f"{name} {doc_name} ({len(data) / 2**20:.1f} MiB): "
+                f"loads {loads * 1000:.1f} ms, dumps {dumps * 1000:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
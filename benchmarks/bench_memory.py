@@ -0,0 +1,27 @@
+import json
+import tracemalloc
+
+import wechat
+from benchmarks import payloads
+
+
+def main():
+    # Round-trip through JSON so that, as with a real response, every
+    # string is its own object.
+    contacts = json.loads(json.dumps(payloads.contacts(20_000, rooms=200, members=500)))
+    members = sum(len(x["MemberList"]) for x in contacts)
+
+    client = wechat.Client()
+    client.set_user_info({"UserName": payloads.user_name()})
+
+    tracemalloc.start()
+    client.add_contacts(contacts)
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(contacts)} contacts, {members} members")
+    print(f"{size / 2**20:.1f} MiB, {size / (len(contacts) + members):.0f} B/record")
+
+
+if __name__ == "__main__":
+    main()
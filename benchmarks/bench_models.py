@@ -0,0 +1,48 @@
+import timeit
+import typing
+
+from benchmarks import payloads
+from wechat import models, utils
+
+
+def update_reflective(self, d):
+    # models.Base.update before the decoders were precompiled.
+    for key, value in d.items():
+        key = utils.to_snake(key)
+
+        if key in self.hints:
+            typ = self.hints[key]
+
+            if typing.get_origin(typ) is list:
+                args = typing.get_args(typ)
+                if args:
+                    value = list(map(args[0], value))
+            else:
+                value = typ(value)
+
+            setattr(self, key, value)
+
+
+class ReflectiveMember(models.Member):
+    __init__ = update = update_reflective
+
+
+class ReflectiveContact(models.Contact):
+    __init__ = update = update_reflective
+
+    member_list = None
+
+
+ReflectiveContact.hints["member_list"] = list[ReflectiveMember]
+
+
+def main():
+    contacts = payloads.contacts(50_000, rooms=500, members=100)
+
+    for cls in ReflectiveContact, models.Contact:
+        t = min(timeit.repeat(lambda: list(map(cls, contacts)), number=1, repeat=3))
+        print(f"{cls.__name__}: {t:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
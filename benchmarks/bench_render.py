@@ -0,0 +1,48 @@
+import re
+import timeit
+
+from benchmarks import payloads
+from wechat import utils
+
+
+def render_regex(s):
+    # utils.render before the emoji table.
+    def repl(m):
+        code = m[1]
+
+        if utils.is_keycap(code):
+            return utils.hexchr(code[:2]) + "️⃣"
+        if utils.is_flag(code):
+            return utils.hexchr(code[:5]) + utils.hexchr(code[5:])
+
+        return utils.hexchr(code)
+
+    s = s.replace("<br/>", "\n")
+    return re.sub('<span class="emoji emoji(.*?)"></span>', repl, s)
+
+
+def main():
+    members = [payloads.user_name() for _ in range(50)]
+
+    traffic = {
+        "direct": [payloads.word() for _ in range(10_000)],
+        "group": [payloads.group_text(members[i % 50], 0) for i in range(10_000)],
+        "group+emoji": [
+            payloads.group_text(members[i % 50], 0.5) for i in range(10_000)
+        ],
+    }
+
+    for kind, msgs in traffic.items():
+        assert utils.render_all(msgs) == list(map(render_regex, msgs))
+
+        for name, f in (
+            ("regex", lambda: list(map(render_regex, msgs))),
+            ("table", lambda: list(map(utils.render, msgs))),
+            ("batch", lambda: utils.render_all(msgs)),
+        ):
+            t = min(timeit.repeat(f, number=1, repeat=5))
+            print(f"{kind} {name}: {len(msgs) / t:,.0f} msgs/s")
+
+
+if __name__ == "__main__":
+    main()
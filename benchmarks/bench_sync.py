@@ -0,0 +1,49 @@
+import contextlib
+import io
+import threading
+import time
+
+import wechat
+from wechat import pipeline
+from wechat.fakeserver import FakeServer
+
+# Sync-loop throughput against wechat.fakeserver, with a handler that takes
+# a millisecond, for a few pipeline sizes.
+
+RATE = 2000
+DURATION = 3
+
+
+def main():
+    for workers in 1, 4, 16:
+        with FakeServer(rooms=50, rate=RATE, poll_timeout=1) as server:
+            client = wechat.Client(**server.urls())
+
+            with contextlib.redirect_stdout(io.StringIO()):  # the QR code
+                msgs = client.login()
+
+            handled = 0
+            lock = threading.Lock()
+
+            def handler(msg):
+                nonlocal handled
+
+                time.sleep(0.001)
+                with lock:
+                    handled += 1
+
+            p = pipeline.Pipeline(handler, client=client, workers=workers)
+            p.start(msgs)
+            time.sleep(DURATION)
+            p.stop()
+
+            latency = client.metrics.snapshot()["latency"]["webwxsync"]
+            print(
+                f"{workers} workers: {handled / DURATION:,.0f} msgs/s handled, "
+                f"{latency['count']} webwxsync, "
+                f"{latency['sum'] / latency['count'] * 1000:.1f} ms each"
+            )
+
+
+if __name__ == "__main__":
+    main()
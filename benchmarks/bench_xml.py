@@ -0,0 +1,22 @@
+import timeit
+
+from benchmarks import payloads
+from wechat import utils
+
+
+def main():
+    docs = [payloads.appmsg() for _ in range(500)] + [
+        payloads.emoticon() for _ in range(500)
+    ]
+
+    for name in utils.XML_BACKENDS:
+        utils.set_xml_backend(name)
+
+        t = min(
+            timeit.repeat(lambda: list(map(utils.parse_xml, docs)), number=1, repeat=5)
+        )
+        print(f"{name}: {len(docs) / t:,.0f} docs/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import random
+import string
+from xml.sax.saxutils import escape
+
+
+def user_name(room=False):
+    return ("@@" if room else "@") + "".join(random.choices("0123456789abcdef", k=64))
+
+
+def member(name=None):
+    return {
+        "UserName": name or user_name(),
+        "NickName": "".join(random.choices(string.ascii_lowercase, k=8)),
+        "AttrStatus": random.randrange(1 << 25),
+        "MemberStatus": 0,
+        "DisplayName": "",
+        "KeyWord": "",
+    }
+
+
+def contact(room=False, members=0, pool=None):
+    name = user_name(room)
+
+    if pool:
+        member_list = [member(x) for x in random.sample(pool, members)]
+    else:
+        member_list = [member() for _ in range(members)]
+
+    return {
+        "UserName": name,
+        "NickName": "".join(random.choices(string.ascii_lowercase, k=8)),
+        "HeadImgUrl": f"/cgi-bin/mmwebwx-bin/webwxgeticon?username={name}",
+        "ContactFlag": 3,
+        "MemberCount": members,
+        "MemberList": member_list,
+        "RemarkName": "",
+        "Sex": random.randrange(3),
+        "Signature": "Because painting suffer store structure sign expect.",
+        "VerifyFlag": 0,
+        "StarFriend": 0,
+        "Statues": 0,
+        "AttrStatus": random.randrange(1 << 25),
+        "Province": "",
+        "City": "",
+        "SnsFlag": 257,
+        "DisplayName": "",
+        "KeyWord": "",
+        "EncryChatRoomId": "@" + user_name()[1:33] if room else "",
+        "IsOwner": 0,
+    }
+
+
+def contacts(n, rooms=0, members=0):
+    # Room members are drawn from the account's own contacts, as they are
+    # in practice, so the same user names show up in many rooms.
+    res = [contact() for _ in range(n - rooms)]
+    pool = [x["UserName"] for x in res]
+
+    return res + [contact(room=True, members=members, pool=pool) for _ in range(rooms)]
+
+
+def appmsg(items=8):
+    # An official-account article push, the heaviest app message.
+    articles = "".join(
+        f"<item><itemshowtype>0</itemshowtype><title><![CDATA[{word()} {word()}]]>"
+        f"</title><url><![CDATA[https://mp.weixin.qq.com/s?__biz={word()}&mid={i}]]>"
+        f"</url><cover><![CDATA[https://mmbiz.qpic.cn/{word()}/0]]></cover>"
+        f"<digest><![CDATA[{' '.join(word() for _ in range(20))}]]></digest>"
+        f"<pub_time>1711670660</pub_time></item>"
+        for i in range(items)
+    )
+
+    return (
+        '<?xml version="1.0"?>\n<msg><appmsg appid="" sdkver="0">'
+        f"<title><![CDATA[{word()}]]></title><des><![CDATA[{word()}]]></des>"
+        "<type>5</type><url></url><mmreader>"
+        f'<category type="20" count="{items}"><name><![CDATA[{word()}]]></name>'
+        f"{articles}</category></mmreader></appmsg>"
+        f"<fromusername>{user_name()}</fromusername></msg>"
+    )
+
+
+def emoticon():
+    return (
+        f'<msg><emoji fromusername="{user_name()}" tousername="{user_name()}" '
+        'type="2" md5="e7bd5f1a" len="94221" productid="" androidmd5="e7bd5f1a" '
+        'cdnurl="http://emoji.qpic.cn/wx_emoji/abc/" width="240" height="240"/>'
+        '<gameext type="0" content="0"></gameext></msg>'
+    )
+
+
+def word():
+    return "".join(random.choices(string.ascii_lowercase, k=random.randrange(3, 10)))
+
+
+EMOJI = ["1f604", "1f602", "1f64f", "2764", "1f44d", "3120e3", "1f1e81f1f3"]
+
+
+def group_text(user_name, emoji=0.5):
+    # A room message as webwxsync sends it, with about `emoji` spans per
+    # word.
+    parts = [f"{user_name}:<br/>"]
+
+    for _ in range(random.randrange(1, 20)):
+        parts.append(word() + " ")
+
+        if random.random() < emoji:
+            parts.append(f'<span class="emoji emoji{random.choice(EMOJI)}"></span>')
+
+    return "".join(parts)
+
+
+OK = {"Ret": 0, "ErrMsg": ""}
+
+
+def sync_key():
+    keys = [{"Key": k, "Val": random.randrange(1 << 30)} for k in (1, 2, 3, 1000)]
+
+    return {"Count": len(keys), "List": keys}
+
+
+def init(user, chats):
+    # webwxinit: the user and the recent chats.
+    return {
+        "BaseResponse": OK,
+        "Count": len(chats),
+        "ContactList": chats,
+        "SyncKey": sync_key(),
+        "User": {**user, "Uin": 1217252163, "SnsFlag": 1},
+        "ChatSet": ",".join(x["UserName"] for x in chats),
+    }
+
+
+def get_contact(contacts, seq, page=1000):
+    # A page of webwxgetcontact, which lists rooms without their members.
+    members = [
+        {**x, "MemberList": []} if x["UserName"].startswith("@@") else x
+        for x in contacts[seq : seq + page]
+    ]
+    seq += page
+
+    return {
+        "BaseResponse": OK,
+        "MemberCount": len(members),
+        "MemberList": members,
+        "Seq": seq if seq < len(contacts) else 0,
+    }
+
+
+def batch_get_contact(contacts):
+    return {"BaseResponse": OK, "Count": len(contacts), "ContactList": contacts}
+
+
+# Message types by share of the traffic.
+MIX = {1: 70, 3: 10, 34: 5, 47: 5, 49: 10}
+
+
+def content(msg_type, sender, emoji=0.5):
+    # What a room message of msg_type looks like in AddMsgList.
+    prefix = f"{sender}:<br/>"
+
+    if msg_type == 1:
+        return group_text(sender, emoji)
+    if msg_type == 47:
+        return prefix + escape(emoticon())
+    if msg_type == 49:
+        return prefix + escape(appmsg())
+
+    # Images, voice and videos: what matters is downloaded separately.
+    return prefix + escape(f'<msg><img length="{random.randrange(1 << 20)}"/></msg>')
+
+
+def sync(n, rooms=20, mix=None, emoji=0.5):
+    # A webwxsync response with n room messages, MsgTypes drawn from mix.
+    room_names = [user_name(room=True) for _ in range(rooms)]
+
+    mix = mix or MIX
+    msg_types = random.choices(list(mix), weights=list(mix.values()), k=n)
+
+    msgs = []
+    for i, msg_type in enumerate(msg_types):
+        room = random.choice(room_names)
+        msgs.append(
+            {
+                "MsgId": str(random.randrange(1 << 63)),
+                "FromUserName": room,
+                "ToUserName": user_name(),
+                "MsgType": msg_type,
+                "Content": content(msg_type, user_name(), emoji),
+                "Status": 3,
+                "ImgStatus": 1,
+                "CreateTime": 1711670660 + i,
+                "VoiceLength": 0,
+                "PlayLength": 0,
+                "FileName": "",
+                "FileSize": "",
+                "MediaId": "",
+                "Url": "",
+                "AppMsgType": 5 if msg_type == 49 else 0,
+                "StatusNotifyCode": 0,
+                "StatusNotifyUserName": "",
+                "ForwardFlag": 0,
+                "AppInfo": {"AppID": "", "Type": 0},
+                "HasProductId": 0,
+                "Ticket": "",
+                "ImgHeight": 0,
+                "ImgWidth": 0,
+                "SubMsgType": 0,
+                "NewMsgId": random.randrange(1 << 63),
+                "OriContent": "",
+            }
+        )
+
+    return {
+        "BaseResponse": OK,
+        "AddMsgCount": n,
+        "AddMsgList": msgs,
+        "ModContactCount": 0,
+        "ModContactList": [],
+        "DelContactCount": 0,
+        "DelContactList": [],
+        "ModChatRoomMemberCount": 0,
+        "ModChatRoomMemberList": [],
+        "Profile": {},
+        "ContinueFlag": 0,
+        "SyncKey": sync_key(),
+        "SKey": "",
+        "SyncCheckKey": sync_key(),
+    }
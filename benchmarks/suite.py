@@ -0,0 +1,286 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import timeit
+import tracemalloc
+from xml.sax.saxutils import unescape
+
+import responses
+
+import wechat
+from benchmarks import payloads
+from wechat import utils
+
+# Runs every benchmark on synthetic payloads of the given scale, and writes
+# the results as JSON, so that two commits can be compared:
+#
+#     python -m benchmarks.suite --output before.json
+#     git checkout ...
+#     python -m benchmarks.suite --output after.json
+#     python -m benchmarks.suite --compare before.json after.json
+
+
+def parse_mix(s):
+    # "1=70,3=10,49=20" -> {1: 70, 3: 10, 49: 20}
+    return {int(k): float(v) for k, v in (x.split("=") for x in s.split(","))}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite")
+    parser.add_argument("--contacts", type=int, default=5000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--msgs", type=int, default=100, help="messages per sync")
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=payloads.MIX,
+        help="MsgType=weight,... (default: %(default)s)",
+    )
+    parser.add_argument("--emoji", type=float, default=0.5, help="emoji per word")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="where to write the JSON, else stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown that --compare fails on (default: %(default)s)",
+    )
+
+    return parser.parse_args(argv)
+
+
+class Data:
+    def __init__(self, args):
+        payloads.random.seed(args.seed)
+
+        self.user = payloads.contact()
+        self.contacts = payloads.contacts(
+            args.contacts, rooms=args.rooms, members=args.members
+        )
+        self.rooms = {x["UserName"]: x for x in self.contacts if x["MemberList"]}
+
+        chats = self.contacts[:10] + list(self.rooms.values())[:10]
+        self.init = payloads.init(self.user, chats)
+        self.sync = payloads.sync(
+            args.msgs, rooms=min(args.rooms, 20) or 1, mix=args.mix, emoji=args.emoji
+        )
+
+        msgs = self.sync["AddMsgList"]
+        self.texts = [x["Content"] for x in msgs if x["MsgType"] == 1]
+        self.docs = [
+            unescape(utils.render(x["Content"]).partition(":\n")[2])
+            for x in msgs
+            if x["MsgType"] in (47, 49)
+        ]
+
+
+def mock_login(mock, data):
+    # Just enough of the server for Client.login to get through init.
+    uuid = "4aDCd-Nv9g=="
+    redirect_uri = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxnewloginpage?ticket=0"
+
+    mock.get(
+        "https://login.wx2.qq.com/jslogin?appid=wx782c26e4c19acffb",
+        body=f'window.QRLogin.code = 200; window.QRLogin.uuid = "{uuid}"',
+    )
+    mock.get(
+        f"https://login.wx2.qq.com/cgi-bin/mmwebwx-bin/login?uuid={uuid}",
+        body=f'window.code=200;\nwindow.redirect_uri="{redirect_uri}";',
+    )
+    mock.get(
+        redirect_uri,
+        body="<error><wxsid>3jFaxE9UDfEa8H+U</wxsid><wxuin>1217252163</wxuin></error>",
+        status=301,
+    )
+    mock.post("https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxinit", json=data.init)
+    mock.post(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxstatusnotify",
+        json={"BaseResponse": payloads.OK, "MsgID": "1"},
+    )
+
+    seq = 0
+    while True:
+        page = payloads.get_contact(data.contacts, seq)
+        mock.get(
+            f"https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetcontact?seq={seq}",
+            json=page,
+        )
+
+        seq = page["Seq"]
+        if seq == 0:
+            break
+
+    def batch_get_contact(request):
+        users = json.loads(request.body)["List"]
+        content = payloads.batch_get_contact(
+            [data.rooms[x["UserName"]] for x in users if x["UserName"] in data.rooms]
+        )
+
+        return 200, {}, json.dumps(content)
+
+    mock.add_callback(
+        "POST",
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
+        batch_get_contact,
+    )
+
+
+def logged_in_client(data):
+    client = wechat.Client()
+    client.set_user_info(data.user)
+
+    return client
+
+
+def bench_login_init(data):
+    def login():
+        client = wechat.Client()
+
+        with contextlib.redirect_stdout(io.StringIO()):  # the QR code
+            client.login()
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as mock:
+        mock_login(mock, data)
+        yield "login_init", 1, login
+
+
+def bench_add_contacts(data):
+    # Round-tripped through JSON, so that, as with a response, every string
+    # is its own object.
+    contacts = json.loads(json.dumps(data.contacts))
+
+    def add_contacts():
+        logged_in_client(data).add_contacts(contacts)
+
+    yield "add_contacts", len(contacts), add_contacts
+
+
+def bench_process_msgs(data):
+    client = logged_in_client(data)
+    msgs = data.sync["AddMsgList"]
+
+    yield "process_msgs", len(msgs), lambda: client.process_msgs(msgs)
+
+
+def bench_render(data):
+    yield "render", len(data.texts), lambda: utils.render_all(data.texts)
+
+
+def bench_parse_xml(data):
+    yield "parse_xml", len(data.docs), lambda: list(map(utils.parse_xml, data.docs))
+
+
+BENCHMARKS = [
+    bench_login_init,
+    bench_add_contacts,
+    bench_process_msgs,
+    bench_render,
+    bench_parse_xml,
+]
+
+
+def memory_per_contact(data):
+    contacts = json.loads(json.dumps(data.contacts))
+    records = len(contacts) + sum(len(x["MemberList"]) for x in contacts)
+
+    client = logged_in_client(data)
+
+    tracemalloc.start()
+    client.add_contacts(contacts)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {"bytes": size, "records": records, "bytes_per_record": size / records}
+
+
+def run(args):
+    data = Data(args)
+
+    results = {}
+    for bench in BENCHMARKS:
+        for name, n, f in bench(data):
+            # Enough calls per repeat for a fast one to be measurable.
+            timer = timeit.Timer(f)
+            number = timer.autorange()[0]
+            seconds = min(timer.repeat(args.repeat, number)) / number
+
+            results[name] = {"n": n, "seconds": seconds, "per_second": n / seconds}
+
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "params": {
+            k: v
+            for k, v in vars(args).items()
+            if k not in ("output", "compare", "threshold")
+        },
+        "results": results,
+        "memory": memory_per_contact(data),
+    }
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(before, after, threshold):
+    # Prints the change of each result, and returns whether any got slower
+    # by more than threshold.
+    slower = False
+
+    changes = {
+        name: after["results"][name]["seconds"] / x["seconds"] - 1
+        for name, x in before["results"].items()
+        if name in after["results"]
+    }
+    changes["bytes_per_record"] = (
+        after["memory"]["bytes_per_record"] / before["memory"]["bytes_per_record"] - 1
+    )
+
+    for name, change in changes.items():
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            slower = True
+
+        print(f"{name:20} {change:+7.1%}{flag}")
+
+    return slower
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.compare:
+        before, after = (json.load(open(path)) for path in args.compare)
+        if before["params"] != after["params"]:
+            print("warning: the runs were at different scales", file=sys.stderr)
+
+        sys.exit(compare(before, after, args.threshold))
+
+    res = json.dumps(run(args), indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(res)
+    else:
+        print(res)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,31 +11,50 @@ def response_mock():
 
 
 @pytest.fixture(autouse=True)
-def msgs(response_mock):
+def client(response_mock, monkeypatch):
+    client = wechat.Client()
+    monkeypatch.setattr(wechat, "client", client)
+
+    return client
+
+
+@pytest.fixture(autouse=True)
+def msgs(client, response_mock):
+    add_login_responses(response_mock.add)
+
+    return client.login()
+
+
+def add_login_responses(add):
     uuid = "4aDCd-Nv9g=="
     redirect_uri = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxnewloginpage?ticket=Awgd0-v_fqfwMrdXcthYCYeK@qrticket_0"
 
     sid = "3jFaxE9UDfEa8H+U"
     uin = 1217252163
 
-    response_mock.get(
+    add(
+        "GET",
         "https://login.wx2.qq.com/jslogin?appid=wx782c26e4c19acffb",
         body=f'window.QRLogin.code = 200; window.QRLogin.uuid = "{uuid}"',
     )
-    response_mock.get(
+    add(
+        "GET",
         f"https://login.wx2.qq.com/cgi-bin/mmwebwx-bin/login?uuid={uuid}",
         body="window.code=201;",
     )
-    response_mock.get(
+    add(
+        "GET",
         f"https://login.wx2.qq.com/cgi-bin/mmwebwx-bin/login?uuid={uuid}",
         body=f'window.code=200;\nwindow.redirect_uri="{redirect_uri}";',
     )
-    response_mock.get(
+    add(
+        "GET",
         redirect_uri,
         body=f"<error><wxsid>{sid}</wxsid><wxuin>{uin}</wxuin></error>",
         status=301,
     )
-    response_mock.post(
+    add(
+        "POST",
         "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxinit",
         json={
             "BaseResponse": {"Ret": 0, "ErrMsg": ""},
@@ -83,11 +102,13 @@ def msgs(response_mock):
             "ChatSet": "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0,",
         },
     )
-    response_mock.post(
+    add(
+        "POST",
         "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxstatusnotify",
         json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MsgID": "2518347772561648129"},
     )
-    response_mock.get(
+    add(
+        "GET",
         "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetcontact?seq=0",
         json={
             "BaseResponse": {"Ret": 0, "ErrMsg": ""},
@@ -117,7 +138,8 @@ def msgs(response_mock):
             "Seq": 0,
         },
     )
-    response_mock.post(
+    add(
+        "POST",
         "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
         json={
             "BaseResponse": {"Ret": 0, "ErrMsg": ""},
@@ -217,5 +239,3 @@ def msgs(response_mock):
             ],
         },
     )
-
-    return wechat.login()
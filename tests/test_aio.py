@@ -0,0 +1,238 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aioresponses import aioresponses
+
+import wechat
+from tests.conftest import add_login_responses
+from wechat import aio, consts, models
+from wechat.fakeserver import PATTERN, FakeServer
+
+
+@pytest.fixture
+def aio_mock():
+    with aioresponses() as mock:
+        yield mock
+
+
+@pytest.fixture
+def runner():
+    with asyncio.Runner() as runner:
+        yield runner
+
+        runner.run(aio.close())
+
+
+@pytest.fixture
+def aio_client(aio_mock, runner):
+    add_login_responses(
+        lambda method, url, json=None, **kwargs: aio_mock.add(
+            url, method, payload=json, **kwargs
+        )
+    )
+
+    client = aio.AsyncClient()
+    runner.run(client.login())
+    yield client
+
+    runner.run(client.close())
+
+
+@pytest.fixture
+def server():
+    with FakeServer(
+        contacts=20, rooms=3, members=5, rate=0, poll_timeout=0.2, media_size=2500
+    ) as server:
+        yield server
+
+
+@pytest.fixture
+def fake_client(server, runner):
+    client = aio.AsyncClient(**server.urls())
+    client.msgs = runner.run(client.login())
+    yield client
+
+    runner.run(client.close())
+
+
+def test_send(aio_client, aio_mock, runner):
+    aio_mock.post(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsg",
+        payload={
+            "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "MsgID": "9947253044869834033",
+        },
+    )
+
+    msg_id = runner.run(
+        aio_client.send(
+            "Message thus with.",
+            "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0",
+        )
+    )
+    assert msg_id == "9947253044869834033"
+
+
+def test_send_error(aio_client, aio_mock, runner):
+    aio_mock.post(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsg",
+        payload={"BaseResponse": {"Ret": 1101, "ErrMsg": ""}},
+    )
+
+    with pytest.raises(wechat.WeChatError):
+        runner.run(aio_client.send("Message thus with.", "filehelper"))
+
+
+def test_batch_add_contacts_errors(aio_client, runner, monkeypatch, capsys):
+    async def batch_get_contacts(users):
+        raise KeyError("ContactList")
+
+    monkeypatch.setattr(aio_client, "batch_get_contacts", batch_get_contacts)
+
+    async def main():
+        aio_client.init_chats(["@stranger"])
+
+        with pytest.raises(KeyError):
+            await aio_client.batch_add_contacts()
+
+        aio_client.init_chats(["@stranger"])
+        await aio_client.batch_add_contacts(background=True)
+        await asyncio.gather(*aio_client.batch_tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    runner.run(main())
+    assert "KeyError: 'ContactList'" in capsys.readouterr().err
+
+
+def test_download_error(aio_client, aio_mock, runner, tmp_path):
+    aio_mock.get(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID=1", status=404
+    )
+
+    with pytest.raises(aiohttp.ClientResponseError):
+        runner.run(aio_client.get_img("1", tmp_path / "1.jpg"))
+
+    aio_mock.get(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID=2",
+        body=b'{"BaseResponse": {"Ret": 1100, "ErrMsg": ""}}',
+        content_type="text/plain",
+    )
+
+    with pytest.raises(wechat.WeChatError):
+        runner.run(aio_client.get_img("2", tmp_path / "2.jpg"))
+    assert not (tmp_path / "2.jpg").exists()
+
+    msg = models.Msg(
+        {"MsgId": "1", "MsgType": consts.MsgType.APP, "MediaId": "1", "FileName": ".."}
+    )
+    with pytest.raises(ValueError):
+        runner.run(aio_client.get_msg_media(msg, tmp_path))
+
+
+def test_sync(server, fake_client, runner):
+    server.bad_status_every = 2
+
+    pushed = []
+    received = []
+    while len(received) < 4 or server.synccheck_count < 3:
+        pushed.append(server.msg())
+        server.push(pushed[-1])
+        received += runner.run(anext(fake_client.msgs))
+
+    # Every second synccheck was "HTTP/1.1 0", and sync went on.
+    assert [x.msg_id for x in received] == [x["MsgId"] for x in pushed]
+
+
+def test_upload(server, fake_client, runner, tmp_path):
+    path = tmp_path / "a.zip"
+    path.write_bytes(bytes(wechat.CHUNK_SIZE * 2 + 1))
+
+    progress = []
+    media_id = runner.run(
+        fake_client.upload(
+            path,
+            "filehelper",
+            client_media_id=1,
+            progress=lambda *x: progress.append(x),
+        )
+    )
+
+    assert media_id == "@crypt_1"
+    assert server.uploads[1] == {0, 1, 2}
+    assert progress[-1] == (3, 3)
+    assert fake_client.uploads == {}
+
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    assert runner.run(fake_client.upload(empty, "filehelper", client_media_id=2))
+    assert server.uploads[2] == {0}
+
+
+def test_get_video(server, fake_client, runner, tmp_path, monkeypatch):
+    monkeypatch.setattr(wechat, "RANGE_SIZE", 1000)
+
+    path = runner.run(fake_client.get_video("1", tmp_path / "a.mp4"))
+    assert path.read_bytes() == (PATTERN * 2)[:2500]
+
+
+def test_broadcast(server, fake_client, runner):
+    to_user_names = [x["UserName"] for x in server.contacts[:5]]
+
+    results = runner.run(fake_client.broadcast(to_user_names, "hi", rate=1000))
+
+    assert sorted(results) == sorted(to_user_names)
+    assert sorted(x["ToUserName"] for x in server.sent) == sorted(to_user_names)
+    assert {x["Content"] for x in server.sent} == {"hi"}
+
+
+def test_restore_session(server, runner, tmp_path):
+    path = tmp_path / "session.json"
+    cookie = {"name": "webwx_data_ticket", "value": "gSd8Zx", "domain": ".qq.com"}
+
+    client = aio.AsyncClient(session_path=path, **server.urls())
+    msgs = runner.run(client.login())
+    server.push(server.msg())
+    runner.run(anext(msgs))
+    client.set_cookies([{**cookie, "path": "/"}])
+    client.save_session()
+    runner.run(client.close())
+
+    restored = aio.AsyncClient(session_path=path, **server.urls())
+    msgs = runner.run(restored.login())
+
+    assert restored.user.user_name == client.user.user_name
+    assert restored.base_request == client.base_request
+    assert restored.sync_key == client.sync_key
+    # As aiohttp keeps the domain, without the dot.
+    assert restored.get_cookies() == [{**cookie, "domain": "qq.com", "path": "/"}]
+
+    server.push(server.msg())
+    assert len(runner.run(anext(msgs))) == 1
+    runner.run(restored.close())
+
+
+def test_loops(server):
+    # A client, and the shared connector, used from one asyncio.run and
+    # then another.
+    client = aio.AsyncClient(**server.urls())
+    cookie = {
+        "name": "webwx_data_ticket",
+        "value": "gSd8Zx",
+        "domain": ".qq.com",
+        "path": "/",
+    }
+
+    with asyncio.Runner() as runner:
+        runner.run(client.login())
+        runner.run(client.send("a", "filehelper"))
+        client.set_cookies([cookie])
+
+    with asyncio.Runner() as runner:
+        runner.run(client.send("b", "filehelper"))
+        assert client.get_cookies() == [{**cookie, "domain": "qq.com"}]
+
+        runner.run(client.close())
+        runner.run(aio.close())
+
+    assert [x["Content"] for x in server.sent] == ["a", "b"]
@@ -0,0 +1,66 @@
+from wechat.cache import DiskCache, MediaCache, SeenMsgs
+
+
+def test_media_cache(tmp_path):
+    path = tmp_path / "media.json"
+
+    c = MediaCache(maxsize=2, path=path)
+    c.set("pic:a", "@crypt_a")
+    c.set("pic:b", "@crypt_b")
+    c.get("pic:a")
+    c.set("pic:c", "@crypt_c")
+
+    c = MediaCache(maxsize=2, path=path)
+    assert c.get("pic:a") == "@crypt_a"
+    assert c.get("pic:b") is None
+    assert c.get("pic:c") == "@crypt_c"
+
+    c = MediaCache(ttl=-1)
+    c.set("pic:a", "@crypt_a")
+    assert c.get("pic:a") is None
+
+
+def test_media_cache_digests(tmp_path):
+    c = MediaCache(maxsize=1)
+
+    for name in "a.jpg", "b.jpg":
+        (tmp_path / name).write_bytes(name.encode())
+        c.key(tmp_path / name, "pic")
+
+    assert len(c.digests) == 1
+
+
+def test_disk_cache(tmp_path):
+    for name in "a", "b", "c":
+        (tmp_path / name).write_bytes(b"x" * 10)
+
+    c = DiskCache(tmp_path / "cache", maxsize=20)
+    c.put("img:a", tmp_path / "a")
+    c.put("img:b", tmp_path / "b")
+    c.get("img:a")
+    c.put("img:c", tmp_path / "c")
+
+    c = DiskCache(tmp_path / "cache", maxsize=20)
+    assert open(c.get("img:a"), "rb").read() == b"x" * 10
+    assert c.get("img:b") is None
+    assert c.get("img:c")
+    assert c.size == 20
+
+
+def test_seen_msgs():
+    c = SeenMsgs(maxsize=2)
+    assert not c.seen("1", 11)
+    assert c.seen("1", 11)
+    assert c.seen("", 11)
+    assert not c.seen("2")
+    mark = c.mark
+    assert not c.seen("3")
+
+    # Bounded, oldest first.
+    assert list(c.entries) == ["2", "3"]
+    assert c.dump(mark) == [["2", c.entries["2"][0]]]
+
+    c = SeenMsgs(ttl=-1)
+    assert not c.seen("1")
+    assert not c.seen("1")
+    assert len(c.entries) == 1
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from wechat import consts, pipeline
+from wechat.dispatch import AsyncDispatcher, Dispatcher
+
+ROOM = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+
+
+def msg(msg_type, peer_user_name, app_msg_type=0, **kwargs):
+    return SimpleNamespace(
+        **kwargs,
+        msg_type=msg_type,
+        app_msg_type=app_msg_type,
+        is_room=peer_user_name.startswith("@@"),
+        peer_user_name=peer_user_name,
+    )
+
+
+def test_dispatch():
+    d = Dispatcher()
+    calls = []
+
+    def handler(name, **route):
+        d.on(**route)(lambda m: calls.append(name))
+
+    handler("any")
+    handler("text", msg_type=consts.MsgType.TEXT)
+    handler("direct text", msg_type=consts.MsgType.TEXT, is_room=False)
+    handler("url", msg_type=consts.MsgType.APP, app_msg_type=consts.AppMsgType.URL)
+    handler("room", peer=ROOM)
+
+    d(msg(consts.MsgType.TEXT, "@a"))
+    assert calls == ["any", "text", "direct text"]
+
+    calls.clear()
+    d(msg(consts.MsgType.TEXT, ROOM))
+    assert calls == ["any", "text", "room"]
+
+    calls.clear()
+    d(msg(consts.MsgType.APP, ROOM, consts.AppMsgType.URL))
+    assert calls == ["any", "url", "room"]
+
+    calls.clear()
+    d(msg(consts.MsgType.APP, "@a", consts.AppMsgType.ATTACH))
+    assert calls == ["any"]
+
+    assert sorted(x["calls"] for x in d.stats().values()) == [1, 1, 2, 2, 4]
+
+
+def test_dispatch_executor():
+    with ThreadPoolExecutor(2) as executor:
+        d = Dispatcher(executor)
+        d.on(msg_type=consts.MsgType.TEXT)(lambda m: m.peer_user_name)
+
+        assert d(msg(consts.MsgType.TEXT, "@a")) == ["@a"]
+
+        @d.on(is_room=True)
+        def fail(m):
+            raise KeyError(m.peer_user_name)
+
+        with pytest.raises(KeyError):
+            d(msg(consts.MsgType.TEXT, ROOM))
+
+
+def test_dispatch_pipeline():
+    handled = []
+    errors = []
+
+    with ThreadPoolExecutor(4) as executor:
+        d = Dispatcher(executor)
+
+        @d.on()
+        def handler(m):
+            # The first message of the peer takes longest.
+            time.sleep(0.01 * (2 - m.n))
+            if m.n == 1:
+                raise KeyError(m.n)
+            handled.append(m.n)
+
+        batches = [[msg(consts.MsgType.TEXT, "@a", n=n)] for n in range(3)]
+        p = pipeline.Pipeline(d, workers=1, on_error=lambda m, e: errors.append(e))
+        p.run(iter(batches))
+
+    assert handled == [0, 2]
+    assert [type(e) for e in errors] == [KeyError]
+
+
+def test_dispatch_no_wait():
+    with ThreadPoolExecutor(2) as executor:
+        d = Dispatcher(executor, wait=False)
+        d.on()(lambda m: m.peer_user_name)
+
+        (future,) = d(msg(consts.MsgType.TEXT, "@a"))
+        assert future.result() == "@a"
+
+        with pytest.raises(ValueError):
+            pipeline.Pipeline(d)
+
+
+def test_async_dispatch():
+    d = AsyncDispatcher()
+    calls = []
+
+    @d.on(is_room=True)
+    async def room(m):
+        await asyncio.sleep(0)
+        calls.append("room")
+
+    @d.on()
+    def any_msg(m):
+        calls.append("any")
+
+    asyncio.run(d(msg(consts.MsgType.TEXT, ROOM)))
+    assert sorted(calls) == ["any", "room"]
+    assert d.stats()[room]["calls"] == 1
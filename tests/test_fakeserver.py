@@ -0,0 +1,51 @@
+import wechat
+from wechat import consts
+from wechat.fakeserver import PATTERN, FakeServer
+
+
+def test_fake_server(response_mock, tmp_path, monkeypatch):
+    monkeypatch.setattr(wechat, "RANGE_SIZE", 1000)
+
+    with FakeServer(
+        contacts=50,
+        rate=200,
+        batch=10,
+        poll_timeout=1,
+        bad_status_every=3,
+        media_size=2500,
+    ) as server:
+        response_mock.add_passthru(server.url)
+
+        client = wechat.Client(**server.urls())
+        msgs = client.login()
+
+        assert len(client.contacts) == 60
+        room = server.rooms[0]["UserName"]
+        assert len(client.contacts[room].members) == 20
+
+        received = []
+        sync_keys = set()
+        for batch in msgs:
+            received += batch
+            sync_keys.add(client.sync_key["List"][0]["Val"])
+
+            if len(received) >= 50:
+                break
+
+        # Every third synccheck was "HTTP/1.1 0", and sync went on.
+        assert server.synccheck_count >= 3
+        assert len(sync_keys) > 1
+        assert [int(x.msg_id) for x in received] == sorted(
+            int(x.msg_id) for x in received
+        )
+        assert all(x.msg_type == consts.MsgType.TEXT for x in received)
+
+        client.send("hi", "filehelper")
+        assert server.sent[-1]["Content"] == "hi"
+
+        path = tmp_path / "a.zip"
+        path.write_bytes(bytes(wechat.CHUNK_SIZE + 1))
+        assert client.upload(path, "filehelper").startswith("@crypt_")
+
+        video = client.get_video(received[0].msg_id, tmp_path / "a.mp4")
+        assert video.read_bytes() == (PATTERN * 2)[:2500]
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+import pytest
+
+# Loaded on first use rather than by the import.
+LAZY = ["fake_useragent", "qrcode", "xmltodict", "requests_toolbelt"]
+
+
+def run(code):
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+
+
+@pytest.mark.parametrize(
+    "module, lazy", [("wechat", [*LAZY, "asyncio"]), ("wechat.aio", LAZY)]
+)
+def test_import(module, lazy):
+    # Nothing heavy, and no default client until it is used.
+    loaded, has_client = run(
+        f"import sys, {module} as m\n"
+        f"print([x for x in {lazy!r} if x in sys.modules] == [])\n"
+        "print('client' in vars(m))"
+    )
+
+    assert loaded == "True"
+    assert has_client == "False"
+
+
+def test_import_lazy_module():
+    # Not the default client's pipeline attribute.
+    assert run("from wechat import pipeline; print(pipeline.__name__)") == [
+        "wechat.pipeline"
+    ]
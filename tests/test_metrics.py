@@ -0,0 +1,62 @@
+import pytest
+
+import wechat
+from wechat import consts
+from wechat.metrics import Metrics
+
+
+def test_metrics():
+    m = Metrics()
+    m.observe("webwxsync", 0.02)
+    m.observe("webwxsync", 40)
+    m.count_msgs([consts.MsgType.TEXT, consts.MsgType.TEXT, consts.MsgType.IMAGE])
+    m.count_bytes("webwxsync", 100, 2000)
+    m.count_error("webwxsendmsg", 1101)
+
+    snapshot = m.snapshot()
+    latency = snapshot["latency"]["webwxsync"]
+    assert latency["count"] == 2
+    assert latency["buckets"]["0.01"] == 0
+    assert latency["buckets"]["0.025"] == 1
+    assert latency["buckets"]["30"] == 1
+    assert latency["buckets"]["+Inf"] == 2
+    assert snapshot["msgs"] == {consts.MsgType.TEXT: 2, consts.MsgType.IMAGE: 1}
+    assert snapshot["bytes"] == {"webwxsync out": 100, "webwxsync in": 2000}
+    assert snapshot["errors"] == {"webwxsendmsg 1101": 1}
+
+    text = m.prometheus()
+    assert 'wechat_latency_seconds_bucket{name="webwxsync",le="+Inf"} 2\n' in text
+    assert 'wechat_msgs_total{msg_type="1"} 2\n' in text
+    assert 'wechat_errors_total{endpoint="webwxsendmsg",ret="1101"} 1\n' in text
+
+
+def test_client_metrics(client, response_mock):
+    response_mock.post(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsg",
+        json={"BaseResponse": {"Ret": consts.Ret.LOGGED_OUT, "ErrMsg": ""}},
+    )
+
+    with pytest.raises(wechat.WeChatError):
+        client.send("hi", "filehelper")
+
+    client.process_msgs(
+        [
+            {
+                "MsgId": "8206925434430164367",
+                "FromUserName": "filehelper",
+                "ToUserName": client.user.user_name,
+                "MsgType": consts.MsgType.TEXT,
+                "Content": "hi",
+                "Url": "",
+                "SubMsgType": 0,
+            }
+        ]
+    )
+
+    snapshot = client.metrics.snapshot()
+    assert snapshot["latency"]["webwxsendmsg"]["count"] == 1
+    assert snapshot["latency"]["process_msgs"]["count"] == 1
+    assert snapshot["latency"]["webwxinit"]["count"] == 1
+    assert snapshot["bytes"]["webwxsendmsg out"] > 0
+    assert snapshot["errors"] == {"webwxsendmsg 1101": 1}
+    assert snapshot["msgs"][consts.MsgType.TEXT] == 1
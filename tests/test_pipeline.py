@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import wechat
+from wechat import pipeline
+
+
+def msg(peer, n):
+    return SimpleNamespace(peer_user_name=peer, n=n)
+
+
+def test_pipeline_order():
+    handled = []
+
+    def handler(m):
+        if m.peer_user_name == "@slow":
+            time.sleep(0.01)
+        handled.append((m.peer_user_name, m.n))
+
+    batches = [
+        [msg(peer, n) for peer in ("@slow", "@fast", "@@room")] for n in range(5)
+    ]
+
+    p = pipeline.Pipeline(handler, workers=2)
+    p.run(iter(batches))
+
+    for peer in "@slow", "@fast", "@@room":
+        assert [n for x, n in handled if x == peer] == list(range(5))
+
+
+@pytest.mark.parametrize(
+    "overflow, handled",
+    [(pipeline.DROP_NEWEST, [0, 1]), (pipeline.DROP_OLDEST, [0, 2])],
+)
+def test_pipeline_overflow(overflow, handled):
+    started = threading.Event()
+    release = threading.Event()
+    res = []
+
+    def handler(m):
+        started.set()
+        release.wait()
+        res.append(m.n)
+
+    def msgs():
+        yield [msg("@a", 0)]
+        started.wait()
+        yield [msg("@a", 1), msg("@a", 2)]
+        release.set()
+
+    p = pipeline.Pipeline(handler, workers=1, maxsize=1, overflow=overflow)
+    p.run(msgs())
+
+    assert res == handled
+    assert p.dropped == 1
+
+
+def test_pipeline_checkpoint(tmp_path, monkeypatch):
+    client = wechat.Client(session_path=tmp_path / "session.json")
+
+    saved = []
+    monkeypatch.setattr(client, "save_session", saved.append)
+
+    release = threading.Event()
+    unhandled = []
+
+    def handler(m):
+        if m.n == 1:
+            release.wait()
+
+    def msgs():
+        client.sync_key = client.sync_check_key = 1
+        yield [msg("@a", 1)]
+
+        # sync has moved on, but the first batch is still being handled.
+        unhandled.extend(saved)
+        release.set()
+
+        client.sync_key = client.sync_check_key = 2
+        yield [msg("@b", 2)]
+
+    client.run(msgs(), handler)
+
+    assert unhandled == []
+    assert saved[-1][:2] == (2, 2)
+    assert client.pipeline is None
+
+
+def test_pipeline_error():
+    def msgs():
+        yield [msg("@a", 0)]
+        raise ConnectionError
+
+    p = pipeline.Pipeline(lambda m: None)
+    with pytest.raises(ConnectionError):
+        p.run(msgs())
+
+
+def test_async_pipeline():
+    handled = []
+    errors = []
+
+    async def handler(m):
+        if m.n == 1:
+            raise ValueError(m.n)
+        await asyncio.sleep(0)
+        handled.append((m.peer_user_name, m.n))
+
+    async def msgs():
+        for n in range(3):
+            yield [msg("@a", n), msg("@b", n)]
+
+    p = pipeline.AsyncPipeline(
+        handler, workers=2, on_error=lambda m, e: errors.append(m.n)
+    )
+    asyncio.run(p.run(msgs()))
+
+    assert [n for x, n in handled if x == "@a"] == [0, 2]
+    assert errors == [1, 1]
+    assert p.errors == 2
@@ -0,0 +1,118 @@
+import pytest
+import xmltodict
+
+from wechat import consts, utils, xmldict
+
+XML = [
+    # Login redirect
+    "<error><ret>0</ret><message></message><skey>@crypt_f2d2ed44_b1c4e1a8"
+    "</skey><wxsid>3jFaxE9UDfEa8H+U</wxsid><wxuin>1217252163</wxuin>"
+    "<pass_ticket>Zq%2BJvPsmPz</pass_ticket><isgrayscale>1</isgrayscale></error>",
+    # App message
+    '<?xml version="1.0"?>\n<msg>\n\t<appmsg appid="" sdkver="0">\n'
+    "\t\t<title>report.pdf</title>\n\t\t<des />\n\t\t<action />\n"
+    "\t\t<type>6</type>\n\t\t<url />\n\t\t<appattach>\n"
+    "\t\t\t<totallen>1048576</totallen>\n\t\t\t<attachid>@cdn_3057_1_1"
+    "</attachid>\n\t\t\t<fileext>pdf</fileext>\n\t\t</appattach>\n"
+    "\t\t<md5>5d41402abc4b2a76b9719d911017c592</md5>\n\t</appmsg>\n"
+    "\t<fromusername>wxid_1</fromusername>\n\t<scene>0</scene>\n"
+    "\t<appinfo>\n\t\t<version>1</version>\n\t\t<appname></appname>\n"
+    "\t</appinfo>\n\t<commenturl></commenturl>\n</msg>",
+    # News app, with CDATA and repeated items
+    '<msg><appmsg><mmreader><category type="20" count="2"><name>'
+    "<![CDATA[Tencent News]]></name><item><title><![CDATA[A & B]]></title>"
+    "<url><![CDATA[https://example.com/?a=1&b=2]]></url></item><item><title>"
+    "<![CDATA[<C>]]></title></item></category></mmreader></appmsg></msg>",
+    # Emoticon
+    '<msg><emoji fromusername="wxid_1" tousername="wxid_2" type="2" '
+    'md5="e7bd5f1a" len="94221" productid="" androidmd5="e7bd5f1a" '
+    'cdnurl="http://emoji.qpic.cn/wx_emoji/abc/" width="240" height="240"/>'
+    '<gameext type="0" content="0"></gameext></msg>',
+    # Recalled
+    '<sysmsg type="revokemsg"><revokemsg><session>wxid_1</session>'
+    "<oldmsgid>1057412870</oldmsgid><msgid>8206925434430164367</msgid>"
+    '<replacemsg><![CDATA["udavis" recalled a message]]></replacemsg>'
+    "</revokemsg></sysmsg>",
+    # Share card
+    '<?xml version="1.0"?>\n<msg bigheadimgurl="http://wx.qlogo.cn/a/0" '
+    'smallheadimgurl="http://wx.qlogo.cn/a/132" username="wxid_3" '
+    'nickname="dflowers" fullpy="dflowers" shortpy="" alias="" '
+    'imagestatus="3" scene="17" province="" city="" sign="" sex="1" '
+    'certflag="0" certinfo="" brandIconUrl="" brandHomeUrl="" '
+    'brandSubscriptConfigUrl="" brandFlags="0" regionCode="CN" />\n',
+    # Location
+    '<?xml version="1.0"?>\n<msg>\n\t<location x="22.540" y="113.934" '
+    'scale="16" label="Nanshan, Shenzhen" maptype="0" poiname="[Location]" '
+    'poiid="" />\n</msg>\n',
+    # Mixed text and children, entities, whitespace-only text
+    "<a>x<b>1</b>y<b>2</b> <c>&lt;&amp;&gt;</c><d>  </d><e/></a>",
+]
+
+
+@pytest.mark.parametrize("xml", XML)
+def test_parse_xml(xml):
+    assert xmldict.parse(xml) == xmltodict.parse(xml)
+
+
+@pytest.mark.parametrize(
+    "d",
+    [
+        {
+            "appmsg": {
+                "title": "a <report> & b",
+                "type": 6,
+                "appattach": {"totallen": 1048576, "attachid": "@cdn_3057_1_1"},
+            }
+        },
+        {"a": {"@x": 'q"1', "@y": None, "#text": "t", "b": [1, True, None], "c": []}},
+    ],
+)
+def test_to_xml(d):
+    assert xmldict.unparse(d, full_document=False) == xmltodict.unparse(
+        d, full_document=False
+    )
+
+
+@pytest.mark.parametrize("xml", XML)
+def test_roundtrip(xml):
+    d = xmltodict.parse(xml)
+    assert xmldict.unparse(d) == xmltodict.unparse(d)
+
+
+@pytest.mark.parametrize(
+    "s, rendered",
+    [
+        ("hello, world", "hello, world"),
+        ("a<br/>b", "a\nb"),
+        ('<span class="emoji emoji1f604"></span>', "\U0001f604"),
+        ('<span class="emoji emoji3120e3"></span>', "1️⃣"),
+        ('<span class="emoji emoji1f1e81f1f3"></span>', "\U0001f1e8\U0001f1f3"),
+        ('<span class="emoji emojia9"></span><br/>', "\xa9\n"),
+    ],
+)
+def test_render(s, rendered):
+    assert utils.render(s) == rendered
+    assert utils.render_all([s, s]) == [rendered, rendered]
+
+
+def test_emoji_table():
+    table = utils.EmojiTable()
+
+    for code in "1f600", "01f600", "001f600":
+        assert table[code] == "\U0001f600"
+    assert list(table) == ["1f600"]
+
+
+@pytest.mark.parametrize("name", utils.JSON_BACKENDS)
+def test_json_backends(name, monkeypatch):
+    monkeypatch.setattr(utils, "json_backend", utils.JSON_BACKENDS[name])
+
+    d = {"Content": "你好 \U0001f604", "MsgType": consts.MsgType.TEXT, "List": [1.5]}
+
+    data = utils.dumps(d)
+    assert isinstance(data, bytes)
+    assert utils.loads(data) == d
+
+    for data in b"\xff\xd8\xff", b"window.code=200;":
+        with pytest.raises(ValueError):
+            utils.loads(data)
@@ -1,4 +1,18 @@
+import concurrent.futures
+import io
+import json
+import os
+import pickle
+import tracemalloc
+from xml.parsers.expat import ExpatError
+
+import pytest
+import requests
+import responses
+
 import wechat
+from tests.conftest import add_login_responses
+from wechat import cache, consts, models, store
 
 
 def test_send(response_mock):
@@ -12,3 +26,761 @@ def test_send(response_mock):
         "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0",
     )
     assert msg_id == "9947253044869834033"
+
+
+def test_clients_are_independent(client):
+    other = wechat.Client()
+
+    assert other.s is not client.s
+    assert other.contacts == {}
+    assert wechat.contacts is client.contacts
+    assert other.s.get_adapter("https://wx2.qq.com") is wechat.adapter
+
+
+def test_upload(client, response_mock, tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(wechat.CHUNK_SIZE * 3))
+
+    url = "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json"
+    response_mock.post(url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}})
+    response_mock.post(url, json={"BaseResponse": {"Ret": 1, "ErrMsg": ""}})
+    response_mock.post(url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}})
+    response_mock.post(
+        url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": "@crypt_1"}
+    )
+
+    progress = []
+
+    with pytest.raises(wechat.WeChatError) as excinfo:
+        client.upload(path, "filehelper", workers=1, retries=0)
+
+    client_media_id = excinfo.value.client_media_id
+
+    media_id = client.upload(
+        path,
+        "filehelper",
+        client_media_id=client_media_id,
+        progress=lambda *x: progress.append(x),
+    )
+    assert media_id == "@crypt_1"
+    assert progress == [(2, 3), (3, 3)]
+    assert client.uploads == {}
+
+
+def test_upload_empty(client, response_mock, tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+
+    url = "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json"
+    response_mock.post(
+        url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": "@crypt_1"}
+    )
+
+    def progress(done, chunks):
+        raise OSError
+
+    # Every chunk landed, but the upload failed after.
+    with pytest.raises(OSError) as excinfo:
+        client.upload(path, "filehelper", progress=progress)
+
+    client_media_id = excinfo.value.client_media_id
+    assert client.uploads[client_media_id]["done"] == {0}
+
+    assert client.upload(path, "filehelper", client_media_id) == "@crypt_1"
+    assert sum(x.request.url == url for x in response_mock.calls) == 1
+    assert client.uploads == {}
+
+
+def test_upload_resume(client, tmp_path, monkeypatch):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(wechat.CHUNK_SIZE * 2))
+
+    upload = client.new_upload(path, "filehelper", 1)
+    upload["done"].add(0)
+    assert client.new_upload(path, "filehelper", 1)["pending"] == [1]
+
+    # The file changed, so nothing that was sent of it counts.
+    path.write_bytes(bytes(wechat.CHUNK_SIZE * 3))
+    assert client.new_upload(path, "filehelper", 1)["pending"] == [0, 1, 2]
+
+    monkeypatch.setattr(wechat, "UPLOAD_TTL", -1)
+    client.new_upload(path, "filehelper", 2)
+    assert list(client.uploads) == [2]
+
+
+def test_send_file(client, response_mock, tmp_path, monkeypatch):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"\xff\xd8\xff")
+
+    upload = response_mock.post(
+        "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json",
+        json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": "@crypt_1"},
+    )
+
+    url = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsgimg?fun=async&f=json"
+    for ret, msg_id in [(0, "1"), (0, "2"), (1, ""), (0, "3")]:
+        response_mock.post(
+            url, json={"BaseResponse": {"Ret": ret, "ErrMsg": ""}, "MsgID": msg_id}
+        )
+
+    assert client.send_file(path, "filehelper") == "1"
+    assert client.send_file(path, "weixin") == "2"
+    assert upload.call_count == 1
+
+    # The cached MediaId is rejected, so the file is uploaded again.
+    assert client.send_file(path, "filehelper") == "3"
+    assert upload.call_count == 2
+
+    # And not kept, should that upload fail.
+    key = client.media_cache.key(path, "pic")
+    client.media_cache.set(key, "@crypt_stale")
+
+    def upload_fails(*args):
+        raise requests.ConnectionError
+
+    monkeypatch.setattr(client, "upload", upload_fails)
+    with pytest.raises(requests.ConnectionError):
+        client.cache_upload(path, "filehelper", key=key, stale="@crypt_stale")
+    assert client.media_cache.get(key) is None
+    assert client.upload_locks == {}
+
+
+def test_send_file_once(client, response_mock, tmp_path):
+    path = tmp_path / "photo.jpg"
+    path.write_bytes(b"\xff\xd8\xff")
+
+    key = client.media_cache.key(path, "pic")
+    client.media_cache.set(key, "@crypt_stale")
+
+    upload = response_mock.post(
+        "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json",
+        json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MediaId": "@crypt_1"},
+    )
+
+    def callback(request):
+        msg = json.loads(request.body)["Msg"]
+
+        if msg["ToUserName"] == "weixin":
+            ret = consts.Ret.TOO_FREQUENT
+        elif msg["MediaId"] == "@crypt_stale":
+            ret = consts.Ret.FAILED
+        else:
+            ret = consts.Ret.OK
+
+        return (
+            200,
+            {},
+            json.dumps({"BaseResponse": {"Ret": ret, "ErrMsg": ""}, "MsgID": "1"}),
+        )
+
+    response_mock.add_callback(
+        "POST",
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsgimg?fun=async&f=json",
+        callback,
+    )
+
+    to_user_names = ["filehelper", "newsapp", "fmessage", "weixin"]
+    results = client.broadcast(to_user_names, path=path, workers=4, rate=1000)
+
+    # Every rejected send waits for the same upload, and an error about the
+    # recipient keeps the cached MediaId.
+    assert upload.call_count == 1
+    assert results["weixin"].args[0] == consts.Ret.TOO_FREQUENT
+    assert [results[x] for x in to_user_names[:3]] == ["1", "1", "1"]
+    assert client.media_cache.get(key) == "@crypt_1"
+    assert client.upload_locks == {}
+
+
+def test_broadcast(client, response_mock):
+    url = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsendmsg"
+    for ret, msg_id in [(0, "1"), (1101, "")]:
+        response_mock.post(
+            url, json={"BaseResponse": {"Ret": ret, "ErrMsg": ""}, "MsgID": msg_id}
+        )
+
+    to_user_names = ["filehelper", "weixin", "newsapp", "fmessage"]
+
+    results = client.broadcast(
+        to_user_names, "Message thus with.", workers=1, rate=1000, max_failures=1
+    )
+    assert results["filehelper"] == "1"
+    assert isinstance(results["weixin"], wechat.WeChatError)
+    assert isinstance(results["newsapp"], wechat.BroadcastAborted)
+
+    response_mock.post(url, body=requests.ConnectionError())
+    response_mock.post(
+        url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "MsgID": "3"}
+    )
+
+    results = client.broadcast(
+        to_user_names[1:], "Message thus with.", workers=1, rate=1000
+    )
+    assert isinstance(results.pop("weixin"), requests.ConnectionError)
+    assert results == {"newsapp": "3", "fmessage": "3"}
+
+
+def test_lazy_msgs(client, monkeypatch):
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+    sender = "@5adfb4b10e294fe7ddee1e4f7af82f9ada0db851877461a8a2ac4bf6b3f37c5b"
+
+    rendered = []
+    render = wechat.utils.render
+    monkeypatch.setattr(
+        wechat.utils, "render", lambda s: rendered.append(s) or render(s)
+    )
+
+    client.lazy = True
+    (msg,) = client.process_msgs(
+        [
+            {
+                "MsgId": "8206925434430164367",
+                "FromUserName": room,
+                "ToUserName": client.user.user_name,
+                "MsgType": 1,
+                "Content": f'{sender}:<br/>hi <span class="emoji emoji1f600"></span>',
+                "Url": "",
+                "SubMsgType": 0,
+                "OriContent": "",
+            }
+        ]
+    )
+    assert msg.peer_user_name == room
+    assert rendered == []
+
+    assert msg.content == "hi \U0001f600"
+    assert msg.sender == sender
+    assert msg.ori_content == ""
+    assert len(rendered) == 1
+
+    with pytest.raises(AttributeError):
+        msg.location_url
+
+
+def test_render_batch(client, monkeypatch):
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+    sender = "@5adfb4b10e294fe7ddee1e4f7af82f9ada0db851877461a8a2ac4bf6b3f37c5b"
+
+    batches = []
+    render_all = wechat.utils.render_all
+    monkeypatch.setattr(
+        wechat.utils, "render_all", lambda x: batches.append(x) or render_all(x)
+    )
+
+    msgs = client.process_msgs(
+        [
+            {
+                "MsgId": str(i),
+                "FromUserName": room,
+                "ToUserName": client.user.user_name,
+                "MsgType": 1,
+                "Content": f'{sender}:<br/>{i} <span class="emoji emoji1f600"></span>',
+                "Url": "",
+                "SubMsgType": 0,
+            }
+            for i in range(3)
+        ]
+    )
+
+    # The whole AddMsgList at once.
+    assert len(batches) == 1 and len(batches[0]) == 3
+    assert [m.content for m in msgs] == [f"{i} \U0001f600" for i in range(3)]
+    assert {m.sender for m in msgs} == {sender}
+
+
+def test_lazy_msgs_errors(client):
+    client.lazy = True
+    (msg,) = client.process_msgs(
+        [
+            {
+                "MsgId": "8206925434430164368",
+                "FromUserName": "@15935d3e04fa3eabf2047f04f288049bdc0afa9b33633658542519b5a9755d37",
+                "ToUserName": client.user.user_name,
+                "MsgType": 47,
+                "HasProductId": 0,
+                "Content": "&lt;msg&gt;&lt;emoji",
+                "Url": "",
+                "SubMsgType": 0,
+            }
+        ]
+    )
+
+    msg = pickle.loads(pickle.dumps(msg))
+
+    for _ in range(2):
+        with pytest.raises(ExpatError):
+            msg.content
+
+
+def test_sync_replay(client, tmp_path):
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+
+    def content(*ids):
+        return {
+            "ModContactList": [],
+            "DelContactList": [],
+            "AddMsgList": [
+                {
+                    "MsgId": str(i),
+                    "NewMsgId": i,
+                    "FromUserName": room,
+                    "ToUserName": client.user.user_name,
+                    "MsgType": 1,
+                    "Content": "hi",
+                    "Url": "",
+                    "SubMsgType": 0,
+                }
+                for i in ids
+            ],
+        }
+
+    client.seen_msgs = cache.SeenMsgs(persist=True)
+    assert [m.msg_id for m in client.process_sync(content(1, 2))] == ["1", "2"]
+    keys = client.checkpoint()
+
+    # After a reconnect, sync returns them again.
+    assert [m.msg_id for m in client.process_sync(content(2, 3))] == ["3"]
+
+    # Restored from a checkpoint before 3 was handled, so it is not dropped.
+    state = json.loads(json.dumps(client.dump_session(keys)))
+    restored = wechat.Client(seen_msgs=cache.SeenMsgs(persist=True))
+    restored.load_session(state)
+    msgs = restored.process_sync(content(1, 2, 3))
+    assert [m.msg_id for m in msgs] == ["3"]
+
+
+def test_contact_indexes(client):
+    me = client.user.user_name
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+
+    (c,) = client.contacts.find(nick_name="drivera")
+    assert c.user_name == room
+    assert [c.nick_name for c in client.contacts.search(remark_name="Mark")] == [
+        "dflowers"
+    ]
+    assert client.contacts.find(nick_name="nobody") == []
+
+    assert len(client.contacts.filter(is_room=True)) == 2
+    assert [c.nick_name for c in client.contacts.filter(is_room=False)] == ["dflowers"]
+    assert len(client.contacts.rooms_of(me)) == 2
+
+    client.add_contact(
+        {"UserName": room, "NickName": "rivera", "MemberList": [{"UserName": "@x"}]}
+    )
+    assert client.contacts.find(nick_name="drivera") == []
+    assert client.contacts.search(nick_name="riv")[0].user_name == room
+    assert len(client.contacts.rooms_of(me)) == 1
+
+    client.del_contact({"UserName": room})
+    assert client.contacts.search(nick_name="riv") == []
+
+
+def test_contact_cache(response_mock, tmp_path, monkeypatch):
+    contact_cache = store.ContactCache(tmp_path / "contacts.db")
+    room = "@@255f17df1bd8a28b7f165fa894b387368cedaf09a6f9782bb42479cd9ae4c8a7"
+
+    client = wechat.Client(contact_cache=contact_cache)
+    add_login_responses(response_mock.add)
+    client.login()
+    assert contact_cache.versions().keys() == client.contacts.keys()
+
+    # webwxgetcontact has the room without its members.
+    (cached,) = [x for x in contact_cache.load() if x["UserName"] == room]
+    assert len(cached["MemberList"]) == 3
+
+    client.apply_contacts([{**cached, "MemberList": []}], contact_cache.versions())
+    client.add_contact({**cached, "MemberList": []})
+    assert len(client.contacts[room].members) == 3
+
+    contact_cache.put([{**cached, "NickName": "shannon", "MemberList": []}])
+    (cached,) = [x for x in contact_cache.load() if x["UserName"] == room]
+    assert len(cached["MemberList"]) == 3
+
+    contact_cache.put([dict(cached, UserName="@@gone")])
+
+    put = []
+    monkeypatch.setattr(
+        contact_cache,
+        "put",
+        lambda contacts, put_=contact_cache.put: put.extend(contacts) or put_(contacts),
+    )
+
+    # The same account, so init starts from the cache, and only catches up
+    # with the server in the background.
+    client = wechat.Client(contact_cache=contact_cache)
+    add_login_responses(response_mock.add)
+    n = len(response_mock.calls)
+    client.login()
+    client.refresh_future.result()
+
+    assert "@@gone" not in client.contacts
+    assert contact_cache.versions().keys() == client.contacts.keys()
+    assert len(client.contacts[room].members) == 3
+    # Only webwxinit's contact, and the room whose NickName was changed in
+    # the cache above.
+    assert [x["UserName"] for x in put] == client.init_user_names + [room]
+
+    # Nor were the rooms fetched again.
+    batch_url = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxbatchgetcontact"
+    assert batch_url not in [x.request.url for x in response_mock.calls[n:]]
+    response_mock.remove("POST", batch_url)
+
+    # Someone else's contacts are of no use.
+    assert not contact_cache.claim(1)
+    assert contact_cache.load() == []
+
+
+def test_restore_session(response_mock, tmp_path):
+    path = tmp_path / "session.json"
+
+    sync_check_url = "https://webpush.wx2.qq.com/cgi-bin/mmwebwx-bin/synccheck"
+    sync_url = "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxsync"
+    sync_key = {"Count": 1, "List": [{"Key": 1, "Val": 791415260}]}
+
+    client = wechat.Client(session_path=path)
+    add_login_responses(response_mock.add)
+    msgs = client.login()
+    client.s.cookies.set("webwx_data_ticket", "gSd8Zx", domain=".qq.com")
+
+    response_mock.get(
+        sync_check_url, body='window.synccheck={retcode:"0",selector:"2"}'
+    )
+    response_mock.post(
+        sync_url,
+        json={
+            "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "ModContactList": [],
+            "DelContactList": [],
+            "AddMsgList": [],
+            "SyncKey": sync_key,
+            "SyncCheckKey": sync_key,
+        },
+    )
+    next(msgs)
+    response_mock.get(
+        sync_check_url, body='window.synccheck={retcode:"0",selector:"0"}'
+    )
+    next(msgs)
+
+    # A new process picks up from the checkpoint, without webwxinit.
+    response_mock.post(sync_url, json={"BaseResponse": {"Ret": 0, "ErrMsg": ""}})
+
+    # Without a contact cache, the chats are fetched again.
+    (room,) = client.chats
+    batch = response_mock.post(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
+        match=[
+            responses.matchers.json_params_matcher(
+                {"Count": 1, "List": [{"UserName": room}]}, strict_match=False
+            )
+        ],
+        json={
+            "BaseResponse": {"Ret": 0, "ErrMsg": ""},
+            "ContactList": [
+                {
+                    "UserName": room,
+                    "ContactFlag": 2,
+                    "VerifyFlag": 0,
+                    "Statues": 0,
+                    "SnsFlag": 0,
+                    "MemberList": [{"UserName": client.user.user_name}],
+                    "EncryChatRoomId": "@e619b0e9ed8896ea8f523e105ac5bd2c",
+                }
+            ],
+        },
+    )
+
+    restored = wechat.Client(session_path=path)
+    msgs = restored.login()
+    # Caught up with webwxgetcontact in the background.
+    restored.refresh_future.result()
+    assert "@@255f17df1bd8a28b7f165fa894b387368cedaf09a6f9782bb42479cd9ae4c8a7" in (
+        restored.contacts
+    )
+    assert restored.user.user_name == client.user.user_name
+    assert restored.base_request == client.base_request
+    assert restored.s.cookies["webwx_data_ticket"] == "gSd8Zx"
+    assert batch.call_count == 1 and room in restored.contacts
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    response_mock.get(
+        sync_check_url, body='window.synccheck={retcode:"0",selector:"0"}'
+    )
+    assert next(msgs) == []
+    assert response_mock.calls[-1].request.params["synckey"] == "1_791415260"
+
+    # The server no longer accepts the session.
+    response_mock.post(sync_url, json={"BaseResponse": {"Ret": 1101, "ErrMsg": ""}})
+    add_login_responses(response_mock.add)
+    response_mock.get(
+        f"https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin={client.user.uin}",
+        json={"ret": "1"},
+    )
+
+    wechat.Client(session_path=path).login()
+    assert response_mock.calls[-1].request.url.endswith("webwxbatchgetcontact")
+
+
+def test_batch_add_contacts(client, response_mock, monkeypatch):
+    monkeypatch.setattr(wechat, "BATCH_SIZE", 1)
+
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+    client.del_contact({"UserName": room})
+    client.init_chats([room, "@stranger", room])
+    assert list(client.users) == [room, "@stranger"]
+
+    fetched = []
+
+    def callback(request):
+        (user,) = json.loads(request.body)["List"]
+        fetched.append(user["UserName"])
+        if user["UserName"] != room:
+            return 200, {}, json.dumps({"BaseResponse": {"Ret": 1, "ErrMsg": ""}})
+
+        contact = {
+            "UserName": room,
+            "NickName": "drivera",
+            "ContactFlag": 2,
+            "VerifyFlag": 0,
+            "Statues": 0,
+            "SnsFlag": 0,
+            "MemberList": [{"UserName": client.user.user_name}],
+            "EncryChatRoomId": "@e619b0e9ed8896ea8f523e105ac5bd2c",
+        }
+        return (
+            200,
+            {},
+            json.dumps(
+                {"BaseResponse": {"Ret": 0, "ErrMsg": ""}, "ContactList": [contact]}
+            ),
+        )
+
+    response_mock.add_callback(
+        "POST", "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxbatchgetcontact", callback
+    )
+
+    futures = client.batch_add_contacts(background=True)
+    concurrent.futures.wait(futures)
+
+    assert sorted(fetched) == [room, "@stranger"]
+    assert client.contacts[room].member_list[0].is_me
+    # The failed batch is fetched again next time.
+    assert list(client.users) == ["@stranger"]
+
+
+def test_batch_add_contacts_errors(client, monkeypatch, capsys):
+    def batch_get_contacts(users):
+        raise KeyError("ContactList")
+
+    monkeypatch.setattr(client, "batch_get_contacts", batch_get_contacts)
+
+    client.init_chats(["@stranger"])
+
+    with pytest.raises(KeyError):
+        client.batch_add_contacts()
+
+    # Nothing waits on these, so the error is printed.
+    client.init_chats(["@stranger"])
+    client.batch_add_contacts(background=True)
+    # Waiters are woken before done callbacks run.
+    client.batch_executor.shutdown()
+    assert "KeyError: 'ContactList'" in capsys.readouterr().err
+
+
+def test_member_diff(client):
+    room = "@@a206ff4c10541070ed74bd5a4affd0388f6f69cca36b37b08a40dc9b544bdbf0"
+    c = client.contacts[room]
+    left, stays, me = list(c.members.values())
+
+    diffs = []
+    client.on_members(lambda room, diff: diffs.append(diff))
+
+    client.add_contact(
+        {
+            "UserName": room,
+            "MemberList": [
+                {"UserName": me.user_name, "NickName": me.nick_name},
+                {"UserName": stays.user_name, "NickName": "olivia"},
+                {"UserName": "@joined", "NickName": "joined"},
+            ],
+        }
+    )
+
+    ((added, removed, changed),) = diffs
+    assert [m.user_name for m in added] == ["@joined"]
+    assert removed == [left]
+    assert changed == [stays]
+
+    assert c.members[me.user_name] is me and me.is_me
+    assert c.members["@joined"].chat_room_id == c.encry_chat_room_id
+    assert stays.nick_name == "olivia"
+    assert client.contacts.rooms_of("@joined") == [c]
+    assert client.contacts.rooms_of(left.user_name) == []
+
+    # As webwxgetcontact lists it, which is not everyone leaving.
+    client.add_contact(
+        {"UserName": room, "NickName": "rivera", "MemberCount": 3, "MemberList": []}
+    )
+    assert len(diffs) == 1
+    assert len(c.members) == 3
+    assert client.contacts.rooms_of("@joined") == [c]
+
+
+def test_shared_user_names(client, response_mock):
+    rooms = [c for c in client.contacts.values() if c.members]
+    a, b = (c.members[client.user.user_name] for c in rooms)
+
+    # The same str in every room, but only for this client and login.
+    assert a.user_name is b.user_name
+    assert client.shared_user_names[a.user_name] is a.user_name
+
+    response_mock.post("https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxlogout")
+    client.logout()
+    assert client.shared_user_names == {}
+
+
+def test_get_video(client, response_mock, tmp_path, monkeypatch):
+    monkeypatch.setattr(wechat, "RANGE_SIZE", 4)
+    client.download_cache = cache.DiskCache(tmp_path / "cache")
+
+    data = b"\x00\x00\x00\x18ftypmp42"
+
+    def callback(request):
+        start, end = map(int, request.headers["Range"][6:].split("-"))
+        headers = {"Content-Range": f"bytes {start}-{end}/{len(data)}"}
+
+        return 206, headers, data[start : end + 1]
+
+    video = response_mock.add_callback(
+        "GET",
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetvideo?msgid=1",
+        callback,
+    )
+
+    path = client.get_video("1", tmp_path / "1.mp4")
+    assert path.read_bytes() == data
+    assert video.call_count == 3
+
+    # The second time from the cache.
+    msgs = [models.Msg({"MsgId": "1", "MsgType": consts.MsgType.VIDEO})]
+    (future,) = client.download_msgs(msgs, tmp_path).values()
+    assert open(future.result(), "rb").read() == data
+    assert video.call_count == 3
+
+
+def test_get_msg_media_file_name(client, response_mock, tmp_path):
+    response_mock.get(
+        "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmedia",
+        body=b"PK",
+        content_type="application/octet-stream",
+    )
+
+    def msg(file_name):
+        return models.Msg(
+            {
+                "MsgId": "1",
+                "MsgType": consts.MsgType.APP,
+                "MediaId": "@crypt_1",
+                "FileName": file_name,
+            }
+        )
+
+    path = client.get_msg_media(msg("../../a.zip"), tmp_path)
+    assert path == os.path.join(tmp_path, "1", "a.zip")
+    assert open(path, "rb").read() == b"PK"
+
+    for file_name in "", ".", "..", "a/..":
+        with pytest.raises(ValueError):
+            client.get_msg_media(msg(file_name), tmp_path)
+
+
+def test_download_error(client, response_mock, tmp_path):
+    client.download_cache = cache.DiskCache(tmp_path / "cache")
+
+    response_mock.get(
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID=1", status=404
+    )
+
+    with pytest.raises(requests.HTTPError):
+        client.get_img("1", tmp_path / "1.jpg")
+    assert client.download_cache.get("img:1") is None
+
+    # WeChat's errors come with a 200.
+    error = json.dumps({"BaseResponse": {"Ret": 1100, "ErrMsg": ""}})
+    for url in (
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID=2",
+        "https://wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetvideo?msgid=2",
+    ):
+        response_mock.get(url, body=error, content_type="text/plain")
+
+    with pytest.raises(wechat.WeChatError):
+        client.get_img("2", tmp_path / "2.jpg")
+    with pytest.raises(wechat.WeChatError):
+        client.get_video("2", tmp_path / "2.mp4")
+
+    assert not os.path.exists(tmp_path / "2.jpg")
+    assert not os.path.exists(tmp_path / "2.mp4")
+    assert client.download_cache.get("img:2") is None
+
+
+class Body(io.RawIOBase):
+    # A body of size bytes of zeros, made as it is read.
+
+    def __init__(self, size):
+        self.left = size
+        self.largest = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        # read() passes a new, zeroed buffer.
+        n = min(len(b), self.left)
+
+        self.left -= n
+        self.largest = max(self.largest, n)
+
+        return n
+
+
+class BodyAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def send(self, request, **kwargs):
+        r = requests.Response()
+        r.status_code = 200
+        r.headers["Content-Type"] = "image/jpeg"
+        r.raw = self.body
+        r.url = request.url
+        r.request = request
+
+        return r
+
+
+class Sink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def test_download_memory(client):
+    size = 1024 * 1024 * 1024
+    body = Body(size)
+    client.s.mount("https://wx2.qq.com/cgi-bin/mmwebwx-bin/", BodyAdapter(body))
+
+    sink = Sink()
+
+    tracemalloc.start()
+    try:
+        client.get_img("1", sink)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert sink.size == size
+    assert body.largest <= wechat.CHUNK_SIZE
+    # A chunk, and the copies reading one makes on the way.
+    assert peak < 4 * wechat.CHUNK_SIZE
@@ -1,31 +1,94 @@
+import contextlib
+import functools
+import importlib
 import json
 import math
 import mimetypes
 import os
 import re
+import shutil
+import threading
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
 from http.client import BadStatusLine
 from xml.sax.saxutils import unescape
 
 import requests
-from fake_useragent import UserAgent
-from requests_toolbelt import sessions
-from requests_toolbelt.downloadutils import stream
+from requests.adapters import HTTPAdapter
 
-from wechat import consts, models, utils
+from wechat import cache, consts, metrics, models, ratelimit, store, utils
+from wechat.utils import get_head_img_url, is_room_contact
+
+BASE_URL = "https://wx2.qq.com"
+LOGIN_URL = "https://login.wx2.qq.com"
+PUSH_URL = "https://webpush.wx2.qq.com"
+FILE_URL = "https://file.wx2.qq.com"
+
+CHUNK_SIZE = int(0.5 * 1024 * 1024)
+
+UPLOAD_WORKERS = 4
+UPLOAD_RETRIES = 3
+UPLOAD_TTL = 60 * 60
+RETRY_BACKOFF = 0.5
+
+# The Ret codes of a send that mean the MediaId has to be uploaded again,
+# rather than something about the recipient.
+MEDIA_ID_REJECTED = {consts.Ret.FAILED}
+
+BROADCAST_WORKERS = 8
+BROADCAST_RATE = 10
+
+# What the response hook leaves unread, by Content-Type.
+MEDIA_TYPES = ("image/", "audio/", "video/", "application/octet-stream")
+
+BATCH_SIZE = 50
+BATCH_WORKERS = 4
+
+DOWNLOAD_WORKERS = 8
+RANGE_SIZE = 4 * 1024 * 1024
+
+# How to download the media of a message, and what to name the file.
+MEDIA_GETTERS = {
+    consts.MsgType.IMAGE: ("get_img", "img.jpg"),
+    consts.MsgType.EMOTICON: ("get_img", "emoticon.gif"),
+    consts.MsgType.VOICE: ("get_voice", "voice.mp3"),
+    consts.MsgType.VIDEO: ("get_video", "video.mp4"),
+}
 
 
 class WeChatError(Exception): ...
 
 
+class BroadcastAborted(Exception): ...
+
+
 def raise_for_json(r, *args, **kwargs):
+    # Media goes to disk a chunk at a time, and reading it here would load
+    # the whole body first, so it is not checked. Anything else is, streamed
+    # or not, so a download that gets a JSON error raises before it writes.
+    if is_media(r):
+        return
+
     r.encoding = "utf-8"
 
+    # From the bytes, without decoding them to a str first.
     try:
-        content = r.json()
-    except requests.JSONDecodeError:
+        content = utils.loads(r.content)
+    except ValueError:
         return
 
+    if isinstance(content, dict):
+        check_response(content)
+
+    r.json = lambda: content
+
+
+def is_media(r):
+    return r.headers.get("Content-Type", "").startswith(MEDIA_TYPES)
+
+
+def check_response(content):
     if "BaseResponse" in content:
         base_response = content["BaseResponse"]
 
@@ -33,568 +96,1290 @@ def raise_for_json(r, *args, **kwargs):
         if ret != 0:
             raise WeChatError(ret, base_response["ErrMsg"])
 
-    r.json = lambda: content
 
+@functools.cache
+def user_agents():
+    # Loading the data takes longer than the rest of the import together,
+    # so it waits for the first client.
+    from fake_useragent import UserAgent
+
+    return UserAgent(platforms="pc")
+
+
+# Shared by every client, so that accounts reuse the connections to
+# wx2.qq.com, webpush.wx2.qq.com and file.wx2.qq.com.
+adapter = HTTPAdapter(pool_maxsize=100)
+
+
+class Client:
+    def __init__(
+        self,
+        adapter=adapter,
+        media_cache=None,
+        contact_cache=None,
+        session_path=None,
+        lazy=False,
+        download_cache=None,
+        base_url=BASE_URL,
+        login_url=LOGIN_URL,
+        push_url=PUSH_URL,
+        file_url=FILE_URL,
+        seen_msgs=None,
+    ):
+        from requests_toolbelt import sessions
+
+        self.s = sessions.BaseUrlSession(base_url=base_url)
+        self.s.mount("https://", adapter)
+        # The other hosts, which a fakeserver.FakeServer can stand in for
+        # too.
+        self.login_url = login_url
+        self.push_url = push_url
+        self.file_url = file_url
+
+        self.metrics = metrics.Metrics()
+        self.s.hooks["response"] = [self.metrics.on_response, self.on_response]
+        self.s.headers["User-Agent"] = user_agents().random
+
+        self.base_request = None
+        self.user_info = None
+        self.user = None
+        self.contacts = store.ContactStore()
+        # One str per user name, however many rooms it is in. Only for this
+        # login, as UserNames are.
+        self.shared_user_names = {}
+        self.contact_cache = contact_cache
+        # Set while contacts catch up with the server in the background.
+        self.refresh_future = None
+        # The contacts of webwxinit, which webwxgetcontact does not list.
+        self.init_user_names = []
+
+        # The store's own lock, which its queries take too, so that the
+        # contacts can change under background batches.
+        self.lock = self.contacts.lock
+
+        self.chats = []
+
+        # The ids of the messages already yielded by sync, a cache.SeenMsgs,
+        # as it can return them again.
+        self.seen_msgs = seen_msgs or cache.SeenMsgs()
+
+        # Called with (room, diff) when members join, leave or change.
+        self.member_handlers = []
+
+        # Contacts to fetch with webwxbatchgetcontact, by UserName.
+        self.users = {}
+        self.batch_executor = ThreadPoolExecutor(BATCH_WORKERS)
+
+        # Unfinished uploads by ClientMediaId, so that they can be resumed.
+        self.uploads = {}
+
+        self.media_cache = media_cache or cache.MediaCache()
+        # Locks by media cache key, so that a file is uploaded once however
+        # many sends need it at the same time, and how many hold or wait for
+        # each. Apart from the contacts' lock, which has nothing to do with
+        # them.
+        self.upload_lock = threading.Lock()
+        self.upload_locks = {}
+
+        # Downloaded media by msg_id or media_id, a cache.DiskCache.
+        self.download_cache = download_cache
+        self.download_executor = ThreadPoolExecutor(DOWNLOAD_WORKERS)
+        # The ranges of a download, apart from the downloads themselves, so
+        # that downloads waiting for their ranges cannot starve them.
+        self.range_executor = ThreadPoolExecutor(DOWNLOAD_WORKERS)
+
+        # Where the session is checkpointed, so that a new process can pick
+        # up syncing where this one left off.
+        self.session_path = session_path
+        self.sync_key = None
+        self.sync_check_key = None
+
+        # Set while a pipeline.Pipeline handles the messages, and takes
+        # over the checkpoints from sync.
+        self.pipeline = None
+
+        self.lazy = lazy
+
+    def on_response(self, r, *args, **kwargs):
+        try:
+            raise_for_json(r, *args, **kwargs)
+        except WeChatError as e:
+            self.metrics.count_error(metrics.endpoint_of(r.url), e.args[0])
+            raise
 
-s = sessions.BaseUrlSession(base_url="https://wx2.qq.com")
-s.hooks["response"] = raise_for_json
+    def login(self):
+        if self.restore_session() and self.check_session():
+            self.clear_contacts()
+            self.load_contacts()
 
-ua = UserAgent(platforms="pc")
-s.headers["User-Agent"] = ua.random
+            # Whatever the contact cache does not have.
+            self.init_chats(list(self.chats))
+            self.batch_add_contacts()
 
-user = None
-contacts = {}
+            # Syncing starts on the cached contacts, which catch up with the
+            # server in the background.
+            self.refresh_future = self.submit(self.refresh_contacts)
 
-chats = []
-users = []
+            return self.sync(self.sync_key, self.sync_check_key)
 
+        if self.user:
+            r = self.s.get(
+                f"/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin={self.user.uin}"
+            )
+            content = r.json()
 
-def login():
-    if user:
-        r = s.get(f"/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin={user.uin}")
-        content = r.json()
+            if content["ret"] == "0":
+                uuid = content["uuid"]
 
-        if content["ret"] == "0":
-            uuid = content["uuid"]
+                if self.check_login(uuid):
+                    return self.init()
 
-            if check_login(uuid):
-                return init()
+        return self.login_qr()
 
-    return login_qr()
+    def logout(self):
+        self.shared_user_names.clear()
 
+        return self.s.post("/cgi-bin/mmwebwx-bin/webwxlogout")
 
-def logout():
-    s.post("/cgi-bin/mmwebwx-bin/webwxlogout")
+    def login_qr(self):
+        r = self.s.get(f"{self.login_url}/jslogin?appid=wx782c26e4c19acffb")
+        uuid = re.search('window.QRLogin.uuid = "(.*)"', r.text)[1]
 
+        utils.print_qr(f"https://login.weixin.qq.com/l/{uuid}")
 
-def login_qr():
-    r = s.get("https://login.wx2.qq.com/jslogin?appid=wx782c26e4c19acffb")
-    uuid = re.search('window.QRLogin.uuid = "(.*)"', r.text)[1]
+        if self.check_login(uuid):
+            return self.init()
 
-    utils.print_qr(f"https://login.weixin.qq.com/l/{uuid}")
+    def check_login(self, uuid):
+        while True:
+            r = self.s.get(f"{self.login_url}/cgi-bin/mmwebwx-bin/login?uuid={uuid}")
+            code = re.search(r"window.code=(\d+)", r.text)[1]
 
-    if check_login(uuid):
-        return init()
+            if code == "200":
+                redirect_uri = re.search('window.redirect_uri="(.*)"', r.text)[1]
 
+                r = self.s.get(redirect_uri, allow_redirects=False)
+                self.set_base_request(r.text)
 
-def check_login(uuid):
-    while True:
-        r = s.get(f"https://login.wx2.qq.com/cgi-bin/mmwebwx-bin/login?uuid={uuid}")
-        code = re.search("window.code=(\d+)", r.text)[1]
+                return True
 
-        if code == "200":
-            redirect_uri = re.search('window.redirect_uri="(.*)"', r.text)[1]
+            if code == "400":
+                return False
 
-            r = s.get(redirect_uri, allow_redirects=False)
-            set_base_request(r.text)
+    def set_base_request(self, xml):
+        root = utils.parse_xml(xml)["error"]
 
-            return True
+        self.base_request = {"Sid": root["wxsid"], "Uin": int(root["wxuin"])}
 
-        if code == "400":
-            return False
+    def init(self):
+        content = self.post_json("/cgi-bin/mmwebwx-bin/webwxinit", {})
+
+        sync_key = content["SyncKey"]
+        self.set_user_info(content["User"])
+
+        self.clear_contacts()
+        cached = self.load_contacts()
+
+        self.init_user_names = [x["UserName"] for x in content["ContactList"]]
+        self.add_contacts(content["ContactList"])
+        self.init_chats(content["ChatSet"])
 
+        self.notify(consts.StatusNotifyCode.INITED, self.user.user_name)
 
-def set_base_request(xml):
-    root = utils.parse_xml(xml)["error"]
+        if cached:
+            self.refresh_future = self.submit(self.refresh_contacts)
+        else:
+            self.refresh_contacts()
 
-    global base_request
-    base_request = {"Sid": root["wxsid"], "Uin": int(root["wxuin"])}
+        return self.sync(sync_key)
 
+    def clear_contacts(self):
+        self.contacts.clear()
+        self.shared_user_names.clear()
 
-def init():
-    content = post_json("/cgi-bin/mmwebwx-bin/webwxinit", {})
+    def load_contacts(self):
+        # Those cached for this account, if any.
+        if not self.contact_cache or not self.contact_cache.claim(self.user.uin):
+            return False
 
-    sync_key = content["SyncKey"]
-    set_user_info(content["User"])
+        contacts = self.contact_cache.load()
 
-    contacts.clear()
-    add_contacts(content["ContactList"])
-    init_chats(content["ChatSet"])
+        with self.lock:
+            for contact in contacts:
+                self.add_contact(contact)
 
-    notify(consts.StatusNotifyCode.INITED, user.user_name)
+        return bool(contacts)
 
-    seq = 0
-    while True:
-        r = s.get(f"/cgi-bin/mmwebwx-bin/webwxgetcontact?seq={seq}")
-        content = r.json()
+    def get_contacts(self):
+        seq = 0
+        while True:
+            r = self.s.get(f"/cgi-bin/mmwebwx-bin/webwxgetcontact?seq={seq}")
+            content = r.json()
 
-        add_contacts(content["MemberList"])
+            yield from content["MemberList"]
 
-        seq = content["Seq"]
-        if seq == 0:
-            break
+            seq = content["Seq"]
+            if seq == 0:
+                break
 
-    batch_add_contacts()
+    def refresh_contacts(self):
+        # The versions from before paging, so that a contact sync adds in
+        # the meantime is not taken for one the server dropped.
+        versions = self.contact_cache.versions() if self.contact_cache else {}
 
-    return sync(sync_key)
+        self.apply_contacts(list(self.get_contacts()), versions)
+        self.batch_add_contacts()
 
+    def apply_contacts(self, contacts, versions):
+        # Only the contacts that changed since they were cached go through
+        # add_contact, and cached ones the server no longer has are dropped.
+        self.add_contacts(
+            [x for x in contacts if versions.get(x["UserName"]) != store.version(x)]
+        )
 
-def set_user_info(user_info):
-    global user
-    user = models.User(user_info)
+        # webwxgetcontact leaves out some of what webwxinit has.
+        seen = {x["UserName"] for x in contacts}
+        seen.update(self.init_user_names)
+        seen.update(self.chats)
 
+        self.del_contacts(
+            [{"UserName": x} for x in versions.keys() - seen if x in self.contacts]
+        )
 
-def sync(sync_key):
-    sync_check_key = sync_key
+    def set_user_info(self, user_info):
+        self.user_info = user_info
+        self.user = models.User(user_info)
 
-    while True:
+    def check_session(self):
+        # Unlike synccheck, webwxsync answers at once, and fails once the
+        # server has dropped the session. What it returns is thrown away,
+        # sync gets it again with the same SyncKey.
         try:
-            r = s.get(
-                "https://webpush.wx2.qq.com/cgi-bin/mmwebwx-bin/synccheck",
-                params={
-                    "sid": base_request["Sid"],
-                    "uin": base_request["Uin"],
-                    "synckey": "|".join(
-                        f'{x["Key"]}_{x["Val"]}' for x in sync_check_key["List"]
-                    ),
-                },
-            )
-        except requests.ConnectionError as e:
-            if not isinstance(e.args[0].args[1], BadStatusLine):  # HTTP/1.1 0 -\r\n
-                raise
+            self.post_json("/cgi-bin/mmwebwx-bin/webwxsync", {"SyncKey": self.sync_key})
+        except WeChatError:
+            return False
 
-            continue
+        return True
 
-        m = re.search('window.synccheck={retcode:"(.*)",selector:"(.*)"}', r.text)
+    def checkpoint(self):
+        # What to save with save_session once the messages so far are
+        # handled.
+        return self.sync_key, self.sync_check_key, self.seen_msgs.mark
 
-        if m[1] != "0":
-            logout()
-            return
+    def dump_session(self, keys=None):
+        sync_key, sync_check_key, mark = keys or self.checkpoint()
 
-        msgs = []
+        state = {
+            "cookies": self.get_cookies(),
+            "base_request": self.base_request,
+            "user": self.user_info,
+            "chats": self.chats,
+            "init_contacts": self.init_user_names,
+            "sync_key": sync_key,
+            "sync_check_key": sync_check_key,
+        }
 
-        if m[2] != "0":
-            content = post_json("/cgi-bin/mmwebwx-bin/webwxsync", {"SyncKey": sync_key})
+        if self.seen_msgs.persist:
+            # Not those after the checkpoint, as sync returns them again.
+            state["seen_msgs"] = self.seen_msgs.dump(mark)
 
-            sync_check_key = content["SyncCheckKey"]
-            sync_key = content["SyncKey"]
+        return state
 
-            add_contacts(content["ModContactList"])
-            del_contacts(content["DelContactList"])
+    def load_session(self, state):
+        self.set_cookies(state["cookies"])
+        self.base_request = state["base_request"]
+        self.set_user_info(state["user"])
+        self.chats[:] = state["chats"]
+        self.init_user_names = state.get("init_contacts", [])
+        self.sync_key = state["sync_key"]
+        self.sync_check_key = state["sync_check_key"]
+        # Older sessions do not have them.
+        self.seen_msgs.load(state.get("seen_msgs", []))
 
-            msgs = process_msgs(content["AddMsgList"])
+    def save_session(self, keys=None):
+        if self.session_path:
+            tmp = f"{self.session_path}.tmp"
 
-            batch_add_contacts()
+            # Only for this user, as it holds the login cookies.
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, "w") as f:
+                json.dump(self.dump_session(keys), f)
 
-        yield msgs
+            os.replace(tmp, self.session_path)
 
+    def restore_session(self):
+        if not self.session_path or not os.path.exists(self.session_path):
+            return False
 
-def process_msgs(msgs):
-    res = []
+        with open(self.session_path) as f:
+            self.load_session(json.load(f))
 
-    for msg in msgs:
-        M = models.Msg(msg)
+        return True
 
-        M.sender = M.from_user_name
-        M.is_send = is_me(M.sender)
-        M.peer_user_name = M.to_user_name if M.is_send else M.from_user_name
-        M.is_room = is_room_contact(M.peer_user_name)
+    def get_cookies(self):
+        return [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path}
+            for c in self.s.cookies
+        ]
 
-        if M.msg_type == consts.MsgType.STATUS_NOTIFY:
-            if M.status_notify_code == consts.StatusNotifyCode.SYNC_CONV:
-                init_chats(M.status_notify_user_name)
-        else:
-            x = utils.render(M.content)
-
-            if M.is_room:
-                m = re.search("^(@[a-z0-9]*):\n(.*)", x)
-                if m:
-                    M.sender = m[1]
-                    x = m[2]
-
-            match M.msg_type:
-                case consts.MsgType.APP:
-                    if M.app_msg_type in consts.AppMsgType:
-                        x = utils.parse_xml(unescape(x))
-                case consts.MsgType.EMOTICON:
-                    if not M.has_product_id:
-                        x = utils.parse_xml(unescape(x))
-                case consts.MsgType.TEXT:
-                    if is_news_app(M.from_user_name):
-                        x = utils.parse_xml(unescape(x))
-                    elif M.sub_msg_type == consts.MsgType.LOCATION:
-                        M.location_desc, location_url = x.split(":\n")
-                        M.location_url = M.url or location_url
-
-                        M.ori_content = utils.parse_xml(M.ori_content)
-                case consts.MsgType.RECALLED:
-                    x = utils.parse_xml(unescape(x))
-                case consts.MsgType.SHARE_CARD:
-                    x = utils.parse_xml(unescape(x))
+    def set_cookies(self, cookies):
+        for cookie in cookies:
+            self.s.cookies.set(**cookie)
 
-                    M.recommend_info.head_img_url = get_head_img_url(
-                        M.recommend_info.user_name
-                    )
+    def sync(self, sync_key, sync_check_key=None):
+        self.sync_key = sync_key
+        self.sync_check_key = sync_check_key or sync_key
 
-            M.content = x
+        self.save_session()
 
-        res.append(M)
+        while True:
+            try:
+                r = self.s.get(
+                    f"{self.push_url}/cgi-bin/mmwebwx-bin/synccheck",
+                    params=self.sync_check_params(self.sync_check_key),
+                )
+            except requests.ConnectionError as e:
+                if not isinstance(e.args[0].args[1], BadStatusLine):  # HTTP/1.1 0 -\r\n
+                    raise
 
-    return res
+                continue
 
+            m = re.search('window.synccheck={retcode:"(.*)",selector:"(.*)"}', r.text)
 
-def init_chats(user_names):
-    if isinstance(user_names, str):
-        user_names = user_names.split(",")
+            if m[1] != "0":
+                self.logout()
+                return
 
-    chats.clear()
+            msgs = []
 
-    for user_name in user_names:
-        if user_name:
-            chats.append(user_name)
+            if m[2] != "0":
+                content = self.post_json(
+                    "/cgi-bin/mmwebwx-bin/webwxsync", {"SyncKey": self.sync_key}
+                )
 
-            if user_name not in contacts:
-                users.append({"UserName": user_name})
+                self.sync_check_key = content["SyncCheckKey"]
+                self.sync_key = content["SyncKey"]
 
+                msgs = self.process_sync(content)
 
-def batch_add_contacts():
-    if users:
-        add_contacts(batch_get_contacts(users))
-        users.clear()
+                self.batch_add_contacts(background=True)
 
+            yield msgs
 
-def batch_get_contacts(users):
-    return post_json(
-        "/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
-        {"Count": len(users), "List": users},
-    )["ContactList"]
+            # Only once the messages have been handled, so that a restart
+            # gets them again rather than losing them.
+            if self.pipeline is None:
+                self.save_session()
 
+    def run(self, msgs, handler, **kwargs):
+        # Handles msgs on a pipeline.Pipeline, which polls ahead of the
+        # handlers. Imported here, as it brings in asyncio.
+        from wechat import pipeline
 
-def add_contacts(contacts):
-    for contact in contacts:
-        add_contact(contact)
+        pipeline.Pipeline(handler, client=self, **kwargs).run(msgs)
 
+    def sync_check_params(self, sync_check_key):
+        return {
+            "sid": self.base_request["Sid"],
+            "uin": self.base_request["Uin"],
+            "synckey": "|".join(
+                f'{x["Key"]}_{x["Val"]}' for x in sync_check_key["List"]
+            ),
+        }
 
-def del_contacts(contacts):
-    for contact in contacts:
-        del_contact(contact)
+    def process_sync(self, content):
+        self.add_contacts(content["ModContactList"])
+        self.del_contacts(content["DelContactList"])
 
+        # Those already seen, after a reconnect or an older SyncKey.
+        msgs = [
+            x
+            for x in content["AddMsgList"]
+            if not self.seen_msgs.seen(x["MsgId"], x.get("NewMsgId"))
+        ]
 
-def add_contact(contact):
-    user_name = contact["UserName"]
+        return self.process_msgs(msgs)
 
-    if user_name in contacts:
-        c = contacts[user_name]
-        c.update(contact)
-    else:
-        c = models.Contact(contact)
-        contacts[user_name] = c
+    def process_msgs(self, msgs):
+        with self.metrics.time("process_msgs"):
+            res = self.decode_msgs(msgs)
 
-        c.is_room = is_room_contact(user_name)
-        c.is_file_helper = is_file_helper(user_name)
-        c.is_recommend_helper = is_recommend_helper(user_name)
-        c.is_news_app = is_news_app(user_name)
+        self.metrics.count_msgs(M.msg_type for M in res)
 
-    c.is_black = bool(c.contact_flag & consts.ContactFlag.BLACKLIST)
-    c.is_brand = bool(c.verify_flag & consts.VerifyFlag.BIZ_BRAND)
-    c.is_muted = bool(
-        not c.statues if c.is_room else c.contact_flag & consts.ContactFlag.NOTIFY_CLOSE
-    )
-    c.is_top = bool(c.contact_flag & consts.ContactFlag.TOP_CONTACT)
-    c.has_photo_album = bool(c.sns_flag & 1)
+        return res
 
-    if c.is_room:
-        if c.member_list and c.encry_chat_room_id:
-            for m in c.member_list:
-                m.is_me = is_me(m.user_name)
-                m.head_img_url = get_head_img_url(
-                    m.user_name, chat_room_id=c.encry_chat_room_id
-                )
-        else:
-            users.append({"UserName": user_name})
+    def decode_msgs(self, msgs):
+        res = []
+        # (M, content, ori_content) to decode, rendered together below.
+        pending = []
 
+        for msg in msgs:
+            M = models.Msg(msg)
 
-def del_contact(contact):
-    user_name = contact["UserName"]
+            M.is_send = self.is_me(M.from_user_name)
+            M.peer_user_name = M.to_user_name if M.is_send else M.from_user_name
+            M.is_room = is_room_contact(M.peer_user_name)
 
-    del contacts[user_name]
+            if M.msg_type == consts.MsgType.STATUS_NOTIFY:
+                M.sender = M.from_user_name
 
+                if M.status_notify_code == consts.StatusNotifyCode.SYNC_CONV:
+                    self.init_chats(M.status_notify_user_name)
+            else:
+                if M.msg_type == consts.MsgType.SHARE_CARD:
+                    M.recommend_info.head_img_url = get_head_img_url(
+                        M.recommend_info.user_name
+                    )
 
-def get_head_img_url(user_name, chat_room_id=""):
-    if is_room_contact(user_name):
-        url = "/cgi-bin/mmwebwx-bin/webwxgetheadimg"
-    else:
-        url = "/cgi-bin/mmwebwx-bin/webwxgeticon"
+                content = M.__dict__.pop("content")
+                ori_content = M.__dict__.pop("ori_content", None)
 
-    url += f"?username={user_name}"
-    if chat_room_id:
-        url += f"&chatroomid={chat_room_id}"
+                if self.lazy:
+                    # sender, content and ori_content are decoded when one
+                    # of them is first read. Not bound to the client, so
+                    # that a lazy message neither keeps it alive nor stops
+                    # being picklable.
+                    M.lazy_decode = functools.partial(
+                        decode_msg, content=content, ori_content=ori_content
+                    )
+                else:
+                    pending.append((M, content, ori_content))
 
-    return url
+            res.append(M)
 
+        rendered = utils.render_all([content for M, content, _ in pending])
+        for (M, _, ori_content), x in zip(pending, rendered):
+            decode_rendered(M, x, ori_content)
 
-def is_me(user_name):
-    return user_name == user.user_name
+        return res
 
+    def init_chats(self, user_names):
+        if isinstance(user_names, str):
+            user_names = user_names.split(",")
 
-def is_room_contact(user_name):
-    return user_name.startswith("@@")
+        self.chats.clear()
 
+        for user_name in user_names:
+            if user_name:
+                self.chats.append(user_name)
 
-def is_file_helper(user_name):
-    return user_name == consts.FILE_HELPER
+                if user_name not in self.contacts:
+                    self.users[user_name] = {"UserName": user_name}
 
+    def batch_add_contacts(self, background=False):
+        with self.lock:
+            users = list(self.users.values())
+            self.users.clear()
 
-def is_recommend_helper(user_name):
-    return user_name == consts.RECOMMEND_HELPER
+        if not users:
+            return
 
+        # Each batch is added as it arrives, on the client's batch workers.
+        # In the background, sync keeps yielding while member lists fill in.
+        futures = [
+            self.batch_executor.submit(self.fetch_contacts, users[i : i + BATCH_SIZE])
+            for i in range(0, len(users), BATCH_SIZE)
+        ]
 
-def is_news_app(user_name):
-    return user_name == consts.NEWS_APP
+        if background:
+            for f in futures:
+                f.add_done_callback(report)
+        else:
+            wait(futures)
 
+            for f in futures:
+                f.result()
 
-def is_weixin(user_name):
-    return user_name == consts.WEIXIN
+        return futures
 
+    def submit(self, fn, *args):
+        future = self.batch_executor.submit(fn, *args)
+        future.add_done_callback(report)
 
-def send(content, to_user_name):
-    return post_msg(
-        "/cgi-bin/mmwebwx-bin/webwxsendmsg",
-        {"ToUserName": to_user_name, "Type": consts.MsgType.TEXT, "Content": content},
-    )
+        return future
 
+    def fetch_contacts(self, users):
+        # The users of a batch that fails are fetched again with the next one.
+        try:
+            contacts = self.batch_get_contacts(users)
+        except (requests.RequestException, WeChatError):
+            self.requeue(users)
+        else:
+            self.add_contacts(contacts)
+
+    def requeue(self, users):
+        with self.lock:
+            for user in users:
+                self.users.setdefault(user["UserName"], user)
+
+    def batch_get_contacts(self, users):
+        return self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
+            {"Count": len(users), "List": users},
+        )["ContactList"]
+
+    def add_contacts(self, contacts):
+        with self.lock:
+            for contact in contacts:
+                self.add_contact(contact)
+
+        if self.contact_cache:
+            self.contact_cache.put(contacts)
+
+    def del_contacts(self, contacts):
+        with self.lock:
+            for contact in contacts:
+                self.del_contact(contact)
+
+        if self.contact_cache:
+            self.contact_cache.delete(x["UserName"] for x in contacts)
+
+    def add_contact(self, contact):
+        self.share_user_names(contact)
+        user_name = contact["UserName"]
+
+        if user_name in self.contacts:
+            c = self.contacts[user_name]
+            chat_room_id = getattr(c, "encry_chat_room_id", None)
+            diff = c.update(contact)
+        else:
+            c = models.Contact(contact)
+            self.contacts[user_name] = c
+
+            chat_room_id = None
+            diff = None
+
+            c.is_room = is_room_contact(user_name)
+            c.is_file_helper = is_file_helper(user_name)
+            c.is_recommend_helper = is_recommend_helper(user_name)
+            c.is_news_app = is_news_app(user_name)
+
+        c.is_black = bool(c.contact_flag & consts.ContactFlag.BLACKLIST)
+        c.is_brand = bool(c.verify_flag & consts.VerifyFlag.BIZ_BRAND)
+        c.is_muted = bool(
+            not c.statues
+            if c.is_room
+            else c.contact_flag & consts.ContactFlag.NOTIFY_CLOSE
+        )
+        c.is_top = bool(c.contact_flag & consts.ContactFlag.TOP_CONTACT)
+        c.has_photo_album = bool(c.sns_flag & 1)
 
-def send_img(media_id, to_user_name):
-    return post_msg(
-        "/cgi-bin/mmwebwx-bin/webwxsendmsgimg?fun=async&f=json",
-        {"ToUserName": to_user_name, "Type": consts.MsgType.IMAGE, "MediaId": media_id},
-    )
+        if c.is_room:
+            if c.members and c.encry_chat_room_id:
+                if c.encry_chat_room_id != chat_room_id:
+                    members = c.members.values()
+                else:
+                    members = diff.added if diff else ()
 
+                for m in members:
+                    m.is_me = self.is_me(m.user_name)
+                    m.chat_room_id = c.encry_chat_room_id
+            else:
+                self.users[user_name] = {"UserName": user_name}
 
-def send_video(media_id, to_user_name):
-    return post_msg(
-        "/cgi-bin/mmwebwx-bin/webwxsendvideomsg?f=json",
-        {"ToUserName": to_user_name, "Type": consts.MsgType.VIDEO, "MediaId": media_id},
-    )
+        self.contacts.index(c, diff)
 
+        if diff and (diff.added or diff.removed or diff.changed):
+            for handler in self.member_handlers:
+                handler(c, diff)
 
-def send_app(title, total_len, attach_id, to_user_name):
-    return post_msg(
-        "/cgi-bin/mmwebwx-bin/webwxsendappmsg",
-        {
-            "ToUserName": to_user_name,
-            "Type": consts.AppMsgType.ATTACH,
-            "Content": utils.to_xml(
-                {
-                    "appmsg": {
-                        "title": title,
-                        "type": consts.AppMsgType.ATTACH.value,
-                        "appattach": {"totallen": total_len, "attachid": attach_id},
+    def share_user_names(self, contact):
+        # Before the models are made, which keep the same str.
+        names = self.shared_user_names
+
+        user_name = contact["UserName"]
+        contact["UserName"] = names.setdefault(user_name, user_name)
+
+        for m in contact.get("MemberList", ()):
+            user_name = m["UserName"]
+            m["UserName"] = names.setdefault(user_name, user_name)
+
+    def on_members(self, handler):
+        self.member_handlers.append(handler)
+
+        return handler
+
+    def del_contact(self, contact):
+        user_name = contact["UserName"]
+
+        del self.contacts[user_name]
+
+    def is_me(self, user_name):
+        return user_name == self.user.user_name
+
+    def send(self, content, to_user_name):
+        return self.post_msg(
+            "/cgi-bin/mmwebwx-bin/webwxsendmsg",
+            {
+                "ToUserName": to_user_name,
+                "Type": consts.MsgType.TEXT,
+                "Content": content,
+            },
+        )
+
+    def send_img(self, media_id, to_user_name):
+        return self.post_msg(
+            "/cgi-bin/mmwebwx-bin/webwxsendmsgimg?fun=async&f=json",
+            {
+                "ToUserName": to_user_name,
+                "Type": consts.MsgType.IMAGE,
+                "MediaId": media_id,
+            },
+        )
+
+    def send_video(self, media_id, to_user_name):
+        return self.post_msg(
+            "/cgi-bin/mmwebwx-bin/webwxsendvideomsg?f=json",
+            {
+                "ToUserName": to_user_name,
+                "Type": consts.MsgType.VIDEO,
+                "MediaId": media_id,
+            },
+        )
+
+    def send_app(self, title, total_len, attach_id, to_user_name):
+        return self.post_msg(
+            "/cgi-bin/mmwebwx-bin/webwxsendappmsg",
+            {
+                "ToUserName": to_user_name,
+                "Type": consts.AppMsgType.ATTACH,
+                "Content": utils.to_xml(
+                    {
+                        "appmsg": {
+                            "title": title,
+                            "type": consts.AppMsgType.ATTACH.value,
+                            "appattach": {
+                                "totallen": total_len,
+                                "attachid": attach_id,
+                            },
+                        }
                     }
-                }
-            ),
-        },
-    )
+                ),
+            },
+        )
+
+    def send_emoticon(self, media_id, to_user_name):
+        return self.post_msg(
+            "/cgi-bin/mmwebwx-bin/webwxsendemoticon?fun=sys",
+            {
+                "ToUserName": to_user_name,
+                "Type": consts.MsgType.EMOTICON,
+                "MediaId": media_id,
+            },
+        )
 
+    def send_file(self, path, to_user_name):
+        key = self.media_cache.key(path, guess_media_type(path))
 
-def send_emoticon(media_id, to_user_name):
-    return post_msg(
-        "/cgi-bin/mmwebwx-bin/webwxsendemoticon?fun=sys",
-        {
-            "ToUserName": to_user_name,
-            "Type": consts.MsgType.EMOTICON,
-            "MediaId": media_id,
-        },
-    )
+        media_id = self.media_cache.get(key)
+        if media_id:
+            try:
+                return self.send_media(path, media_id, to_user_name)
+            except WeChatError as e:
+                if e.args[0] not in MEDIA_ID_REJECTED:
+                    raise
+
+        media_id = self.cache_upload(path, to_user_name, key=key, stale=media_id)
+
+        return self.send_media(path, media_id, to_user_name)
+
+    def cache_upload(self, path, to_user_name, key=None, stale=None):
+        # Uploads the file unless the cache has a MediaId for it, other than
+        # a stale one that was just rejected.
+        key = key or self.media_cache.key(path, guess_media_type(path))
+
+        with self.locked_upload(key):
+            media_id = self.media_cache.get(key)
+
+            if media_id is not None and media_id == stale:
+                # Gone from the cache even if the upload fails.
+                self.media_cache.discard(key)
+                media_id = None
 
+            if media_id is None:
+                media_id = self.upload(path, to_user_name)
+                self.media_cache.set(key, media_id)
 
-def post_msg(url, msg):
-    client_msg_id = time.time_ns()
+        return media_id
 
-    return post_json(
-        url,
-        {
+    @contextlib.contextmanager
+    def locked_upload(self, key):
+        # The lock of key, dropped once no one holds or waits for it.
+        with self.upload_lock:
+            entry = self.upload_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.upload_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.upload_locks[key]
+
+    def send_media(self, path, media_id, to_user_name):
+        match guess_media_type(path):
+            case "pic":
+                return self.send_img(media_id, to_user_name)
+            case "video":
+                return self.send_video(media_id, to_user_name)
+
+        if mimetypes.guess_type(path)[0] == "image/gif":
+            return self.send_emoticon(media_id, to_user_name)
+
+        return self.send_app(
+            os.path.basename(path), os.path.getsize(path), media_id, to_user_name
+        )
+
+    def broadcast(
+        self,
+        to_user_names,
+        content=None,
+        path=None,
+        workers=BROADCAST_WORKERS,
+        rate=BROADCAST_RATE,
+        max_failures=None,
+    ):
+        bucket = ratelimit.TokenBucket(rate)
+
+        results = {}
+        failures = 0
+        lock = threading.Lock()
+
+        def send(to_user_name):
+            nonlocal failures
+
+            # Stop after max_failures sends in a row failed, leaving
+            # BroadcastAborted for the rest.
+            if max_failures and failures >= max_failures:
+                results[to_user_name] = BroadcastAborted(to_user_name)
+                return
+
+            time.sleep(bucket.reserve())
+
+            try:
+                if path is None:
+                    results[to_user_name] = self.send(content, to_user_name)
+                else:
+                    results[to_user_name] = self.send_file(path, to_user_name)
+            except (requests.RequestException, WeChatError) as e:
+                results[to_user_name] = e
+
+                with lock:
+                    failures += 1
+            else:
+                with lock:
+                    failures = 0
+
+        if path is not None and to_user_names:
+            self.cache_upload(path, to_user_names[0])
+
+        with ThreadPoolExecutor(workers) as executor:
+            list(executor.map(send, to_user_names))
+
+        return results
+
+    def post_msg(self, url, msg):
+        return self.post_json(url, self.msg_payload(msg))["MsgID"]
+
+    def msg_payload(self, msg):
+        client_msg_id = time.time_ns()
+
+        return {
             "Msg": {
                 "ClientMsgId": client_msg_id,
                 "LocalID": client_msg_id,
-                "FromUserName": user.user_name,
+                "FromUserName": self.user.user_name,
                 **msg,
             }
-        },
-    )["MsgID"]
-
+        }
 
-def revoke(svr_msg_id, to_user_name):
-    post_json(
-        "/cgi-bin/mmwebwx-bin/webwxrevokemsg",
-        {
-            "SvrMsgId": svr_msg_id,
-            "ToUserName": to_user_name,
-            "ClientMsgId": time.time_ns(),
-        },
-    )
+    def revoke(self, svr_msg_id, to_user_name):
+        return self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxrevokemsg",
+            {
+                "SvrMsgId": svr_msg_id,
+                "ToUserName": to_user_name,
+                "ClientMsgId": time.time_ns(),
+            },
+        )
 
+    def notify(self, code, to_user_name):
+        return self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxstatusnotify",
+            self.notify_payload(code, to_user_name),
+        )["MsgID"]
 
-def notify(code, to_user_name):
-    return post_json(
-        "/cgi-bin/mmwebwx-bin/webwxstatusnotify",
-        {
+    def notify_payload(self, code, to_user_name):
+        return {
             "Code": code,
-            "FromUserName": user.user_name,
+            "FromUserName": self.user.user_name,
             "ToUserName": to_user_name,
             "ClientMsgId": time.time_ns(),
-        },
-    )["MsgID"]
+        }
 
+    def upload(
+        self,
+        path,
+        to_user_name,
+        client_media_id=None,
+        workers=UPLOAD_WORKERS,
+        retries=UPLOAD_RETRIES,
+        progress=None,
+    ):
+        client_media_id = client_media_id or time.time_ns()
+        upload = self.new_upload(path, to_user_name, client_media_id)
+
+        def upload_chunk(chunk):
+            # Retries included, which webwxuploadmedia's latency leaves out.
+            with self.metrics.time("upload_chunk"):
+                content = retry(
+                    lambda: self.upload_media(upload, chunk, read_chunk(path, chunk)),
+                    retries,
+                )
+            upload["done"].add(chunk)
+            upload["media_id"] = content.get("MediaId")
 
-def upload(path, to_user_name):
-    filename = os.path.basename(path)
+            if progress:
+                progress(len(upload["done"]), upload["chunks"])
 
-    ctype, encoding = mimetypes.guess_type(path)
-    if ctype is None or encoding is not None:
-        # No guess could be made, or the file is encoded (compressed), so
-        # use a generic bag-of-bits type.
-        ctype = "application/octet-stream"
+            return content
 
-    maintype, subtype = ctype.split("/")
-    if maintype == "image" and subtype != "gif":
-        media_type = "pic"
-    elif maintype == "video":
-        media_type = "video"
-    else:
-        media_type = "doc"
+        if not upload["pending"]:
+            # Every chunk landed before, the last one with the MediaId.
+            del self.uploads[client_media_id]
+            return upload["media_id"]
 
-    with open(path, "rb") as f:
-        total_len = f.seek(0, os.SEEK_END)
-        f.seek(0)
+        # The server only answers with the MediaId once it has every chunk,
+        # so the last one goes out after the others have landed.
+        *chunks, last = upload["pending"]
 
-        upload_media_request = json.dumps(
+        try:
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(upload_chunk, chunks))
+
+            content = upload_chunk(last)
+        except Exception as e:
+            # Passing it back to upload resumes from the chunks that landed.
+            e.client_media_id = client_media_id
+            raise
+
+        del self.uploads[client_media_id]
+
+        return content["MediaId"]
+
+    def new_upload(self, path, to_user_name, client_media_id):
+        st = os.stat(path)
+        stamp = (st.st_size, st.st_mtime_ns)
+        now = time.time()
+
+        # Uploads that were given up on are forgotten after UPLOAD_TTL.
+        for key, upload in list(self.uploads.items()):
+            if upload["updated"] + UPLOAD_TTL < now:
+                del self.uploads[key]
+
+        upload = self.uploads.get(client_media_id)
+
+        # A file that changed since is uploaded from scratch.
+        if upload is None or upload["stamp"] != stamp:
+            total_len = st.st_size
+
+            self.uploads[client_media_id] = {
+                "stamp": stamp,
+                "filename": os.path.basename(path),
+                "media_type": guess_media_type(path),
+                # An empty file is one empty chunk.
+                "chunks": max(1, math.ceil(total_len / CHUNK_SIZE)),
+                "done": set(),
+                "upload_media_request": self.upload_media_request(
+                    client_media_id, total_len, to_user_name
+                ),
+            }
+
+        upload = self.uploads[client_media_id]
+        upload["updated"] = now
+        upload["pending"] = [
+            chunk for chunk in range(upload["chunks"]) if chunk not in upload["done"]
+        ]
+
+        return upload
+
+    def upload_media(self, upload, chunk, data):
+        return self.s.post(
+            f"{self.file_url}/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json",
+            files={"filename": (upload["filename"], data)},
+            data={
+                "chunks": upload["chunks"],
+                "chunk": chunk,
+                "mediatype": upload["media_type"],
+                "uploadmediarequest": upload["upload_media_request"],
+            },
+        ).json()
+
+    def upload_media_request(self, client_media_id, total_len, to_user_name):
+        return json.dumps(
             {
-                "BaseRequest": base_request,
-                "ClientMediaId": time.time_ns(),
+                "BaseRequest": self.base_request,
+                "ClientMediaId": client_media_id,
                 "TotalLen": total_len,
                 "StartPos": 0,
                 "DataLen": total_len,
                 "MediaType": consts.MediaType.ATTACHMENT,
-                "FromUserName": user.user_name,
+                "FromUserName": self.user.user_name,
                 "ToUserName": to_user_name,
             }
         )
 
-        chunk_size = int(0.5 * 1024 * 1024)
-        chunks = math.ceil(total_len / chunk_size)
-
-        for chunk in range(chunks):
-            r = s.post(
-                "https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json",
-                files={"filename": (filename, f.read(chunk_size))},
-                data={
-                    "chunks": chunks,
-                    "chunk": chunk,
-                    "mediatype": media_type,
-                    "uploadmediarequest": upload_media_request,
-                },
+    def get_img(self, msg_id, path):
+        return self.download(
+            f"/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID={msg_id}",
+            path,
+            key=f"img:{msg_id}",
+        )
+
+    def get_voice(self, msg_id, path):
+        return self.download(
+            f"/cgi-bin/mmwebwx-bin/webwxgetvoice?msgid={msg_id}",
+            path,
+            key=f"voice:{msg_id}",
+        )
+
+    def get_video(self, msg_id, path):
+        return self.download(
+            f"/cgi-bin/mmwebwx-bin/webwxgetvideo?msgid={msg_id}",
+            path,
+            key=f"video:{msg_id}",
+            ranged=True,
+        )
+
+    def get_media(self, media_id, path):
+        filename = os.path.basename(path)
+        return self.download(
+            f"{self.file_url}/cgi-bin/mmwebwx-bin/webwxgetmedia?mediaid={media_id}&encryfilename={filename}",
+            path,
+            key=f"media:{media_id}",
+            ranged=True,
+        )
+
+    def get_msg_media(self, msg, directory):
+        # Into directory/<MsgId>/, under the file name of an attachment.
+        if msg.msg_type == consts.MsgType.APP and msg.media_id:
+            getter, filename = "get_media", msg.file_name
+        elif msg.msg_type in MEDIA_GETTERS:
+            getter, filename = MEDIA_GETTERS[msg.msg_type]
+        else:
+            return None
+
+        # The sender names an attachment, so it must not leave directory.
+        filename = os.path.basename(filename or "")
+        path = os.path.join(directory, msg.msg_id, filename)
+        if filename in ("", ".", "..") or not is_inside(path, directory):
+            raise ValueError(f"Unsafe file name: {msg.file_name!r}")
+
+        os.makedirs(os.path.join(directory, msg.msg_id), exist_ok=True)
+
+        if getter == "get_media":
+            return self.get_media(msg.media_id, path)
+
+        return getattr(self, getter)(msg.msg_id, path)
+
+    def download_msgs(self, msgs, directory):
+        # The media of many messages at the same time, with futures of the
+        # paths by MsgId.
+        return {
+            msg.msg_id: self.download_executor.submit(
+                self.get_msg_media, msg, directory
             )
+            for msg in msgs
+            if msg.msg_type in MEDIA_GETTERS or msg.msg_type == consts.MsgType.APP
+        }
 
-    return r.json()["MediaId"]
+    def download(self, url, path=None, key=None, ranged=False, **kwargs):
+        cache = self.download_cache
+        if not (key and isinstance(path, (str, os.PathLike))):
+            cache = None
 
+        if cache and (cached := cache.get(key)):
+            shutil.copyfile(cached, path)
+            return path
 
-def get_img(msg_id, path):
-    download(f"/cgi-bin/mmwebwx-bin/webwxgetmsgimg?MsgID={msg_id}", path)
+        if ranged and isinstance(path, (str, os.PathLike)):
+            path = self.download_ranges(url, path, **kwargs)
+        else:
+            from requests_toolbelt.downloadutils import stream
 
+            r = self.s.get(url, stream=True, **kwargs)
+            r.raise_for_status()
+            path = stream.stream_response_to_file(r, path, CHUNK_SIZE)
 
-def get_voice(msg_id, path):
-    download(f"/cgi-bin/mmwebwx-bin/webwxgetvoice?msgid={msg_id}", path)
+        if cache:
+            cache.put(key, path)
 
+        return path
 
-def get_video(msg_id, path):
-    download(
-        f"/cgi-bin/mmwebwx-bin/webwxgetvideo?msgid={msg_id}",
-        path,
-        headers={"Range": "bytes=0-"},
-    )
+    def download_ranges(self, url, path, headers=None, **kwargs):
+        # The first range tells the size, and the rest are downloaded at the
+        # same time, each into its place in the file.
+        headers = headers or {}
 
+        r = self.get_range(url, 0, headers, **kwargs)
+        size = range_size(r.status_code, r.headers)
 
-def get_media(media_id, path):
-    filename = os.path.basename(path)
-    download(
-        f"https://file.wx2.qq.com/cgi-bin/mmwebwx-bin/webwxgetmedia?mediaid={media_id}&encryfilename={filename}",
-        path,
-    )
+        with open(path, "wb") as f:
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
+
+            if size is None or size <= RANGE_SIZE:
+                # All of it already, ranges or not.
+                return path
+
+            f.truncate(size)
 
+        futures = [
+            self.range_executor.submit(
+                self.download_range, url, path, start, headers, **kwargs
+            )
+            for start in range(RANGE_SIZE, size, RANGE_SIZE)
+        ]
+        for future in futures:
+            future.result()
+
+        return path
+
+    def download_range(self, url, path, start, headers, **kwargs):
+        r = self.get_range(url, start, headers, **kwargs)
+        if range_size(r.status_code, r.headers) is None:
+            raise requests.HTTPError(
+                f"Expected a partial response, got {r.status_code}", response=r
+            )
 
-def download(url, path=None, **kwargs):
-    r = s.get(url, stream=True, **kwargs)
-    return stream.stream_response_to_file(r, path)
+        with open(path, "r+b") as f:
+            f.seek(start)
+            for chunk in r.iter_content(CHUNK_SIZE):
+                f.write(chunk)
 
+    def get_range(self, url, start, headers, **kwargs):
+        headers = {**headers, "Range": f"bytes={start}-{start + RANGE_SIZE - 1}"}
 
-def mod_remark_name(user_name, remark_name):
-    oplog(
-        {
-            "UserName": user_name,
-            "CmdId": consts.CmdId.MOD_REMARK_NAME,
-            "RemarkName": remark_name,
-        }
-    )
+        r = self.s.get(url, stream=True, headers=headers, **kwargs)
+        r.raise_for_status()
+
+        return r
+
+    def mod_remark_name(self, user_name, remark_name):
+        return self.oplog(
+            {
+                "UserName": user_name,
+                "CmdId": consts.CmdId.MOD_REMARK_NAME,
+                "RemarkName": remark_name,
+            }
+        )
+
+    def set_top_contact(self, user_name, op):
+        return self.oplog(
+            {"UserName": user_name, "CmdId": consts.CmdId.TOP_CONTACT, "OP": op}
+        )
+
+    def oplog(self, data):
+        return self.post_json("/cgi-bin/mmwebwx-bin/webwxoplog", data)
+
+    def create_chat_room(self, members, topic=""):
+        return self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxcreatechatroom",
+            {"MemberCount": len(members), "MemberList": members, "Topic": topic},
+        )["ChatRoomName"]
+
+    def add_members(self, chat_room_name, members):
+        if not isinstance(members, str):
+            members = ",".join(members)
+
+        return self.update_chat_room(
+            "addmember", {"ChatRoomName": chat_room_name, "AddMemberList": members}
+        )
+
+    def del_members(self, chat_room_name, members):
+        if not isinstance(members, str):
+            members = ",".join(members)
+
+        return self.update_chat_room(
+            "delmember", {"ChatRoomName": chat_room_name, "DelMemberList": members}
+        )
+
+    def invite_members(self, chat_room_name, members):
+        if not isinstance(members, str):
+            members = ",".join(members)
+
+        return self.update_chat_room(
+            "invitemember",
+            {"ChatRoomName": chat_room_name, "InviteMemberList": members},
+        )
+
+    def quit_chat_room(self, chat_room_name):
+        return self.update_chat_room("quitchatroom", {"ChatRoomName": chat_room_name})
+
+    def mod_topic(self, chat_room_name, new_topic):
+        return self.update_chat_room(
+            "modtopic", {"ChatRoomName": chat_room_name, "NewTopic": new_topic}
+        )
+
+    def update_chat_room(self, fun, data):
+        return self.post_json(
+            f"/cgi-bin/mmwebwx-bin/webwxupdatechatroom?fun={fun}", data
+        )
+
+    def post_json(self, url, data):
+        payload = {"BaseRequest": self.base_request, **data}
+
+        return self.s.post(
+            url,
+            data=utils.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        ).json()
+
+    def check_url(self, url):
+        r = self.s.get(
+            f"/cgi-bin/mmwebwx-bin/webwxcheckurl?requrl={url}", allow_redirects=False
+        )
+
+        return r.json()["FullURL"]
+
+
+def decode_msg(M, content, ori_content):
+    decode_rendered(M, utils.render(content), ori_content)
+
+
+def decode_rendered(M, x, ori_content):
+    M.sender = M.from_user_name
+    if ori_content is not None:
+        M.ori_content = ori_content
+
+    if M.is_room:
+        m = re.search("^(@[a-z0-9]*):\n(.*)", x)
+        if m:
+            M.sender = m[1]
+            x = m[2]
+
+    match M.msg_type:
+        case consts.MsgType.APP:
+            if M.app_msg_type in consts.AppMsgType:
+                x = utils.parse_xml(unescape(x))
+        case consts.MsgType.EMOTICON:
+            if not M.has_product_id:
+                x = utils.parse_xml(unescape(x))
+        case consts.MsgType.TEXT:
+            if is_news_app(M.from_user_name):
+                x = utils.parse_xml(unescape(x))
+            elif M.sub_msg_type == consts.MsgType.LOCATION:
+                M.location_desc, location_url = x.split(":\n")
+                M.location_url = M.url or location_url
+
+                M.ori_content = utils.parse_xml(ori_content)
+        case consts.MsgType.RECALLED:
+            x = utils.parse_xml(unescape(x))
+        case consts.MsgType.SHARE_CARD:
+            x = utils.parse_xml(unescape(x))
+
+    M.content = x
 
 
-def set_top_contact(user_name, op):
-    oplog({"UserName": user_name, "CmdId": consts.CmdId.TOP_CONTACT, "OP": op})
+def is_file_helper(user_name):
+    return user_name == consts.FILE_HELPER
+
+
+def is_recommend_helper(user_name):
+    return user_name == consts.RECOMMEND_HELPER
+
+
+def is_news_app(user_name):
+    return user_name == consts.NEWS_APP
+
+
+def is_weixin(user_name):
+    return user_name == consts.WEIXIN
+
 
+def report(future):
+    # Nothing waits on background work, so its errors are printed rather
+    # than lost with the future.
+    if not future.cancelled() and (e := future.exception()):
+        traceback.print_exception(e)
 
-def oplog(data):
-    post_json("/cgi-bin/mmwebwx-bin/webwxoplog", data)
 
+def is_inside(path, directory):
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([directory, os.path.realpath(path)]) == directory
 
-def create_chat_room(members, topic=""):
-    return post_json(
-        "/cgi-bin/mmwebwx-bin/webwxcreatechatroom",
-        {"MemberCount": len(members), "MemberList": members, "Topic": topic},
-    )["ChatRoomName"]
 
+def read_chunk(path, chunk):
+    with open(path, "rb") as f:
+        f.seek(chunk * CHUNK_SIZE)
+        return f.read(CHUNK_SIZE)
 
-def add_members(chat_room_name, members):
-    if not isinstance(members, str):
-        members = ",".join(members)
 
-    update_chat_room(
-        "addmember", {"ChatRoomName": chat_room_name, "AddMemberList": members}
-    )
+def retry(func, retries, backoff=RETRY_BACKOFF):
+    for attempt in range(retries):
+        try:
+            return func()
+        except (requests.RequestException, WeChatError):
+            time.sleep(backoff * 2**attempt)
 
+    return func()
 
-def del_members(chat_room_name, members):
-    if not isinstance(members, str):
-        members = ",".join(members)
 
-    update_chat_room(
-        "delmember", {"ChatRoomName": chat_room_name, "DelMemberList": members}
-    )
+def range_size(status, headers):
+    # The full size from a 206's Content-Range, e.g. "bytes 0-1023/4096".
+    if status != 206:
+        return None
 
+    size = headers.get("Content-Range", "").rpartition("/")[2]
 
-def invite_members(chat_room_name, members):
-    if not isinstance(members, str):
-        members = ",".join(members)
+    return int(size) if size.isdigit() else None
 
-    update_chat_room(
-        "invitemember", {"ChatRoomName": chat_room_name, "InviteMemberList": members}
-    )
+
+def guess_media_type(path):
+    ctype, encoding = mimetypes.guess_type(path)
+    if ctype is None or encoding is not None:
+        # No guess could be made, or the file is encoded (compressed), so
+        # use a generic bag-of-bits type.
+        ctype = "application/octet-stream"
+
+    maintype, subtype = ctype.split("/")
+    if maintype == "image" and subtype != "gif":
+        return "pic"
+    if maintype == "video":
+        return "video"
+    return "doc"
 
 
-def quit_chat_room(chat_room_name):
-    update_chat_room("quitchatroom", {"ChatRoomName": chat_room_name})
+# Guards making the default client, wechat.client, which waits for first use
+# so that importing wechat has no side effects.
+client_lock = threading.Lock()
 
 
-def mod_topic(chat_room_name, new_topic):
-    update_chat_room(
-        "modtopic", {"ChatRoomName": chat_room_name, "NewTopic": new_topic}
-    )
+def get_client():
+    with client_lock:
+        if "client" not in globals():
+            globals()["client"] = Client()
 
+        return globals()["client"]
 
-def update_chat_room(fun, data):
-    post_json(f"/cgi-bin/mmwebwx-bin/webwxupdatechatroom?fun={fun}", data)
 
+# Submodules that importing wechat leaves for later. from wechat import
+# pipeline would otherwise get the client's pipeline attribute.
+LAZY_MODULES = {"aio", "dispatch", "fakeserver", "pipeline"}
 
-def post_json(url, data):
-    payload = {"BaseRequest": base_request, **data}
 
-    return s.post(
-        url,
-        data=json.dumps(payload, ensure_ascii=False).encode(),
-        headers={"Content-Type": "application/json"},
-    ).json()
+def __getattr__(name):
+    if name == "client":
+        return get_client()
 
+    if name in LAZY_MODULES:
+        return importlib.import_module(f"{__name__}.{name}")
 
-def check_url(url):
-    r = s.get(f"/cgi-bin/mmwebwx-bin/webwxcheckurl?requrl={url}", allow_redirects=False)
+    # The module-level API (wechat.login(), wechat.send(), wechat.contacts,
+    # ...) is a facade over the default client.
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    return r.json()["FullURL"]
+    return getattr(get_client(), name)
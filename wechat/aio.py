@@ -0,0 +1,685 @@
+import asyncio
+import contextlib
+import re
+import shutil
+import threading
+import time
+from http.cookies import Morsel
+from urllib.parse import urljoin
+
+import aiohttp
+from aiohttp.http_exceptions import BadStatusLine
+from yarl import URL
+
+import wechat
+from wechat import consts, metrics, pipeline, ratelimit, utils
+
+# Shared by every client on a loop, like wechat.adapter. A connector only
+# works on the loop it was made on, so each loop has its own.
+connectors = {}
+
+
+def get_connector():
+    loop = asyncio.get_running_loop()
+
+    for old in [x for x in connectors if x.is_closed()]:
+        del connectors[old]
+
+    connector = connectors.get(loop)
+    if connector is None or connector.closed:
+        connector = connectors[loop] = aiohttp.TCPConnector(limit=100)
+
+    return connector
+
+
+async def close():
+    if "client" in globals():
+        await globals()["client"].close()
+
+    connector = connectors.pop(asyncio.get_running_loop(), None)
+    if connector:
+        await connector.close()
+
+
+def raise_for_json(data):
+    try:
+        content = utils.loads(data)
+    except ValueError:
+        return data.decode()
+
+    if isinstance(content, dict):
+        wechat.check_response(content)
+
+    return content
+
+
+async def body_chunks(r):
+    # Media streams to disk as it arrives. Anything else is read and checked
+    # first, so a JSON error raises before a file is written.
+    if wechat.is_media(r):
+        return r.content.iter_chunked(wechat.CHUNK_SIZE)
+
+    data = await r.read()
+    raise_for_json(data)
+
+    return iter_chunks([data])
+
+
+async def iter_chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class AsyncClient(wechat.Client):
+    def __init__(self, connector=None, **kwargs):
+        super().__init__(**kwargs)
+
+        self.connector = connector
+        self.session = None
+        self.session_loop = None
+
+        # Background batches of webwxbatchgetcontact and contact refreshes,
+        # see create_task.
+        self.batch_tasks = set()
+        self.refresh_task = None
+        self.batch_semaphore = asyncio.Semaphore(wechat.BATCH_WORKERS)
+        self.download_semaphore = asyncio.Semaphore(wechat.DOWNLOAD_WORKERS)
+
+    def get_session(self):
+        # Made again on another loop, keeping the cookies.
+        loop = asyncio.get_running_loop()
+
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            self.session = aiohttp.ClientSession(
+                connector=self.connector or get_connector(),
+                connector_owner=False,
+                headers={"User-Agent": self.s.headers["User-Agent"]},
+                cookie_jar=self.session.cookie_jar if self.session else None,
+            )
+            self.session_loop = loop
+
+        return self.session
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+
+    async def request(self, method, url, **kwargs):
+        endpoint = metrics.endpoint_of(url)
+
+        start = time.perf_counter()
+        async with self.get_session().request(
+            method, urljoin(self.s.base_url, url), **kwargs
+        ) as r:
+            # Until the headers, as with requests' Response.elapsed.
+            self.metrics.observe(endpoint, time.perf_counter() - start)
+
+            data = await r.read()
+
+        body = kwargs.get("data")
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+        self.metrics.count_bytes(endpoint, sent, len(data))
+
+        try:
+            return raise_for_json(data)
+        except wechat.WeChatError as e:
+            self.metrics.count_error(endpoint, e.args[0])
+            raise
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def login(self):
+        if self.restore_session() and await self.check_session():
+            self.clear_contacts()
+            self.load_contacts()
+
+            self.init_chats(list(self.chats))
+            await self.batch_add_contacts()
+
+            self.refresh_task = self.create_task(self.refresh_contacts())
+
+            return self.sync(self.sync_key, self.sync_check_key)
+
+        if self.user:
+            content = await self.get(
+                f"/cgi-bin/mmwebwx-bin/webwxpushloginurl?uin={self.user.uin}"
+            )
+
+            if content["ret"] == "0":
+                uuid = content["uuid"]
+
+                if await self.check_login(uuid):
+                    return await self.init()
+
+        return await self.login_qr()
+
+    async def logout(self):
+        self.shared_user_names.clear()
+
+        return await self.post("/cgi-bin/mmwebwx-bin/webwxlogout")
+
+    async def login_qr(self):
+        text = await self.get(f"{self.login_url}/jslogin?appid=wx782c26e4c19acffb")
+        uuid = re.search('window.QRLogin.uuid = "(.*)"', text)[1]
+
+        utils.print_qr(f"https://login.weixin.qq.com/l/{uuid}")
+
+        if await self.check_login(uuid):
+            return await self.init()
+
+    async def check_login(self, uuid):
+        while True:
+            text = await self.get(
+                f"{self.login_url}/cgi-bin/mmwebwx-bin/login?uuid={uuid}"
+            )
+            code = re.search(r"window.code=(\d+)", text)[1]
+
+            if code == "200":
+                redirect_uri = re.search('window.redirect_uri="(.*)"', text)[1]
+
+                text = await self.get(redirect_uri, allow_redirects=False)
+                self.set_base_request(text)
+
+                return True
+
+            if code == "400":
+                return False
+
+    async def init(self):
+        content = await self.post_json("/cgi-bin/mmwebwx-bin/webwxinit", {})
+
+        sync_key = content["SyncKey"]
+        self.set_user_info(content["User"])
+
+        self.clear_contacts()
+        cached = self.load_contacts()
+
+        self.init_user_names = [x["UserName"] for x in content["ContactList"]]
+        self.add_contacts(content["ContactList"])
+        self.init_chats(content["ChatSet"])
+
+        await self.notify(consts.StatusNotifyCode.INITED, self.user.user_name)
+
+        if cached:
+            self.refresh_task = self.create_task(self.refresh_contacts())
+        else:
+            await self.refresh_contacts()
+
+        return self.sync(sync_key)
+
+    async def get_contacts(self):
+        seq = 0
+        while True:
+            content = await self.get(f"/cgi-bin/mmwebwx-bin/webwxgetcontact?seq={seq}")
+
+            for contact in content["MemberList"]:
+                yield contact
+
+            seq = content["Seq"]
+            if seq == 0:
+                break
+
+    async def refresh_contacts(self):
+        versions = self.contact_cache.versions() if self.contact_cache else {}
+
+        self.apply_contacts([x async for x in self.get_contacts()], versions)
+        await self.batch_add_contacts()
+
+    async def check_session(self):
+        try:
+            await self.post_json(
+                "/cgi-bin/mmwebwx-bin/webwxsync", {"SyncKey": self.sync_key}
+            )
+        except wechat.WeChatError:
+            return False
+
+        return True
+
+    def cookie_jar(self):
+        # Outside the loop too, once there is a session, as save_session can
+        # be.
+        if self.session is None:
+            return self.get_session().cookie_jar
+
+        return self.session.cookie_jar
+
+    def get_cookies(self):
+        return [
+            {"name": m.key, "value": m.value, "domain": m["domain"], "path": m["path"]}
+            for m in self.cookie_jar()
+        ]
+
+    def set_cookies(self, cookies):
+        for cookie in cookies:
+            m = Morsel()
+            m.set(cookie["name"], cookie["value"], cookie["value"])
+            m["domain"] = cookie["domain"]
+            m["path"] = cookie["path"]
+
+            self.cookie_jar().update_cookies(
+                {m.key: m}, URL(f"https://{cookie['domain'].lstrip('.')}/")
+            )
+
+    async def sync(self, sync_key, sync_check_key=None):
+        self.sync_key = sync_key
+        self.sync_check_key = sync_check_key or sync_key
+
+        self.save_session()
+
+        while True:
+            try:
+                text = await self.get(
+                    f"{self.push_url}/cgi-bin/mmwebwx-bin/synccheck",
+                    params=self.sync_check_params(self.sync_check_key),
+                )
+            except aiohttp.ClientResponseError as e:
+                if not is_bad_status_line(e):  # HTTP/1.1 0 -\r\n
+                    raise
+
+                continue
+
+            m = re.search('window.synccheck={retcode:"(.*)",selector:"(.*)"}', text)
+
+            if m[1] != "0":
+                await self.logout()
+                return
+
+            msgs = []
+
+            if m[2] != "0":
+                content = await self.post_json(
+                    "/cgi-bin/mmwebwx-bin/webwxsync", {"SyncKey": self.sync_key}
+                )
+
+                self.sync_check_key = content["SyncCheckKey"]
+                self.sync_key = content["SyncKey"]
+
+                msgs = self.process_sync(content)
+
+                await self.batch_add_contacts(background=True)
+
+            yield msgs
+
+            if self.pipeline is None:
+                self.save_session()
+
+    async def run(self, msgs, handler, **kwargs):
+        await pipeline.AsyncPipeline(handler, client=self, **kwargs).run(msgs)
+
+    async def batch_add_contacts(self, background=False):
+        users = list(self.users.values())
+        self.users.clear()
+
+        if not users:
+            return
+
+        if background:
+            self.create_task(self.fetch_contacts(users))
+        else:
+            await self.fetch_contacts(users)
+
+    def create_task(self, coro):
+        # Kept until done, as the loop only keeps a weak reference.
+        task = asyncio.create_task(coro)
+        self.batch_tasks.add(task)
+        task.add_done_callback(self.batch_tasks.discard)
+        task.add_done_callback(wechat.report)
+
+        return task
+
+    async def fetch_contacts(self, users):
+        size = wechat.BATCH_SIZE
+
+        async def fetch(batch):
+            # Shared by every round, like the sync client's batch workers.
+            async with self.batch_semaphore:
+                try:
+                    contacts = await self.batch_get_contacts(batch)
+                except (aiohttp.ClientError, wechat.WeChatError):
+                    self.requeue(batch)
+                else:
+                    self.add_contacts(contacts)
+
+        await asyncio.gather(
+            *(fetch(users[i : i + size]) for i in range(0, len(users), size))
+        )
+
+    async def batch_get_contacts(self, users):
+        content = await self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxbatchgetcontact",
+            {"Count": len(users), "List": users},
+        )
+
+        return content["ContactList"]
+
+    async def send_file(self, path, to_user_name):
+        key = self.media_cache.key(path, wechat.guess_media_type(path))
+
+        media_id = self.media_cache.get(key)
+        if media_id:
+            try:
+                return await self.send_media(path, media_id, to_user_name)
+            except wechat.WeChatError as e:
+                if e.args[0] not in wechat.MEDIA_ID_REJECTED:
+                    raise
+
+        media_id = await self.cache_upload(path, to_user_name, key=key, stale=media_id)
+
+        return await self.send_media(path, media_id, to_user_name)
+
+    async def cache_upload(self, path, to_user_name, key=None, stale=None):
+        key = key or self.media_cache.key(path, wechat.guess_media_type(path))
+
+        async with self.locked_upload(key):
+            media_id = self.media_cache.get(key)
+
+            if media_id is not None and media_id == stale:
+                self.media_cache.discard(key)
+                media_id = None
+
+            if media_id is None:
+                media_id = await self.upload(path, to_user_name)
+                self.media_cache.set(key, media_id)
+
+        return media_id
+
+    @contextlib.asynccontextmanager
+    async def locked_upload(self, key):
+        # On the loop, so without upload_lock.
+        entry = self.upload_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.upload_locks[key]
+
+    async def broadcast(
+        self,
+        to_user_names,
+        content=None,
+        path=None,
+        workers=wechat.BROADCAST_WORKERS,
+        rate=wechat.BROADCAST_RATE,
+        max_failures=None,
+    ):
+        bucket = ratelimit.TokenBucket(rate)
+        semaphore = asyncio.Semaphore(workers)
+
+        results = {}
+        failures = 0
+
+        async def send(to_user_name):
+            nonlocal failures
+
+            async with semaphore:
+                if max_failures and failures >= max_failures:
+                    results[to_user_name] = wechat.BroadcastAborted(to_user_name)
+                    return
+
+                await asyncio.sleep(bucket.reserve())
+
+                try:
+                    if path is None:
+                        results[to_user_name] = await self.send(content, to_user_name)
+                    else:
+                        results[to_user_name] = await self.send_file(path, to_user_name)
+                except (aiohttp.ClientError, wechat.WeChatError) as e:
+                    results[to_user_name] = e
+                    failures += 1
+                else:
+                    failures = 0
+
+        if path is not None and to_user_names:
+            await self.cache_upload(path, to_user_names[0])
+
+        await asyncio.gather(*map(send, to_user_names))
+
+        return results
+
+    async def post_msg(self, url, msg):
+        content = await self.post_json(url, self.msg_payload(msg))
+
+        return content["MsgID"]
+
+    async def notify(self, code, to_user_name):
+        content = await self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxstatusnotify",
+            self.notify_payload(code, to_user_name),
+        )
+
+        return content["MsgID"]
+
+    async def upload(
+        self,
+        path,
+        to_user_name,
+        client_media_id=None,
+        workers=wechat.UPLOAD_WORKERS,
+        retries=wechat.UPLOAD_RETRIES,
+        progress=None,
+    ):
+        client_media_id = client_media_id or time.time_ns()
+        upload = self.new_upload(path, to_user_name, client_media_id)
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def upload_chunk(chunk):
+            async with semaphore:
+                data = wechat.read_chunk(path, chunk)
+
+                with self.metrics.time("upload_chunk"):
+                    content = await retry(
+                        lambda: self.upload_media(upload, chunk, data), retries
+                    )
+            upload["done"].add(chunk)
+            upload["media_id"] = content.get("MediaId")
+
+            if progress:
+                progress(len(upload["done"]), upload["chunks"])
+
+            return content
+
+        if not upload["pending"]:
+            del self.uploads[client_media_id]
+            return upload["media_id"]
+
+        *chunks, last = upload["pending"]
+
+        try:
+            await asyncio.gather(*map(upload_chunk, chunks))
+
+            content = await upload_chunk(last)
+        except Exception as e:
+            e.client_media_id = client_media_id
+            raise
+
+        del self.uploads[client_media_id]
+
+        return content["MediaId"]
+
+    async def upload_media(self, upload, chunk, data):
+        form = aiohttp.FormData()
+        form.add_field("chunks", str(upload["chunks"]))
+        form.add_field("chunk", str(chunk))
+        form.add_field("mediatype", upload["media_type"])
+        form.add_field("uploadmediarequest", upload["upload_media_request"])
+        form.add_field("filename", data, filename=upload["filename"])
+
+        return await self.post(
+            f"{self.file_url}/cgi-bin/mmwebwx-bin/webwxuploadmedia?f=json",
+            data=form,
+        )
+
+    async def get_msg_media(self, msg, directory):
+        res = super().get_msg_media(msg, directory)
+        if res is None:
+            return None
+
+        async with self.download_semaphore:
+            return await res
+
+    async def download_msgs(self, msgs, directory):
+        # The paths, or what went wrong, by MsgId.
+        msgs = [
+            msg
+            for msg in msgs
+            if msg.msg_type in wechat.MEDIA_GETTERS
+            or msg.msg_type == consts.MsgType.APP
+        ]
+
+        res = await asyncio.gather(
+            *(self.get_msg_media(msg, directory) for msg in msgs),
+            return_exceptions=True,
+        )
+
+        return {msg.msg_id: x for msg, x in zip(msgs, res)}
+
+    async def download(self, url, path, key=None, ranged=False, **kwargs):
+        cache = self.download_cache if key else None
+
+        if cache and (cached := cache.get(key)):
+            await asyncio.to_thread(shutil.copyfile, cached, path)
+            return path
+
+        if ranged:
+            await self.download_ranges(url, path, **kwargs)
+        else:
+            async with self.get_session().get(
+                urljoin(self.s.base_url, url), raise_for_status=True, **kwargs
+            ) as r:
+                chunks = await body_chunks(r)
+
+                with open(path, "wb") as f:
+                    async for chunk in chunks:
+                        f.write(chunk)
+
+        if cache:
+            await asyncio.to_thread(cache.put, key, path)
+
+        return path
+
+    async def download_ranges(self, url, path, headers=None, **kwargs):
+        headers = headers or {}
+
+        async with self.get_range(url, 0, headers, **kwargs) as r:
+            size = wechat.range_size(r.status, r.headers)
+            chunks = await body_chunks(r)
+
+            with open(path, "wb") as f:
+                async for chunk in chunks:
+                    f.write(chunk)
+
+                if size is None or size <= wechat.RANGE_SIZE:
+                    return path
+
+                f.truncate(size)
+
+        await asyncio.gather(
+            *(
+                self.download_range(url, path, start, headers, **kwargs)
+                for start in range(wechat.RANGE_SIZE, size, wechat.RANGE_SIZE)
+            )
+        )
+
+        return path
+
+    async def download_range(self, url, path, start, headers, **kwargs):
+        async with self.get_range(url, start, headers, **kwargs) as r:
+            if wechat.range_size(r.status, r.headers) is None:
+                raise aiohttp.ClientResponseError(
+                    r.request_info,
+                    r.history,
+                    status=r.status,
+                    message="Expected a partial response",
+                )
+
+            chunks = await body_chunks(r)
+
+            with open(path, "r+b") as f:
+                f.seek(start)
+                async for chunk in chunks:
+                    f.write(chunk)
+
+    def get_range(self, url, start, headers, **kwargs):
+        end = start + wechat.RANGE_SIZE - 1
+
+        return self.get_session().get(
+            urljoin(self.s.base_url, url),
+            headers={**headers, "Range": f"bytes={start}-{end}"},
+            raise_for_status=True,
+            **kwargs,
+        )
+
+    async def create_chat_room(self, members, topic=""):
+        content = await self.post_json(
+            "/cgi-bin/mmwebwx-bin/webwxcreatechatroom",
+            {"MemberCount": len(members), "MemberList": members, "Topic": topic},
+        )
+
+        return content["ChatRoomName"]
+
+    async def post_json(self, url, data):
+        payload = {"BaseRequest": self.base_request, **data}
+
+        return await self.post(
+            url,
+            data=utils.dumps(payload),
+            headers={"Content-Type": "application/json"},
+        )
+
+    async def check_url(self, url):
+        content = await self.get(
+            f"/cgi-bin/mmwebwx-bin/webwxcheckurl?requrl={url}", allow_redirects=False
+        )
+
+        return content["FullURL"]
+
+
+async def retry(func, retries, backoff=wechat.RETRY_BACKOFF):
+    for attempt in range(retries):
+        try:
+            return await func()
+        except (aiohttp.ClientError, wechat.WeChatError):
+            await asyncio.sleep(backoff * 2**attempt)
+
+    return await func()
+
+
+def is_bad_status_line(e):
+    while e is not None:
+        if isinstance(e, BadStatusLine):
+            return True
+
+        e = e.__cause__
+
+    return False
+
+
+# The default client, aio.client, made on first use like wechat.client.
+client_lock = threading.Lock()
+
+
+def get_client():
+    with client_lock:
+        if "client" not in globals():
+            globals()["client"] = AsyncClient()
+
+        return globals()["client"]
+
+
+def __getattr__(name):
+    if name == "client":
+        return get_client()
+
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return getattr(get_client(), name)
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+class MediaCache:
+    def __init__(self, maxsize=1024, ttl=24 * 60 * 60, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+        # (path, mtime, size) -> sha256, also least recently used first.
+        self.digests = OrderedDict()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.entries.update(json.load(f))
+
+    def key(self, path, media_type):
+        st = os.stat(path)
+
+        # Broadcasts send the same file many times, so only hash it again
+        # when it has changed.
+        stamp = (os.fspath(path), st.st_mtime_ns, st.st_size)
+
+        with self.lock:
+            digest = self.digests.get(stamp)
+            if digest:
+                self.digests.move_to_end(stamp)
+
+        if not digest:
+            with open(path, "rb") as f:
+                digest = hashlib.file_digest(f, "sha256").hexdigest()
+
+            with self.lock:
+                self.digests[stamp] = digest
+
+                while len(self.digests) > self.maxsize:
+                    self.digests.popitem(last=False)
+
+        return f"{media_type}:{digest}"
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            media_id, expires = self.entries[key]
+            if expires < time.time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+
+            return media_id
+
+    def set(self, key, media_id):
+        with self.lock:
+            self.entries[key] = (media_id, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+            self.save()
+
+    def discard(self, key):
+        with self.lock:
+            if self.entries.pop(key, None):
+                self.save()
+
+    def save(self):
+        if self.path:
+            tmp = f"{self.path}.tmp"
+
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+
+            os.replace(tmp, self.path)
+
+
+class DiskCache:
+    # Downloaded media by key, in files under path, least recently used
+    # first. Once the files add up to more than maxsize bytes, the least
+    # recently used ones are removed. Their mtimes keep the order across
+    # processes.
+
+    def __init__(self, path, maxsize=1024 * 1024 * 1024):
+        self.path = path
+        self.maxsize = maxsize
+
+        os.makedirs(path, exist_ok=True)
+
+        self.lock = threading.Lock()
+
+        # File name -> size.
+        self.entries = OrderedDict()
+        self.size = 0
+
+        files = [x for x in os.scandir(path) if not x.name.endswith(".tmp")]
+        for entry in sorted(files, key=lambda x: x.stat().st_mtime_ns):
+            self.entries[entry.name] = entry.stat().st_size
+            self.size += self.entries[entry.name]
+
+    def file(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+
+        return name, os.path.join(self.path, name)
+
+    def get(self, key):
+        name, file = self.file(key)
+
+        with self.lock:
+            if name not in self.entries:
+                return None
+
+            self.entries.move_to_end(name)
+            os.utime(file)
+
+            return file
+
+    def put(self, key, path):
+        name, file = self.file(key)
+
+        tmp = f"{file}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, file)
+
+        with self.lock:
+            self.size -= self.entries.pop(name, 0)
+            self.entries[name] = os.path.getsize(file)
+            self.size += self.entries[name]
+
+            # Always keeps the newest, however big.
+            while self.size > self.maxsize and len(self.entries) > 1:
+                old, size = self.entries.popitem(last=False)
+                self.size -= size
+                os.remove(os.path.join(self.path, old))
+
+
+class SeenMsgs:
+    # The ids of the messages seen in the last ttl seconds, at most maxsize
+    # of them, oldest first, so that a message sync returns again after a
+    # reconnect or an older SyncKey is dropped. Each check is a dict lookup,
+    # and expired entries are popped from the front as it goes.
+    #
+    # Each message is numbered, so that a checkpoint can dump only what was
+    # seen before it. With persist, the Client saves them with the session.
+
+    def __init__(self, maxsize=10000, ttl=24 * 60 * 60, persist=False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+
+        self.lock = threading.Lock()
+        # id -> (time, mark)
+        self.entries = OrderedDict()
+        self.mark = 0
+
+    def seen(self, *ids):
+        # Whether any of ids was seen, remembering them if not.
+        ids = [str(x) for x in ids if x]
+        now = time.time()
+
+        with self.lock:
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest[0] > now - self.ttl:
+                    break
+
+                self.entries.popitem(last=False)
+
+            if any(x in self.entries for x in ids):
+                return True
+
+            self.mark += 1
+            for x in ids:
+                self.entries[x] = (now, self.mark)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+            return False
+
+    def dump(self, mark=None):
+        # [[id, time]], of those seen up to mark.
+        with self.lock:
+            return [
+                [x, t]
+                for x, (t, m) in self.entries.items()
+                if mark is None or m <= mark
+            ]
+
+    def load(self, entries):
+        with self.lock:
+            self.entries.clear()
+            for x, t in entries:
+                self.entries[x] = (t, 0)
+
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
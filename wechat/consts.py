@@ -30,6 +30,13 @@ class AppMsgType(IntEnum):
     TRANSFERS = 2000
 
 
+class Ret(IntEnum):
+    OK = 0
+    FAILED = 1  # what sending a MediaId the server no longer has gets
+    LOGGED_OUT = 1101
+    TOO_FREQUENT = 1205
+
+
 class MediaType(IntEnum):
     ATTACHMENT = 4
 
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import wait
+
+import wechat
+
+# What a handler can be registered by, in the order of a route's key.
+FIELDS = ("msg_type", "app_msg_type", "is_room", "peer_user_name")
+
+
+class Dispatcher:
+    # Routes messages to the handlers registered for them. Each handler is
+    # filed under a key of the fields it was registered by, with None for
+    # the rest, so a message costs one lookup per combination of fields in
+    # use rather than a test per handler.
+    #
+    #     dispatcher = Dispatcher()
+    #
+    #     @dispatcher.on(msg_type=consts.MsgType.TEXT, is_room=False)
+    #     def reply(msg): ...
+    #
+    #     client.run(client.login(), dispatcher)
+    #
+    # With an executor, the handlers of a message run at the same time, and
+    # the call returns once they all have, raising the first error, so a
+    # pipeline still keeps a peer's messages in order and checkpoints after
+    # them. With wait=False it returns the futures instead, and errors are
+    # printed; a pipeline refuses such a dispatcher.
+
+    def __init__(self, executor=None, wait=True):
+        self.executor = executor
+        self.wait = wait
+
+        # key -> [(order, handler)]
+        self.routes = {}
+        # Which fields each key sets, e.g. (True, False, True, False).
+        self.patterns = set()
+        self.order = itertools.count()
+
+        # handler -> [calls, total seconds, max seconds]
+        self.lock = threading.Lock()
+        self.timings = {}
+
+    def on(self, msg_type=None, app_msg_type=None, is_room=None, peer=None):
+        key = (msg_type, app_msg_type, is_room, peer)
+
+        def register(handler):
+            self.routes.setdefault(key, []).append((next(self.order), handler))
+            self.patterns.add(tuple(x is not None for x in key))
+
+            return handler
+
+        return register
+
+    def handlers(self, msg):
+        values = tuple(getattr(msg, field, None) for field in FIELDS)
+
+        matches = []
+        for pattern in self.patterns:
+            key = tuple(v if used else None for v, used in zip(values, pattern))
+            matches += self.routes.get(key, ())
+
+        # In the order they were registered.
+        return [handler for order, handler in sorted(matches, key=lambda x: x[0])]
+
+    def __call__(self, msg):
+        if self.executor is None:
+            return [self.run(handler, msg) for handler in self.handlers(msg)]
+
+        futures = [
+            self.executor.submit(self.run, handler, msg)
+            for handler in self.handlers(msg)
+        ]
+
+        if not self.wait:
+            for f in futures:
+                f.add_done_callback(wechat.report)
+            return futures
+
+        wait(futures)
+
+        return [f.result() for f in futures]
+
+    def run(self, handler, msg):
+        start = time.perf_counter()
+        try:
+            return handler(msg)
+        finally:
+            self.time(handler, time.perf_counter() - start)
+
+    def time(self, handler, t):
+        with self.lock:
+            timing = self.timings.setdefault(handler, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += t
+            timing[2] = max(timing[2], t)
+
+    def stats(self):
+        # {handler: {"calls", "total", "mean", "max"}}
+        with self.lock:
+            return {
+                handler: {
+                    "calls": calls,
+                    "total": total,
+                    "mean": total / calls,
+                    "max": max_,
+                }
+                for handler, (calls, total, max_) in self.timings.items()
+            }
+
+
+class AsyncDispatcher(Dispatcher):
+    # The same for AsyncClient. Coroutine handlers run concurrently on the
+    # loop, and plain ones on the executor, if there is one.
+
+    async def __call__(self, msg):
+        return await asyncio.gather(
+            *(self.run(handler, msg) for handler in self.handlers(msg))
+        )
+
+    async def run(self, handler, msg):
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(handler):
+                return await handler(msg)
+
+            if self.executor is None:
+                return handler(msg)
+
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, handler, msg)
+        finally:
+            self.time(handler, time.perf_counter() - start)
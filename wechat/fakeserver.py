@@ -0,0 +1,517 @@
+import argparse
+import collections
+import itertools
+import json
+import random
+import string
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from wechat import consts
+
+# A stand-in for the WeChat web servers, for load testing and trying the
+# client against something that behaves like them: long-polled synccheck,
+# rotating SyncKeys, the "HTTP/1.1 0" status line, chunked uploads and
+# ranged downloads, with room messages made at a steady rate.
+#
+#     with FakeServer(rate=100) as server:
+#         client = wechat.Client(**server.urls())
+#         msgs = client.login()
+#
+# Or on its own, with python -m wechat.fakeserver.
+
+OK = {"Ret": 0, "ErrMsg": ""}
+
+# Pending messages past which the oldest are dropped.
+MAX_PENDING = 100_000
+
+CONTACT_PAGE = 1000
+
+# What the media endpoints send, repeated to the size asked for.
+PATTERN = bytes(range(256)) * 256
+
+MEDIA_TYPES = {
+    "webwxgetmsgimg": "image/jpeg",
+    "webwxgetvoice": "audio/mp3",
+    "webwxgetvideo": "video/mp4",
+    "webwxgetmedia": "application/octet-stream",
+    "webwxgeticon": "image/jpeg",
+    "webwxgetheadimg": "image/jpeg",
+}
+
+
+class Response:
+    def __init__(self, body=b"", status=200, headers=None, size=None):
+        # body is bytes or an iterable of them, in which case size is their
+        # total length.
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.size = len(body) if size is None else size
+
+
+# The BadStatusLine quirk.
+BAD_STATUS = object()
+
+
+class FakeServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        contacts=100,
+        rooms=10,
+        members=20,
+        rate=10.0,
+        batch=100,
+        poll_timeout=25.0,
+        bad_status_every=0,
+        media_size=1024 * 1024,
+        seed=None,
+    ):
+        # rate: messages a second, over all rooms.
+        # batch: the most messages one webwxsync answers with.
+        # bad_status_every: every how many synccheck requests answer with
+        # "HTTP/1.1 0", or never with 0.
+        self.rate = rate
+        self.batch = batch
+        self.poll_timeout = poll_timeout
+        self.bad_status_every = bad_status_every
+        self.media_size = media_size
+
+        self.random = random.Random(seed)
+
+        self.user = self.contact()
+        self.contacts = [self.contact() for _ in range(contacts)]
+        self.rooms = [self.room(members) for _ in range(rooms)]
+        self.by_user_name = {x["UserName"]: x for x in self.contacts + self.rooms}
+
+        self.cond = threading.Condition()
+        self.pending = collections.deque(maxlen=MAX_PENDING)
+        self.ids = itertools.count(1)
+        self.sync_key = {1: 1, 2: 1, 3: 1, 1000: int(time.time())}
+        self.synccheck_count = 0
+
+        # ClientMediaId -> chunks received
+        self.uploads = {}
+        # The Msg of every send
+        self.sent = []
+
+        self.stopped = threading.Event()
+        self.threads = []
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+
+        self.url = f"http://{host}:{self.httpd.server_port}"
+
+    def urls(self):
+        # For wechat.Client(**server.urls()).
+        return {
+            "base_url": self.url,
+            "login_url": self.url,
+            "push_url": self.url,
+            "file_url": self.url,
+        }
+
+    def start(self):
+        self.threads = [
+            threading.Thread(target=self.httpd.serve_forever, daemon=True),
+            threading.Thread(target=self.produce, daemon=True),
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+        with self.cond:
+            self.cond.notify_all()
+
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def name(self, room=False):
+        return ("@@" if room else "@") + "%064x" % self.random.getrandbits(256)
+
+    def word(self):
+        return "".join(self.random.choices(string.ascii_lowercase, k=8))
+
+    def contact(self, room=False):
+        user_name = self.name(room)
+
+        return {
+            "UserName": user_name,
+            "NickName": self.word(),
+            "HeadImgUrl": f"/cgi-bin/mmwebwx-bin/webwxgeticon?username={user_name}",
+            "ContactFlag": 3,
+            "MemberCount": 0,
+            "MemberList": [],
+            "RemarkName": "",
+            "Sex": 0,
+            "Signature": "",
+            "VerifyFlag": 0,
+            "StarFriend": 0,
+            "Statues": 0,
+            "AttrStatus": 0,
+            "Province": "",
+            "City": "",
+            "SnsFlag": 0,
+            "DisplayName": "",
+            "KeyWord": "",
+            "EncryChatRoomId": "",
+            "IsOwner": 0,
+        }
+
+    def room(self, members):
+        room = self.contact(room=True)
+
+        pool = self.contacts + [self.user]
+        room["MemberList"] = [
+            {
+                "UserName": x["UserName"],
+                "NickName": x["NickName"],
+                "AttrStatus": 0,
+                "MemberStatus": 0,
+                "DisplayName": "",
+                "KeyWord": "",
+            }
+            for x in self.random.sample(pool, min(members, len(pool)))
+        ]
+        room["MemberCount"] = len(room["MemberList"])
+        room["EncryChatRoomId"] = self.name()[:33]
+
+        return room
+
+    def msg(self, content=None, from_user_name=None):
+        room = self.random.choice(self.rooms)
+        sender = self.random.choice(room["MemberList"])["UserName"]
+        msg_id = next(self.ids)
+
+        return {
+            "MsgId": str(msg_id),
+            "FromUserName": from_user_name or room["UserName"],
+            "ToUserName": self.user["UserName"],
+            "MsgType": consts.MsgType.TEXT,
+            "Content": content or f"{sender}:<br/>{self.word()} {msg_id}",
+            "Status": 3,
+            "ImgStatus": 1,
+            "CreateTime": int(time.time()),
+            "VoiceLength": 0,
+            "PlayLength": 0,
+            "FileName": "",
+            "FileSize": "",
+            "MediaId": "",
+            "Url": "",
+            "AppMsgType": 0,
+            "StatusNotifyCode": 0,
+            "StatusNotifyUserName": "",
+            "ForwardFlag": 0,
+            "AppInfo": {"AppID": "", "Type": 0},
+            "HasProductId": 0,
+            "Ticket": "",
+            "ImgHeight": 0,
+            "ImgWidth": 0,
+            "SubMsgType": 0,
+            "NewMsgId": msg_id,
+            "OriContent": "",
+        }
+
+    def push(self, *msgs):
+        # Messages for the next webwxsync, besides the ones made at rate.
+        with self.cond:
+            self.pending.extend(msgs)
+            self.cond.notify_all()
+
+    def produce(self):
+        if not self.rate:
+            return
+
+        interval = 1 / self.rate
+        due = time.monotonic()
+
+        while not self.stopped.is_set():
+            self.push(self.msg())
+
+            due += interval
+            self.stopped.wait(max(0, due - time.monotonic()))
+
+    def sync_key_json(self):
+        return {
+            "Count": len(self.sync_key),
+            "List": [{"Key": k, "Val": v} for k, v in self.sync_key.items()],
+        }
+
+    def handle(self, method, name, query, headers, body):
+        handler = getattr(self, f"on_{name}", None)
+        if handler:
+            return handler(query=query, headers=headers, body=body)
+
+        if name in MEDIA_TYPES:
+            return self.media(name, headers)
+
+        if method == "POST" and name.startswith("webwx"):
+            # statusnotify, oplog, logout and the like.
+            return {"BaseResponse": OK, "MsgID": str(next(self.ids))}
+
+        return Response(b"not found", status=404)
+
+    def on_jslogin(self, **kwargs):
+        return 'window.QRLogin.code = 200; window.QRLogin.uuid = "fake=="'
+
+    def on_login(self, **kwargs):
+        redirect_uri = f"{self.url}/cgi-bin/mmwebwx-bin/webwxnewloginpage?ticket=fake"
+
+        return f'window.code=200;\nwindow.redirect_uri="{redirect_uri}";'
+
+    def on_webwxnewloginpage(self, **kwargs):
+        return (
+            "<error><ret>0</ret><message></message><skey>@crypt_fake</skey>"
+            "<wxsid>fake</wxsid><wxuin>1217252163</wxuin>"
+            "<pass_ticket>fake</pass_ticket><isgrayscale>1</isgrayscale></error>"
+        )
+
+    def on_webwxinit(self, **kwargs):
+        chats = self.rooms[:10] + self.contacts[:10]
+
+        with self.cond:
+            sync_key = self.sync_key_json()
+
+        return {
+            "BaseResponse": OK,
+            "Count": len(chats),
+            "ContactList": chats,
+            "SyncKey": sync_key,
+            "User": {**self.user, "Uin": 1217252163},
+            "ChatSet": ",".join(x["UserName"] for x in chats),
+        }
+
+    def on_webwxgetcontact(self, query, **kwargs):
+        # Rooms come without their members, as they do from WeChat.
+        contacts = self.contacts + [{**x, "MemberList": []} for x in self.rooms]
+
+        seq = int(query.get("seq", 0))
+        page = contacts[seq : seq + CONTACT_PAGE]
+        seq += CONTACT_PAGE
+
+        return {
+            "BaseResponse": OK,
+            "MemberCount": len(page),
+            "MemberList": page,
+            "Seq": seq if seq < len(contacts) else 0,
+        }
+
+    def on_webwxbatchgetcontact(self, body, **kwargs):
+        users = json.loads(body)["List"]
+        contacts = [
+            self.by_user_name[x["UserName"]]
+            for x in users
+            if x["UserName"] in self.by_user_name
+        ]
+
+        return {"BaseResponse": OK, "Count": len(contacts), "ContactList": contacts}
+
+    def on_synccheck(self, **kwargs):
+        with self.cond:
+            self.synccheck_count += 1
+
+            if self.bad_status_every and (
+                self.synccheck_count % self.bad_status_every == 0
+            ):
+                return BAD_STATUS
+
+            # Long-polls until there are messages.
+            deadline = time.monotonic() + self.poll_timeout
+            while not self.pending and not self.stopped.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                self.cond.wait(remaining)
+
+            selector = "2" if self.pending else "0"
+
+        return f'window.synccheck={{retcode:"0",selector:"{selector}"}}'
+
+    def on_webwxsync(self, **kwargs):
+        with self.cond:
+            n = min(len(self.pending), self.batch)
+            msgs = [self.pending.popleft() for _ in range(n)]
+
+            self.sync_key[1] += 1
+            self.sync_key[1000] = int(time.time())
+            sync_key = self.sync_key_json()
+
+        return {
+            "BaseResponse": OK,
+            "AddMsgCount": len(msgs),
+            "AddMsgList": msgs,
+            "ModContactCount": 0,
+            "ModContactList": [],
+            "DelContactCount": 0,
+            "DelContactList": [],
+            "ModChatRoomMemberCount": 0,
+            "ModChatRoomMemberList": [],
+            "Profile": {},
+            "ContinueFlag": 0,
+            "SyncKey": sync_key,
+            "SKey": "",
+            "SyncCheckKey": sync_key,
+        }
+
+    def on_send(self, body, **kwargs):
+        with self.cond:
+            self.sent.append(json.loads(body)["Msg"])
+
+        msg_id = str(next(self.ids))
+
+        return {"BaseResponse": OK, "MsgID": msg_id, "LocalID": msg_id}
+
+    on_webwxsendmsg = on_send
+    on_webwxsendmsgimg = on_send
+    on_webwxsendvideomsg = on_send
+    on_webwxsendappmsg = on_send
+    on_webwxsendemoticon = on_send
+
+    def on_webwxuploadmedia(self, headers, body, **kwargs):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        fields = {
+            part.get_param("name", header="content-disposition"): part.get_payload(
+                decode=True
+            )
+            for part in message.iter_parts()
+        }
+
+        request = json.loads(fields["uploadmediarequest"])
+        client_media_id = request["ClientMediaId"]
+
+        with self.cond:
+            chunks = self.uploads.setdefault(client_media_id, set())
+            chunks.add(int(fields["chunk"]))
+            done = len(chunks) == int(fields["chunks"])
+
+        # The MediaId only comes with the last chunk.
+        return {
+            "BaseResponse": OK,
+            "MediaId": f"@crypt_{client_media_id}" if done else "",
+            "StartPos": request["TotalLen"] if done else 0,
+        }
+
+    def media(self, name, headers):
+        size = self.media_size
+        start, end = 0, size - 1
+        status = 200
+        response_headers = {"Content-Type": MEDIA_TYPES[name]}
+
+        if "Range" in headers:
+            first, _, last = headers["Range"].removeprefix("bytes=").partition("-")
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+            status = 206
+            response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+        return Response(
+            media_body(start, end + 1),
+            status=status,
+            headers=response_headers,
+            size=end + 1 - start,
+        )
+
+
+def media_body(start, stop):
+    # PATTERN, repeated, from start to stop, a slice at a time.
+    while start < stop:
+        offset = start % len(PATTERN)
+        n = min(len(PATTERN) - offset, stop - start)
+
+        yield PATTERN[offset : offset + n]
+
+        start += n
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def route(self, method):
+        url = urlparse(self.path)
+        name = url.path.rpartition("/")[2]
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        res = self.server.fake.handle(method, name, query, self.headers, body)
+
+        if res is BAD_STATUS:
+            self.wfile.write(b"HTTP/1.1 0 -\r\n\r\n")
+            self.close_connection = True
+            return
+
+        if isinstance(res, dict):
+            res = Response(
+                json.dumps(res).encode(), headers={"Content-Type": "text/plain"}
+            )
+        elif isinstance(res, str):
+            res = Response(res.encode(), headers={"Content-Type": "text/javascript"})
+
+        self.send_response(res.status)
+        for k, v in res.headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(res.size))
+        self.end_headers()
+
+        if isinstance(res.body, bytes):
+            self.wfile.write(res.body)
+        else:
+            for chunk in res.body:
+                self.wfile.write(chunk)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m wechat.fakeserver")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--contacts", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=10.0, help="messages/s")
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--poll-timeout", type=float, default=25.0)
+    parser.add_argument("--bad-status-every", type=int, default=0)
+    parser.add_argument("--media-size", type=int, default=1024 * 1024)
+    args = parser.parse_args()
+
+    with FakeServer(**vars(args)) as server:
+        print(f"wechat.Client(**{server.urls()})")
+
+        try:
+            server.stopped.wait()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import bisect
+import collections
+import contextlib
+import threading
+import time
+from urllib.parse import urlparse
+
+# Upper bounds of the latency buckets, in seconds. synccheck long-polls for
+# about 25 seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        # Per bucket, and the last for anything slower.
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        res = {}
+        for le, n in zip((*BUCKETS, "+Inf"), self.counts):
+            total += n
+            res[str(le)] = total
+
+        return res
+
+
+class Metrics:
+    # Latency by endpoint or operation, messages by MsgType, bytes by
+    # endpoint and WeChatError Ret codes by endpoint. Recording is a few
+    # dict updates under a lock, cheap enough to leave on.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.latency = collections.defaultdict(Histogram)
+        self.msgs = collections.Counter()
+        # (endpoint, "in" or "out") -> bytes
+        self.bytes = collections.Counter()
+        # (endpoint, Ret) -> count
+        self.errors = collections.Counter()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.latency[name].observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count_msgs(self, msg_types):
+        with self.lock:
+            self.msgs.update(msg_types)
+
+    def count_bytes(self, endpoint, sent, received):
+        with self.lock:
+            self.bytes[endpoint, "out"] += sent
+            self.bytes[endpoint, "in"] += received
+
+    def count_error(self, endpoint, ret):
+        with self.lock:
+            self.errors[endpoint, ret] += 1
+
+    def on_response(self, r, *args, stream=False, **kwargs):
+        # A requests response hook. A streamed body is not read here, so
+        # its size is what the headers say.
+        endpoint = endpoint_of(r.url)
+
+        if stream:
+            received = int(r.headers.get("Content-Length", 0))
+        else:
+            received = len(r.content)
+
+        body = r.request.body
+        sent = len(body) if isinstance(body, (bytes, str)) else 0
+
+        with self.lock:
+            self.latency[endpoint].observe(r.elapsed.total_seconds())
+            self.bytes[endpoint, "out"] += sent
+            self.bytes[endpoint, "in"] += received
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "latency": {
+                    name: {"count": h.count, "sum": h.sum, "buckets": h.cumulative()}
+                    for name, h in self.latency.items()
+                },
+                "msgs": dict(self.msgs),
+                "bytes": {f"{e} {d}": n for (e, d), n in self.bytes.items()},
+                "errors": {f"{e} {ret}": n for (e, ret), n in self.errors.items()},
+            }
+
+    def prometheus(self):
+        # The text exposition format, for a /metrics endpoint.
+        lines = []
+
+        with self.lock:
+            lines.append("# TYPE wechat_latency_seconds histogram")
+            for name, h in self.latency.items():
+                for le, n in h.cumulative().items():
+                    lines.append(
+                        f'wechat_latency_seconds_bucket{{name="{name}",le="{le}"}} {n}'
+                    )
+                lines.append(f'wechat_latency_seconds_sum{{name="{name}"}} {h.sum}')
+                lines.append(f'wechat_latency_seconds_count{{name="{name}"}} {h.count}')
+
+            lines.append("# TYPE wechat_msgs_total counter")
+            for msg_type, n in self.msgs.items():
+                lines.append(f'wechat_msgs_total{{msg_type="{int(msg_type)}"}} {n}')
+
+            lines.append("# TYPE wechat_bytes_total counter")
+            for (endpoint, direction), n in self.bytes.items():
+                lines.append(
+                    f'wechat_bytes_total{{endpoint="{endpoint}",direction="{direction}"}} {n}'
+                )
+
+            lines.append("# TYPE wechat_errors_total counter")
+            for (endpoint, ret), n in self.errors.items():
+                lines.append(
+                    f'wechat_errors_total{{endpoint="{endpoint}",ret="{ret}"}} {n}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def endpoint_of(url):
+    return urlparse(str(url)).path.rpartition("/")[2]
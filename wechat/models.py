@@ -4,26 +4,67 @@ from wechat import utils
 
 
 class Base:
+    __slots__ = ()
+
     def __init_subclass__(cls):
         cls.hints = typing.get_type_hints(cls)
 
+        cls.converters = {name: converter(name, typ) for name, typ in cls.hints.items()}
+
+        # CamelCase key -> (attribute, converter), or None for keys that
+        # are not fields. Filled in as keys are first seen.
+        cls.decoders = {}
+
+    @classmethod
+    def decoder(cls, key):
+        name = utils.to_snake(key)
+
+        if name in cls.converters:
+            return name, cls.converters[name]
+
     def update(self, d):
+        decoders = self.decoders
+
         for key, value in d.items():
-            key = utils.to_snake(key)
+            try:
+                decoder = decoders[key]
+            except KeyError:
+                decoder = decoders[key] = self.decoder(key)
 
-            if key in self.hints:
-                typ = self.hints[key]
+            if decoder:
+                name, convert = decoder
+                setattr(self, name, convert(value))
 
-                if typing.get_origin(typ) is list:
-                    args = typing.get_args(typ)
-                    if args:
-                        value = list(map(args[0], value))
-                else:
-                    value = typ(value)
+    __init__ = update
 
-                setattr(self, key, value)
+    def changed(self, d):
+        # Whether update(d) would change any field.
+        decoders = self.decoders
 
-    __init__ = update
+        for key, value in d.items():
+            try:
+                decoder = decoders[key]
+            except KeyError:
+                decoder = decoders[key] = self.decoder(key)
+
+            if decoder:
+                name, convert = decoder
+                if getattr(self, name, None) != convert(value):
+                    return True
+
+        return False
+
+
+def converter(name, typ):
+    if typing.get_origin(typ) is list:
+        args = typing.get_args(typ)
+        if args:
+            item = args[0]
+            return lambda value: list(map(item, value))
+
+        return lambda value: value
+
+    return typ
 
 
 class User(Base):
@@ -37,17 +78,57 @@ class User(Base):
 
 
 class Member(Base):
+    __slots__ = (
+        "user_name",
+        "nick_name",
+        "attr_status",
+        "display_name",
+        "key_word",
+        "is_me",
+        "chat_room_id",
+    )
+
     user_name: str
     nick_name: str
     attr_status: int
     display_name: str
     key_word: str
 
+    @property
+    def head_img_url(self):
+        return utils.get_head_img_url(self.user_name, chat_room_id=self.chat_room_id)
+
 
 class Contact(Member):
+    __slots__ = (
+        "head_img_url",
+        "contact_flag",
+        "members",
+        "remark_name",
+        "sex",
+        "signature",
+        "verify_flag",
+        "star_friend",
+        "statues",
+        "province",
+        "city",
+        "sns_flag",
+        "encry_chat_room_id",
+        "is_owner",
+        "chat_room_owner",
+        "is_room",
+        "is_file_helper",
+        "is_recommend_helper",
+        "is_news_app",
+        "is_black",
+        "is_brand",
+        "is_muted",
+        "is_top",
+        "has_photo_album",
+    )
+
     head_img_url: str
     contact_flag: int
-    member_list: list[Member]
     remark_name: str
     sex: int
     signature: str
@@ -59,8 +140,59 @@ class Contact(Member):
     sns_flag: int
     encry_chat_room_id: str
     is_owner: int
+    chat_room_owner: str
+
+    def __init__(self, d):
+        self.chat_room_owner = ""
+        self.members = {}
+        self.update(d)
+
+    @property
+    def member_list(self):
+        return list(self.members.values())
+
+    def update(self, d):
+        chat_room_id = getattr(self, "encry_chat_room_id", "")
+        super().update(d)
+
+        # Nor does the empty EncryChatRoomId that comes with it.
+        if chat_room_id and not d.get("EncryChatRoomId"):
+            self.encry_chat_room_id = chat_room_id
+
+        # An empty list, as webwxgetcontact sends for every room, says
+        # nothing about who is in it.
+        if d.get("MemberList"):
+            return self.update_members(d["MemberList"])
+
+    def update_members(self, member_list):
+        # Members by user name, so that a room update only builds the ones
+        # that joined and updates the ones that changed.
+        members = {}
+        added = []
+        changed = []
+
+        for d in member_list:
+            m = self.members.pop(d["UserName"], None)
 
-    chat_room_owner: str = ""
+            if m is None:
+                m = Member(d)
+                added.append(m)
+            elif m.changed(d):
+                m.update(d)
+                changed.append(m)
+
+            members[m.user_name] = m
+
+        removed = list(self.members.values())
+        self.members = members
+
+        return MemberDiff(added, removed, changed)
+
+
+class MemberDiff(typing.NamedTuple):
+    added: list[Member]
+    removed: list[Member]
+    changed: list[Member]
 
 
 class RecommendInfo(Base):
@@ -113,3 +245,19 @@ class Msg(Base):
     sub_msg_type: int
     new_msg_id: int
     ori_content: str
+
+    def __getattr__(self, name):
+        decode = self.__dict__.pop("lazy_decode", None)
+        if decode is None:
+            raise AttributeError(
+                f"{type(self).__name__!r} object has no attribute {name!r}"
+            )
+
+        try:
+            decode(self)
+        except BaseException:
+            # Left to raise the same error again on the next read.
+            self.lazy_decode = decode
+            raise
+
+        return getattr(self, name)
@@ -0,0 +1,276 @@
+import asyncio
+import collections
+import queue
+import threading
+import traceback
+
+from wechat.dispatch import Dispatcher
+
+WORKERS = 4
+MAXSIZE = 1000
+
+# What the poller does when a worker's queue is full.
+BLOCK = "block"  # wait for room, which holds up the next synccheck
+DROP_NEWEST = "drop_newest"  # drop the message that does not fit
+DROP_OLDEST = "drop_oldest"  # drop the oldest queued message to make room
+
+OVERFLOWS = (BLOCK, DROP_NEWEST, DROP_OLDEST)
+
+
+class Pipeline:
+    # Polls sync in its own thread, so that a slow handler does not hold up
+    # the next synccheck, and hands messages to a pool of workers. All the
+    # messages of a peer go to the same worker, which keeps them in order.
+    #
+    # With a client, the session is checkpointed once every message of a
+    # batch, and of the batches before it, has been handled or dropped.
+
+    def __init__(
+        self,
+        handler,
+        client=None,
+        workers=WORKERS,
+        maxsize=MAXSIZE,
+        overflow=BLOCK,
+        on_error=None,
+    ):
+        if overflow not in OVERFLOWS:
+            raise ValueError(f"overflow must be one of {OVERFLOWS}")
+
+        # Its handlers would outlive the worker, out of order and after the
+        # checkpoint, with their errors lost to on_error.
+        if isinstance(handler, Dispatcher) and not handler.wait:
+            raise ValueError("a Dispatcher must wait for its handlers")
+
+        self.handler = handler
+        self.client = client
+        self.overflow = overflow
+        self.on_error = on_error
+
+        self.queues = [queue.Queue(maxsize) for _ in range(workers)]
+        self.threads = []
+
+        self.stopped = threading.Event()
+        self.error = None
+
+        # [messages not yet done, sync keys] for each batch, oldest first.
+        self.lock = threading.Lock()
+        self.batches = collections.deque()
+
+        self.dropped = 0
+        self.errors = 0
+
+    def run(self, msgs):
+        self.start(msgs)
+        self.join()
+
+    def start(self, msgs):
+        if self.client:
+            self.client.pipeline = self
+
+        self.threads = [
+            threading.Thread(target=self.work, args=(q,), daemon=True)
+            for q in self.queues
+        ]
+        self.threads.append(
+            threading.Thread(target=self.poll, args=(msgs,), daemon=True)
+        )
+
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        # The poller stops after the synccheck in progress.
+        self.stopped.set()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+        self.finish()
+
+    def finish(self):
+        if self.client:
+            self.client.pipeline = None
+
+        if self.error:
+            raise self.error
+
+    def poll(self, msgs):
+        try:
+            for batch in msgs:
+                self.put_batch(batch)
+
+                if self.stopped.is_set():
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            for q in self.queues:
+                q.put(None)
+
+            close = getattr(msgs, "close", None)
+            if close:
+                close()
+
+    def put_batch(self, batch):
+        entry = self.new_batch(batch)
+
+        for msg in batch:
+            self.put((entry, msg))
+
+    def new_batch(self, batch):
+        keys = None
+        if self.client:
+            keys = self.client.checkpoint()
+
+        entry = [len(batch), keys]
+
+        with self.lock:
+            self.batches.append(entry)
+
+        if not batch:
+            self.done(entry, 0)
+
+        return entry
+
+    def done(self, entry, n=1):
+        with self.lock:
+            entry[0] -= n
+
+            keys = None
+            while self.batches and self.batches[0][0] == 0:
+                keys = self.batches.popleft()[1]
+
+            if keys and self.client:
+                self.client.save_session(keys)
+
+    def queue_of(self, item):
+        entry, msg = item
+
+        return self.queues[hash(msg.peer_user_name) % len(self.queues)]
+
+    def put(self, item):
+        q = self.queue_of(item)
+
+        if self.overflow == BLOCK:
+            q.put(item)
+            return
+
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except queue.Full:
+                self.dropped += 1
+
+                if self.overflow == DROP_NEWEST:
+                    self.done(item[0])
+                    return
+
+            try:
+                self.done(q.get_nowait()[0])
+            except queue.Empty:
+                pass
+
+    def work(self, q):
+        while (item := q.get()) is not None:
+            entry, msg = item
+
+            try:
+                self.handler(msg)
+            except Exception as e:
+                self.fail(msg, e)
+            finally:
+                self.done(entry)
+
+    def fail(self, msg, e):
+        self.errors += 1
+
+        if self.on_error:
+            self.on_error(msg, e)
+        else:
+            traceback.print_exception(e)
+
+
+class AsyncPipeline(Pipeline):
+    # The same with tasks, for AsyncClient. The handler may be a coroutine
+    # function.
+
+    def __init__(self, handler, workers=WORKERS, maxsize=MAXSIZE, **kwargs):
+        super().__init__(handler, workers=0, **kwargs)
+
+        self.queues = [asyncio.Queue(maxsize) for _ in range(workers)]
+        self.tasks = []
+
+    async def run(self, msgs):
+        self.start(msgs)
+        await self.join()
+
+    def start(self, msgs):
+        if self.client:
+            self.client.pipeline = self
+
+        self.tasks = [asyncio.create_task(self.work(q)) for q in self.queues]
+        self.tasks.append(asyncio.create_task(self.poll(msgs)))
+
+    async def join(self):
+        await asyncio.gather(*self.tasks)
+
+        self.finish()
+
+    async def poll(self, msgs):
+        try:
+            async for batch in msgs:
+                entry = self.new_batch(batch)
+
+                for msg in batch:
+                    await self.put((entry, msg))
+
+                if self.stopped.is_set():
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            for q in self.queues:
+                await q.put(None)
+
+            aclose = getattr(msgs, "aclose", None)
+            if aclose:
+                await aclose()
+
+    async def put(self, item):
+        q = self.queue_of(item)
+
+        if self.overflow == BLOCK:
+            await q.put(item)
+            return
+
+        while True:
+            try:
+                q.put_nowait(item)
+                return
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+                if self.overflow == DROP_NEWEST:
+                    self.done(item[0])
+                    return
+
+            try:
+                self.done(q.get_nowait()[0])
+            except asyncio.QueueEmpty:
+                pass
+
+    async def work(self, q):
+        while (item := await q.get()) is not None:
+            entry, msg = item
+
+            try:
+                res = self.handler(msg)
+                if asyncio.iscoroutine(res):
+                    await res
+            except Exception as e:
+                self.fail(msg, e)
+            finally:
+                self.done(entry)
@@ -0,0 +1,26 @@
+import threading
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        # Takes a token, and returns how long to wait before using it.
+        with self.lock:
+            now = time.monotonic()
+
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            self.tokens -= 1
+
+            return max(0, -self.tokens / self.rate)
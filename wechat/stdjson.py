@@ -0,0 +1,12 @@
+import json
+
+# The standard library behind orjson's interface, for utils.JSON_BACKENDS:
+# dumps() to UTF-8 bytes, loads() from bytes or str.
+
+
+def dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def loads(data):
+    return json.loads(data)
@@ -0,0 +1,269 @@
+import bisect
+import hashlib
+import json
+import sqlite3
+import threading
+
+from wechat.utils import is_room_contact
+
+NAMES = ("nick_name", "remark_name", "display_name")
+FLAGS = ("is_room", "is_top", "is_muted", "is_brand", "is_black")
+
+# What webwxgetcontact leaves empty for rooms, and only webwxbatchgetcontact
+# sends.
+BATCH_ONLY = ("MemberList", "EncryChatRoomId")
+
+
+class ContactStore(dict):
+    # A dict of contacts by UserName, with indexes that Client.add_contact
+    # keeps up to date through index().
+
+    def __init__(self):
+        super().__init__()
+
+        # Taken by the queries below and by whatever changes the contacts.
+        self.lock = threading.RLock()
+
+        # field -> value -> user names
+        self.names = {field: {} for field in NAMES}
+        # field -> sorted values, rebuilt when a prefix search needs it
+        self.sorted_names = {}
+        # flag -> user names it is set for
+        self.flags = {flag: set() for flag in FLAGS}
+        # member user name -> rooms
+        self.rooms = {}
+
+        # user name -> the names and flags it is currently indexed under
+        self.indexed = {}
+
+    def index(self, c, diff=None):
+        # diff is the MemberDiff of the update, if it had members.
+        with self.lock:
+            names = tuple(getattr(c, field, "") for field in NAMES)
+            flags = tuple(flag for flag in FLAGS if getattr(c, flag, False))
+
+            if c.user_name in self.indexed:
+                old_names, old_flags = self.indexed[c.user_name]
+
+                added = [m.user_name for m in diff.added] if diff else ()
+                removed = [m.user_name for m in diff.removed] if diff else ()
+            else:
+                old_names, old_flags = (), ()
+
+                added = getattr(c, "members", ())
+                removed = ()
+
+            if (names, flags) != (old_names, old_flags):
+                self.unindex_names(c.user_name, old_names, old_flags)
+
+                for field, value in zip(NAMES, names):
+                    if value:
+                        self.names[field].setdefault(value, set()).add(c.user_name)
+                        self.sorted_names.pop(field, None)
+
+                for flag in flags:
+                    self.flags[flag].add(c.user_name)
+
+            for member in added:
+                self.rooms.setdefault(member, set()).add(c.user_name)
+
+            for member in removed:
+                discard(self.rooms, member, c.user_name)
+
+            self.indexed[c.user_name] = names, flags
+
+    def unindex(self, user_name):
+        # Before the contact is removed, as its members are what it is
+        # indexed under in rooms.
+        if user_name not in self.indexed:
+            return
+
+        names, flags = self.indexed.pop(user_name)
+
+        self.unindex_names(user_name, names, flags)
+
+        for member in getattr(self[user_name], "members", ()):
+            discard(self.rooms, member, user_name)
+
+    def unindex_names(self, user_name, names, flags):
+        for field, value in zip(NAMES, names):
+            if value:
+                discard(self.names[field], value, user_name)
+                self.sorted_names.pop(field, None)
+
+        for flag in flags:
+            self.flags[flag].discard(user_name)
+
+    def __delitem__(self, user_name):
+        with self.lock:
+            self.unindex(user_name)
+            super().__delitem__(user_name)
+
+    def pop(self, user_name, *args):
+        with self.lock:
+            self.unindex(user_name)
+            return super().pop(user_name, *args)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+
+            for index in self.names.values():
+                index.clear()
+            self.sorted_names.clear()
+            for index in self.flags.values():
+                index.clear()
+            self.rooms.clear()
+            self.indexed.clear()
+
+    def find(self, **fields):
+        # Exact match, e.g. find(nick_name="udavis").
+        with self.lock:
+            return self.lookup(
+                self.names[field].get(value, ()) for field, value in fields.items()
+            )
+
+    def search(self, **fields):
+        # Prefix match, e.g. search(remark_name="Mark").
+        with self.lock:
+            return self.lookup(
+                self.prefixed(field, prefix) for field, prefix in fields.items()
+            )
+
+    def filter(self, **flags):
+        # e.g. filter(is_room=True, is_muted=False)
+        with self.lock:
+            return self.lookup(
+                self.flags[flag] if value else self.keys() - self.flags[flag]
+                for flag, value in flags.items()
+            )
+
+    def rooms_of(self, user_name):
+        with self.lock:
+            return [self[x] for x in self.rooms.get(user_name, ())]
+
+    def prefixed(self, field, prefix):
+        if field not in self.sorted_names:
+            self.sorted_names[field] = sorted(self.names[field])
+
+        values = self.sorted_names[field]
+        res = set()
+
+        for i in range(bisect.bisect_left(values, prefix), len(values)):
+            if not values[i].startswith(prefix):
+                break
+
+            res |= self.names[field][values[i]]
+
+        return res
+
+    def lookup(self, matches):
+        res = None
+
+        for user_names in matches:
+            res = set(user_names) if res is None else res.intersection(user_names)
+
+        return [self[x] for x in res or ()]
+
+
+def discard(index, key, user_name):
+    user_names = index[key]
+    user_names.discard(user_name)
+
+    if not user_names:
+        del index[key]
+
+
+class ContactCache:
+    # Contacts as the server sent them, with a version per contact, in
+    # SQLite.
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS contacts"
+            " (user_name TEXT PRIMARY KEY, version TEXT, data TEXT)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+    def claim(self, owner):
+        # Whether the contacts are owner's. If they are someone else's, they
+        # are cleared, and the cache is owner's from then on.
+        owner = str(owner)
+
+        with self.lock, self.db:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'owner'")
+            row = row.fetchone()
+            if row and row[0] == owner:
+                return True
+
+            self.db.execute("DELETE FROM contacts")
+            self.db.execute("REPLACE INTO meta VALUES ('owner', ?)", (owner,))
+
+            return False
+
+    def load(self):
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM contacts").fetchall()
+
+        return [json.loads(data) for data, in rows]
+
+    def versions(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT user_name, version FROM contacts"))
+
+    def put(self, contacts):
+        with self.lock, self.db:
+            rows = [
+                (x["UserName"], version(x), json.dumps(x, ensure_ascii=False))
+                for x in map(self.with_members, contacts)
+            ]
+
+            self.db.executemany("REPLACE INTO contacts VALUES (?, ?, ?)", rows)
+
+    def with_members(self, contact):
+        # webwxgetcontact lists rooms without their members, so those cached
+        # from webwxbatchgetcontact are kept, with the EncryChatRoomId.
+        if contact.get("MemberList") or not is_room_contact(contact["UserName"]):
+            return contact
+
+        row = self.db.execute(
+            "SELECT data FROM contacts WHERE user_name = ?", (contact["UserName"],)
+        ).fetchone()
+        if row is None:
+            return contact
+
+        cached = json.loads(row[0])
+
+        return {
+            **contact,
+            **{
+                k: cached[k] for k in BATCH_ONLY if cached.get(k) and not contact.get(k)
+            },
+        }
+
+    def delete(self, user_names):
+        rows = [(x,) for x in user_names]
+
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM contacts WHERE user_name = ?", rows)
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM contacts")
+
+    def close(self):
+        self.db.close()
+
+
+def version(contact):
+    # Without what only webwxbatchgetcontact sends, so that a room from
+    # webwxgetcontact has the version it was cached with.
+    contact = {k: v for k, v in contact.items() if k not in BATCH_ONLY}
+    data = json.dumps(contact, sort_keys=True, ensure_ascii=False).encode()
+
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
@@ -1,26 +1,66 @@
+import importlib
 import re
 
-import qrcode
-import xmltodict
+from wechat import stdjson, xmldict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def to_snake(s):
     return re.sub("(?<=[^_])((?=[A-Z][a-z])|(?<=[^A-Z])(?=[A-Z]))", "_", s).lower()
 
 
-def render(s):
-    def repl(m):
-        code = m[1]
+EMOJI_RE = re.compile('<br/>|<span class="emoji emoji(.*?)"></span>')
+
+EMOJI_TABLE_SIZE = 4096
+
+
+class EmojiTable(dict):
+    # Code -> Unicode sequence, each computed the first time the web client
+    # sends it. <br/> matches with no code.
+    #
+    # Codes come from message content, so only canonical ones are kept, and
+    # no more than EMOJI_TABLE_SIZE of them.
+    def __missing__(self, code):
+        canonical = code.lstrip("0") or "0"
+        if canonical != code:
+            return self[canonical]
 
         if is_keycap(code):
-            return hexchr(code[:2]) + "\ufe0f\u20e3"
-        if is_flag(code):
-            return hexchr(code[:5]) + hexchr(code[5:])
+            x = hexchr(code[:2]) + "\ufe0f\u20e3"
+        elif is_flag(code):
+            x = hexchr(code[:5]) + hexchr(code[5:])
+        else:
+            x = hexchr(code)
+
+        if len(self) < EMOJI_TABLE_SIZE:
+            self[code] = x
+
+        return x
 
-        return hexchr(code)
 
-    s = s.replace("<br/>", "\n")
-    return re.sub('<span class="emoji emoji(.*?)"></span>', repl, s)
+emoji_table = EmojiTable({None: "\n"})
+
+
+def render(s):
+    if "<" not in s:
+        return s
+
+    return EMOJI_RE.sub(lambda m: emoji_table[m[1]], s)
+
+
+def render_all(strings):
+    # The contents of a whole AddMsgList, with the lookups done once.
+    sub = EMOJI_RE.sub
+    table = emoji_table
+
+    def repl(m):
+        return table[m[1]]
+
+    return [s if "<" not in s else sub(repl, s) for s in strings]
 
 
 def is_keycap(code):
@@ -35,15 +75,68 @@ def hexchr(x):
     return chr(int(x, base=16))
 
 
+def get_head_img_url(user_name, chat_room_id=""):
+    if is_room_contact(user_name):
+        url = "/cgi-bin/mmwebwx-bin/webwxgetheadimg"
+    else:
+        url = "/cgi-bin/mmwebwx-bin/webwxgeticon"
+
+    url += f"?username={user_name}"
+    if chat_room_id:
+        url += f"&chatroomid={chat_room_id}"
+
+    return url
+
+
+def is_room_contact(user_name):
+    return user_name.startswith("@@")
+
+
 def print_qr(data):
+    import qrcode
+
     qr = qrcode.QRCode()
     qr.add_data(data)
     qr.print_ascii()
 
 
+# Any module with xmltodict's parse() and unparse() will do. Imported when
+# picked, so that xmltodict is only loaded for those who want it.
+XML_BACKENDS = {"xmldict": "wechat.xmldict", "xmltodict": "xmltodict"}
+
+xml_backend = xmldict
+
+
+def set_xml_backend(name):
+    global xml_backend
+    xml_backend = importlib.import_module(XML_BACKENDS[name])
+
+
 def parse_xml(xml):
-    return xmltodict.parse(xml)
+    return xml_backend.parse(xml)
 
 
 def to_xml(d):
-    return xmltodict.unparse(d, full_document=False)
+    return xml_backend.unparse(d, full_document=False)
+
+
+# Any module with orjson's dumps() to bytes and loads() from bytes will do.
+# Both raise ValueError on what they cannot handle.
+JSON_BACKENDS = {"json": stdjson}
+if orjson:
+    JSON_BACKENDS["orjson"] = orjson
+
+json_backend = orjson or stdjson
+
+
+def set_json_backend(name):
+    global json_backend
+    json_backend = JSON_BACKENDS[name]
+
+
+def dumps(obj):
+    return json_backend.dumps(obj)
+
+
+def loads(data):
+    return json_backend.loads(data)
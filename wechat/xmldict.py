@@ -0,0 +1,127 @@
+from xml.parsers import expat
+from xml.sax.saxutils import escape, quoteattr
+
+# A drop-in for the parts of xmltodict that wechat uses, building the dicts
+# straight from expat callbacks instead of through a generic SAX handler.
+
+
+def parse(xml):
+    if isinstance(xml, str):
+        xml = xml.encode()
+
+    stack = []
+    item = None
+    data = []
+
+    def start(name, attrs):
+        nonlocal item, data
+
+        stack.append((item, data))
+
+        if attrs:
+            item = {"@" + attrs[i]: attrs[i + 1] for i in range(0, len(attrs), 2)}
+        else:
+            item = None
+        data = []
+
+    def end(name):
+        nonlocal item, data
+
+        text = "".join(data).strip() or None if data else None
+        value = item
+        item, data = stack.pop()
+
+        if value is not None:
+            if text:
+                push(value, "#text", text)
+        else:
+            value = text
+
+        if item is None:
+            item = {}
+        push(item, name, value)
+
+    def characters(text):
+        data.append(text)
+
+    def forbid_entities(*args):
+        raise ValueError("entities are disabled")
+
+    parser = expat.ParserCreate("utf-8")
+    parser.ordered_attributes = True
+    parser.buffer_text = True
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = characters
+    parser.EntityDeclHandler = forbid_entities
+    parser.Parse(xml, True)
+
+    return item
+
+
+def push(item, key, value):
+    if key in item:
+        existing = item[key]
+        if isinstance(existing, list):
+            existing.append(value)
+        else:
+            item[key] = [existing, value]
+    else:
+        item[key] = value
+
+
+def unparse(d, full_document=True):
+    out = []
+
+    if full_document:
+        if len(d) != 1:
+            raise ValueError("Document must have exactly one root.")
+
+        out.append('<?xml version="1.0" encoding="utf-8"?>\n')
+
+    for key, value in d.items():
+        emit(key, value, out)
+
+    return "".join(out)
+
+
+def emit(key, value, out):
+    if not isinstance(value, list):
+        value = [value]
+
+    for v in value:
+        if v is None:
+            v = {}
+        elif isinstance(v, bool):
+            v = {"#text": "true" if v else "false"}
+        elif not isinstance(v, dict):
+            v = {"#text": str(v)}
+
+        text = None
+        attrs = []
+        children = []
+
+        for k, x in v.items():
+            if k == "#text":
+                text = None if x is None else to_str(x)
+            elif k.startswith("@"):
+                attrs.append(f" {k[1:]}={quoteattr('' if x is None else to_str(x))}")
+            elif x != []:
+                children.append((k, x))
+
+        out.append(f"<{key}{''.join(attrs)}>")
+
+        for k, x in children:
+            emit(k, x, out)
+
+        if text is not None:
+            out.append(escape(text))
+
+        out.append(f"</{key}>")
+
+
+def to_str(x):
+    if isinstance(x, bool):
+        return "true" if x else "false"
+
+    return str(x)